@@ -13,6 +13,12 @@ if __name__ == "__main__":
         help="Clear cache of Python modules autogenerated from CellML")
     parser.add_argument("--clear", action="store_true", 
         help="Clear all caches")
+    parser.add_argument("--prebuild", nargs="+", metavar="MODEL", 
+        help="Generate and compile code for CellML models, e.g. before "
+        "a cluster run. MODEL is a cellml.org workspace name, a URL, a path "
+        "to a CellML file, or a model bundled with cgp, e.g. fitzhugh_1961")
+    parser.add_argument("--bench-import", action="store_true", 
+        help="Time imports of core modules against their budgets")
 
     if len(sys.argv) == 1:
         parser.print_help()
@@ -30,3 +36,10 @@ if __name__ == "__main__":
         from cgp.physmod.cellmlmodel import cgp_tempdir
         print "Clearing " + cgp_tempdir
         shutil.rmtree(cgp_tempdir)
+    if args.prebuild:
+        from cgp.physmod.cellmlmodel import prebuild
+        for model in args.prebuild:
+            print "Built %s in %s" % (model, prebuild(model))
+    if args.bench_import:
+        from cgp.utils.importtime import bench_import
+        sys.exit(0 if bench_import() else 1)
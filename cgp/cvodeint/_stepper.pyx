@@ -0,0 +1,74 @@
+"""
+Compiled adaptive-step loop for :meth:`Cvodeint._integrate_adaptive_steps`.
+
+Selected with ``Cvodeint(..., stepper="native")``. The driver calls CVode()
+directly with task CV_ONE_STEP_TSTOP and copies each step into preallocated
+output buffers, without a round trip through ctypes and Python per step.
+
+Buffer growth, exceptions and logging remain in Python: :func:`step` returns
+whenever the buffers are full, *maxsteps* is reached, a root is found, the
+stop time is reached, or CVode returns an error flag.
+
+The GIL is released for each CVode() call. The right-hand side callback 
+reacquires it on entry; a compiled CellML model releases it again while 
+computing rates (see :mod:`cgp.physmod.cythonize`). Thus solvers for 
+different models can step concurrently in threads of one process.
+"""
+
+import numpy as np
+cimport numpy as np
+
+cdef extern from "sundials/sundials_nvector.h":
+    ctypedef struct _generic_N_Vector
+    ctypedef _generic_N_Vector* N_Vector
+
+cdef extern from "cvode/cvode.h" nogil:
+    int CVode(void *cvode_mem, double tout, N_Vector yout, double *tret,
+              int itask)
+    int CV_SUCCESS, CV_TSTOP_RETURN, CV_ROOT_RETURN, CV_ONE_STEP_TSTOP
+
+# Status codes returned by step()
+DONE, FULL, MAXSTEPS, ERROR = range(4)
+
+def step(size_t cvode_mem, size_t yout, size_t ydata, size_t ptret,
+         double tstop,
+         np.ndarray[np.double_t, ndim=1] t, np.ndarray[np.double_t, ndim=2] Y,
+         int i, double maxsteps, flag):
+    """
+    Take CVODE steps towards *tstop*, writing into ``t[i:]`` and ``Y[i:]``.
+
+    :param cvode_mem: Address of the CVODE solver memory.
+    :param yout: Address of the solver's N_Vector.
+    :param ydata: Address of the N_Vector's data array.
+    :param ptret: Address of the realtype receiving the time reached.
+    :param i: Index of the first unused row of *t* and *Y*.
+    :param flag: Flag of the previous call, returned unchanged if no step
+        is taken.
+    :return: i, flag, status; where *i* is the number of rows filled and
+        *status* is one of DONE, FULL, MAXSTEPS, ERROR.
+    """
+    cdef double *tret = <double*> ptret
+    cdef double *y = <double*> ydata
+    cdef int n = Y.shape[1]
+    cdef int d1 = Y.shape[0]
+    cdef int j, iflag
+    while tret[0] < tstop:
+        if i >= maxsteps:
+            return i, flag, MAXSTEPS
+        if i >= d1:
+            return i, flag, FULL
+        with nogil:
+            iflag = CVode(<void*> cvode_mem, tstop, <N_Vector> yout, tret,
+                          CV_ONE_STEP_TSTOP)
+        flag = iflag
+        if (iflag == CV_SUCCESS) or (iflag == CV_TSTOP_RETURN) or (
+            iflag == CV_ROOT_RETURN):
+            for j in range(n):
+                Y[i, j] = y[j]
+            t[i] = tret[0]
+            i += 1
+            if iflag == CV_ROOT_RETURN:
+                return i, flag, DONE
+        else:
+            return i, flag, ERROR
+    return i, CV_TSTOP_RETURN, DONE
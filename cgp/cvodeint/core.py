@@ -32,12 +32,16 @@ doctests. A replacement for :func:`scipy.integrate.odeint` is in module
 """
 
 import traceback
+import textwrap
+import time
+import copy
 import ctypes  # required for communicating with cvode
 from pysundials import cvode
 import numpy as np
 import logging
 
-__all__ = "CvodeException", "Cvodeint", "flags", "cvodefun"
+__all__ = ("CvodeException", "Cvodeint", "flags", "cvodefun", "bandwidth", 
+    "detect_sparsity", "color_columns", "ColoredJacobian", "SolverStats")
 
 # cdef inline double* bufarr(x):
 #     """Fast access to internal data of ndarray"""
@@ -62,6 +66,27 @@ del cv_
 
 nv = cvode.NVector # CVODE vector data type
 
+def _native_stepper():
+    """
+    Import the compiled stepping driver :mod:`cgp.cvodeint._stepper`.
+    
+    The extension is built with :mod:`pyximport` on first use. Returns None 
+    (with a warning) if Cython, a C compiler, or the SUNDIALS headers 
+    are unavailable.
+    """
+    try:
+        from cgp.cvodeint import _stepper
+    except ImportError:
+        try:
+            import pyximport
+            pyximport.install()
+            from cgp.cvodeint import _stepper
+        except Exception, exc:  # pylint: disable=W0703
+            log.warning("Native stepper unavailable, using Python loop: %s", 
+                exc)
+            return None
+    return _stepper
+
 
 class CvodeException(StandardError):
     """
@@ -86,6 +111,143 @@ class CvodeException(StandardError):
         super(CvodeException, self).__init__(message)
         self.result = result
 
+class OutputArena(object):
+    """
+    Reusable output buffers for adaptive time steps, with geometric growth.
+    
+    Each :class:`Cvodeint` owns one arena, so repeated calls to 
+    :meth:`Cvodeint.integrate` write into the same memory instead of 
+    allocating fresh arrays. When full, the buffers are replaced by new ones 
+    *factor* times larger, so the number of reallocations grows only 
+    logarithmically with the number of steps. 
+    
+    :meth:`result` returns copies by default. Views (``copy=False``) are 
+    overwritten by the next call that writes into the same buffers, i.e. 
+    the next :meth:`Cvodeint.integrate`; only views of buffers that have 
+    since been replaced by :meth:`grow` keep their contents.
+    
+    >>> arena = OutputArena(n=2, size=4)
+    >>> arena.t[:3] = 0, 1, 2
+    >>> t, Y = arena.grow(3)
+    >>> t.shape, Y.shape, arena.ngrow
+    ((8,), (8, 2), 1)
+    >>> t[:3]
+    array([ 0.,  1.,  2.])
+    """
+    def __init__(self, n, size=2000, factor=2):
+        self.n = n
+        self.factor = factor
+        size = max(2, int(size)) # room for initial state and one step
+        self.t = np.empty(shape=(size,))
+        self.Y = np.empty(shape=(size, n))
+        self.ngrow = 0 # number of times the buffers were enlarged
+    
+    def __repr__(self):
+        return "%s(n=%s, size=%s, factor=%s) with ngrow=%s" % (
+            self.__class__.__name__, self.n, len(self.t), self.factor, 
+            self.ngrow)
+    
+    def grow(self, used):
+        """Enlarge buffers, keeping the first *used* rows. Return (t, Y)."""
+        size = max(used + 1, int(len(self.t) * self.factor))
+        log.debug("Enlarging arrays from %s to %s" % (len(self.t), size))
+        t = np.empty(shape=(size,))
+        Y = np.empty(shape=(size, self.n))
+        t[:used] = self.t[:used]
+        Y[:used] = self.Y[:used]
+        self.t, self.Y = t, Y
+        self.ngrow += 1
+        return t, Y
+    
+    def result(self, i, copy=True):
+        """Return the first *i* rows of (t, Y), as copies or views."""
+        if copy:
+            return self.t[:i].copy(), self.Y[:i].copy()
+        else:
+            return self.t[:i], self.Y[:i]
+
+class SolverStats(object):
+    """
+    Solver counters and wall-clock time accumulated over integrate() calls.
+    
+    Counters are those reported by CVODE (`details
+    <https://computation.llnl.gov/casc/sundials/documentation/cv_guide/node5.html#SECTION00570000000000000000>`_):
+    
+    * **nsteps**: internal steps
+    * **nfevals**: right-hand side evaluations, excluding those for 
+      finite-difference Jacobians, which are counted in **nfevals_ls**
+    * **nlinsetups**: linear solver setups
+    * **netfails**: local error test failures
+    * **nniters**: Newton iterations
+    * **nncfails**: Newton convergence failures
+    * **njevals**: Jacobian evaluations
+    * **ngevals**: rootfinding function evaluations
+    
+    Timing: **ncalls** is the number of calls to 
+    :meth:`~Cvodeint.integrate`, **wall_time** their total duration, 
+    **callback_time** the part spent in Python callbacks (only measured with 
+    ``Cvodeint(..., profile=True)``), and **solver_time** the remainder.
+    
+    >>> s = SolverStats()
+    >>> s.add([10, 20, 3, 1, 15, 0, 2, 4, 0])
+    >>> s.ncalls, s.wall_time, s.callback_time = 1, 0.5, 0.375
+    >>> s
+    SolverStats(nsteps=10, nfevals=20, nlinsetups=3, netfails=1, nniters=15,
+    nncfails=0, njevals=2, nfevals_ls=4, ngevals=0, ncalls=1, wall_time=0.5,
+    callback_time=0.375, solver_time=0.125)
+    """
+    counters = ("nsteps nfevals nlinsetups netfails nniters nncfails "
+        "njevals nfevals_ls ngevals").split()
+    timers = "ncalls wall_time callback_time solver_time".split()
+    
+    def __init__(self):
+        self.reset()
+    
+    def reset(self):
+        """Set all counters and times to zero."""
+        for k in self.counters:
+            setattr(self, k, 0)
+        self.ncalls = 0
+        self.wall_time = 0.0
+        self.callback_time = 0.0
+    
+    @property
+    def solver_time(self):
+        """Wall time not spent in Python callbacks."""
+        return self.wall_time - self.callback_time
+    
+    def add(self, counts):
+        """Add a sequence of counts in the order of :attr:`counters`."""
+        for k, v in zip(self.counters, counts):
+            setattr(self, k, getattr(self, k) + int(v))
+    
+    def __repr__(self):
+        items = ["%s=%s" % (k, getattr(self, k)) 
+            for k in self.counters + self.timers]
+        text = "%s(%s)" % (self.__class__.__name__, ", ".join(items))
+        return "\n".join(textwrap.wrap(text, 79, break_long_words=False))
+
+def timed(fun, stats):
+    """
+    Wrap a callback to add its duration to ``stats.callback_time``.
+    
+    >>> stats = SolverStats()
+    >>> f = timed(lambda x: x, stats)
+    >>> f(42), stats.callback_time >= 0
+    (42, True)
+    """
+    def wrapper(*args):
+        """Timed callback."""
+        t0 = time.time()
+        try:
+            return fun(*args)
+        finally:
+            stats.callback_time += time.time() - t0
+    # pysundials names its callback interface after the function
+    wrapper.__name__ = wrapper.func_name = getattr(fun, "func_name", 
+        getattr(fun, "__name__", "callback"))
+    return wrapper
+
 def assert_assigns_all(fun, y, f_data=None):
     """
     Check that ``fun(t, y, ydot, f_data)`` does assign to all elements of *ydot*.
@@ -222,13 +384,155 @@ def cvodefun(fun):
             return "@cvodefun wrapper around %s" % fun
     return odefun()
 
+def bandwidth(sparsity):
+    """
+    Upper and lower bandwidth of a Jacobian sparsity pattern.
+    
+    :param array_like sparsity: Boolean matrix, nonzero where 
+        ``d ydot[i] / d y[j]`` may be nonzero.
+    :return tuple: (mupper, mlower), suitable for :class:`Cvodeint`.
+    
+    >>> bandwidth([[1, 1, 0, 0], [0, 1, 0, 0], [1, 0, 1, 0], [0, 0, 0, 1]])
+    (1, 2)
+    >>> bandwidth(np.eye(3))
+    (0, 0)
+    """
+    i, j = np.nonzero(np.atleast_2d(sparsity))
+    if len(i) == 0:
+        return 0, 0
+    return max(0, (j - i).max()), max(0, (i - j).max())
+
+def detect_sparsity(f_ode, t, y, f_data=None, nprobe=3, seed=0):
+    """
+    Detect the sparsity pattern of the Jacobian of *f_ode* by probing.
+    
+    Each state variable is perturbed in turn at *y* and at ``nprobe - 1`` 
+    randomly perturbed copies of *y*, and the pattern is the union of rates 
+    that change. Dependencies that are switched off by conditionals at all 
+    probe states will be missed.
+    
+    :return: Boolean array, S[i, j] true if ydot[i] depends on y[j].
+    
+    >>> from cgp.cvodeint.example_ode import vdp
+    >>> detect_sparsity(vdp, 0, [-2.0, 0.5]).astype(int)
+    array([[0, 1],
+           [1, 1]])
+    """
+    y = np.array(y, dtype=float)
+    n = len(y)
+    rng = np.random.RandomState(seed)
+    S = np.zeros((n, n), dtype=bool)
+    ywork, fwork = nv(y), nv(y)
+    for k in range(nprobe):
+        yk = y if k == 0 else y * (1 + 0.1 * rng.uniform(-1, 1, n))
+        ywork[:] = yk
+        f_ode(t, ywork, fwork, f_data)
+        f0 = np.array(fwork)
+        for j in range(n):
+            yp = yk.copy()
+            yp[j] += 1e-4 * max(abs(yp[j]), 1e-3)
+            ywork[:] = yp
+            f_ode(t, ywork, fwork, f_data)
+            S[:, j] |= np.array(fwork) != f0
+    return S
+
+def color_columns(sparsity):
+    """
+    Greedy coloring of Jacobian columns that share no nonzero rows.
+    
+    Columns of the same color can be estimated with a single finite 
+    difference, since perturbing them together affects disjoint rows.
+    
+    :param array_like sparsity: Boolean matrix, see :func:`detect_sparsity`.
+    :return: Integer array of colors, one per column.
+    
+    A tridiagonal pattern needs three colors regardless of size.
+    
+    >>> n = 7
+    >>> S = abs(np.subtract.outer(range(n), range(n))) <= 1
+    >>> color_columns(S)
+    array([0, 1, 2, 0, 1, 2, 0])
+    """
+    S = np.asarray(sparsity, dtype=bool)
+    n = S.shape[1]
+    colors = -np.ones(n, dtype=int)
+    # Rows touched by each color so far
+    rows = []
+    for j in range(n):
+        for c, used in enumerate(rows):
+            if not (used & S[:, j]).any():
+                break
+        else:
+            c = len(rows)
+            rows.append(np.zeros(S.shape[0], dtype=bool))
+        colors[j] = c
+        rows[c] |= S[:, j]
+    return colors
+
+class ColoredJacobian(object):
+    """
+    Finite-difference Jacobian with column coloring, for use as *jac*.
+    
+    Instead of one evaluation of *f_ode* per state variable, columns that 
+    share no nonzero rows are perturbed together, so that each Jacobian 
+    costs one evaluation per color. The result can be passed as the *jac* 
+    argument to :class:`Cvodeint`, which will use it with CVDense or 
+    (given *mupper*) CVBand; ``Cvodeint(..., jac="colored")`` does this 
+    automatically.
+    
+    >>> from cgp.cvodeint.example_ode import vdp
+    >>> S = detect_sparsity(vdp, 0, [-2.0, 0.5])
+    >>> jac = ColoredJacobian(vdp, S)
+    >>> J = np.zeros((2, 2))
+    >>> jac(0, [-2.0, 0.5], [0.5, 0.5], J)
+    >>> np.round(J, 4)
+    array([[ 0.,  1.],
+           [ 1., -3.]])
+    >>> jac.ncolors, jac.nfevals
+    (2, 2)
+    """
+    
+    srur = np.sqrt(np.finfo(float).eps)
+    
+    def __init__(self, f_ode, sparsity, f_data=None, floor=1e-3):
+        self.f_ode = f_ode
+        self.f_data = f_data
+        self.floor = floor  # minimum magnitude for scaling the increment
+        self.sparsity = S = np.asarray(sparsity, dtype=bool)
+        self.colors = color_columns(S)
+        self.ncolors = self.colors.max() + 1 if len(self.colors) else 0
+        # For each color: columns, and (row, column) indices of nonzeros
+        self.groups = []
+        for c in range(self.ncolors):
+            cols = np.flatnonzero(self.colors == c)
+            i, j = np.nonzero(S[:, cols])
+            self.groups.append((cols, i, cols[j]))
+        self.ywork = nv(np.zeros(S.shape[1]))
+        self.fwork = nv(np.zeros(S.shape[0]))
+        self.nfevals = 0  # number of evaluations of f_ode
+    
+    def __call__(self, t, y, fy, J):
+        """Write finite-difference Jacobian at (t, y) into J."""
+        y = np.array(y, dtype=float)
+        fy = np.array(fy, dtype=float)
+        for cols, i, j in self.groups:
+            h = np.zeros_like(y)
+            h[cols] = self.srur * np.maximum(abs(y[cols]), self.floor)
+            self.ywork[:] = y + h
+            self.f_ode(t, self.ywork, self.fwork, self.f_data)
+            df = np.array(self.fwork) - fy
+            J[i, j] = df[i] / h[j]
+        self.nfevals += self.ncolors
+
 def new_with_kwargs(cls, args, kwargs):
     """
     A helper function for pickling classes with keyword arguments.
     
     http://stackoverflow.com/questions/5238252/unpickling-new-style-with-kwargs-not-possible
     """
-    return cls.__new__(cls, *args, **kwargs)
+    instance = cls.__new__(cls, *args, **kwargs)
+    instance.__init__(*args, **kwargs)
+    return instance
 
 class Cvodeint(object):
     """
@@ -247,15 +551,75 @@ class Cvodeint(object):
     :param reltol, abstol, nrtfn, g_rtfn, f_data, g_data: Arguments passed 
         to CVODE (`details 
         <https://computation.llnl.gov/casc/sundials/documentation/cv_guide/cv_guide.html>`_)
-    :param int chunksize: When returning adaptive time steps, result 
-        vectors are allocated in chunks of *chunksize*. 
+    :param int chunksize: Initial size of the reusable buffers for 
+        adaptive time steps (see :class:`OutputArena`), which are doubled 
+        in size as needed.
+    :param bool copy_output: If False, adaptive time steps are returned as 
+        views on the reusable buffers, avoiding a copy. The views are only 
+        valid until the next call to 
+        :meth:`~cgp.cvodeint.core.Cvodeint.integrate`, which overwrites 
+        them. By default, each call returns fresh copies of its output, so 
+        the buffers then only save the reallocations while stepping; 
+        avoiding the per-call allocation needs ``copy_output=False``.
     :param int maxsteps: If the number of  time-steps exceeds *maxsteps*, 
         an exception is raised.
     :param int mupper, mlower: Upper and lower bandwidth for the 
         `CVBand 
         <https://computation.llnl.gov/casc/sundials/documentation/cv_guide/node5.html#SECTION00566000000000000000>`_
         approximation to the Jacobian. CVDense is used by default if 
-        *mupper* and *mlower* are both ``None``.
+        *mupper* and *mlower* are both ``None``. If *mupper* is ``"auto"``, 
+        the bandwidth is computed from *sparsity* with :func:`bandwidth`, 
+        and CVBand is used if the pattern is narrower than a full matrix. 
+        This needs a structural pattern passed as *sparsity*; otherwise 
+        CVDense is used.
+    :param function jac: Optional analytic Jacobian, a function of 
+        (t, y, fy, J) which writes ``d ydot[i] / d y[j]`` into ``J[i, j]``, 
+        where *fy* is the rate vector at (t, y) and *J* is an n-by-n 
+        zero-filled array. It replaces CVODE's finite-difference 
+        approximation, which costs n evaluations of *f_ode* per Jacobian.
+        If *jac* is ``"colored"``, a :class:`ColoredJacobian` is used, 
+        costing one evaluation per color of the sparsity pattern.
+    :param array_like sparsity: Boolean n-by-n matrix, nonzero where 
+        ``J[i, j]`` may be nonzero at any state, e.g. from static analysis 
+        of the rate equations. Available as the *sparsity* attribute. 
+        For ``jac="colored"``, it is detected by probing *f_ode* with 
+        :func:`detect_sparsity` if omitted. Such a detected pattern is not 
+        used to choose a band, since entries that vanish at the probed 
+        states would be taken as structural zeros.
+    :param str stepper: ``"python"`` (default) or ``"native"``. The latter 
+        runs the adaptive-step loop of 
+        :meth:`~cgp.cvodeint.core.Cvodeint.integrate` in compiled code 
+        (:mod:`cgp.cvodeint._stepper`), falling back to Python if the 
+        extension cannot be built. The GIL is released during each 
+        CVode() call, so instances can step concurrently in threads 
+        when the right-hand side also releases it, as compiled CellML 
+        models do.
+    :param bool profile: If True, measure the time spent in Python callbacks 
+        (right-hand side, Jacobian and rootfinding functions), at the cost 
+        of two clock readings per callback. See :attr:`stats`.
+    :param int native_rhs: Optional address of a compiled function with 
+        the signature of CVODE's right-hand side, 
+        ``int f(realtype t, N_Vector y, N_Vector ydot, void *f_data)``, 
+        computing the same rates as *f_ode*. CVODE then calls it directly, 
+        bypassing the ctypes callback through which pysundials calls 
+        Python functions. *f_ode* is still used when called from Python, 
+        e.g. for checking and finite-difference Jacobians, and for CVODE 
+        if *profile* is True. Compiled CellML models provide this as 
+        *rhs_address*, see :func:`~cgp.physmod.cythonize.cythonize_model`.
+    :param tuple native_jac: Optional addresses (dense, band) of compiled 
+        functions with the signatures of CVODE's CVDenseJacFn and 
+        CVBandJacFn, computing the same Jacobian as *jac*. They get 
+        *f_data* as their jac_data argument, and are used only if 
+        *f_data* is given. As with *native_rhs*, CVODE then calls them 
+        directly; *jac* is still used when called from Python, and for 
+        CVODE if *profile* is True. Compiled CellML models with 
+        ``jacobian=True`` provide these, see 
+        :func:`~cgp.physmod.cythonize.cythonize_jacobian`.
+    :param bool check: If False, trust that *f_ode* assigns all rates and 
+        returns 0 on success and a negative value on failure, skipping 
+        :func:`assert_assigns_all` and the trial calls that decide whether 
+        to wrap it with :func:`cvodefun`. Used when rebuilding models from 
+        a :class:`~cgp.physmod.cellmlmodel.ModelSpec`.
     
     **Usage example:**
     
@@ -379,7 +743,12 @@ class Cvodeint(object):
     """  # pylint: disable=W0105
     def __init__(self, f_ode, t, y, reltol=1e-8, abstol=1e-8, nrtfn=None, 
         g_rtfn=None, f_data=None, g_data=None, chunksize=2000, maxsteps=1e4, 
-        mupper=None, mlower=None):
+        mupper=None, mlower=None, stepper="python", copy_output=True, 
+        jac=None, sparsity=None, profile=False, check=True, native_rhs=None, 
+        native_jac=None):
+        if stepper not in ("python", "native"):
+            raise ValueError("stepper must be 'python' or 'native', not %r" 
+                % stepper)
         # Ensure that t and y can be indexed
         t = np.array(t, dtype=float, ndmin=1)
         try:
@@ -388,26 +757,20 @@ class Cvodeint(object):
             msg = "State vector y not interpretable as float: {}"
             raise ValueError(msg.format(y))
         assert len(y) > 0, "Empty state vector"
-        # Ensure that f_ode assigns a value to all elements of the rate vector
-        assert_assigns_all(f_ode, y, f_data)
-        # Ensure that the function returns 0 on success and <0 on exception. 
-        # (CVODE's convention is 
-        # 0 = OK, >0 = recoverable error, <0 = unrecoverable error.)
-        # If not, decorate as if with @cvodefun.
         self.f_ode = f_ode # store this for use in __repr__ etc.
-        success_value = f_ode(t[0], nv(y), nv(y), f_data) # probably 0 or None
-        try:
-            error_value = f_ode(None, None, None, None) # <0 or raise exception
-        except StandardError:
-            error_value = None
-            try:
-                f_ode.traceback = ""
-            except AttributeError:
-                pass
-        if (success_value == 0) and (error_value < 0):
-            self.my_f_ode = f_ode
+        if check:
+            self.my_f_ode = self._checked(f_ode, t, y, f_data)
         else:
-            self.my_f_ode = cvodefun(f_ode)
+            self.my_f_ode = f_ode
+        # Solver statistics, see the stats property
+        self._stats = SolverStats()
+        self.profile = profile
+        self._f_cvode = self._callback(self.my_f_ode) # passed to CVODE
+        # Compiled right-hand side, unless profiling Python callbacks
+        self.native_rhs = native_rhs
+        self._native_rhs = None
+        if (native_rhs is not None) and not profile:
+            self._native_rhs = cvode.CVRhsFn(native_rhs)
         # Variables y, tret, abstol are written by CVode functions, and their 
         # pointers must remain constant. They are assigned here; later 
         # assignments will copy values into the existing variables, like so:
@@ -430,29 +793,68 @@ class Cvodeint(object):
         self.f_data = f_data # user data for right-hand-side of ODE
         self.g_data = g_data # user data for rootfinding function
         self.chunksize = chunksize
+        self.arena = OutputArena(self.n, chunksize)
+        self.copy_output = copy_output
         self.maxsteps = maxsteps
         self.last_flag = None
+        self.stepper = stepper
+        self._native = _native_stepper() if stepper == "native" else None
         # CVODE solver object
         self.cvode_mem = cvode.CVodeCreate(cvode.CV_BDF, cvode.CV_NEWTON)
-        cvode.CVodeMalloc(self.cvode_mem, self.my_f_ode, self.t0, self.y, 
-            self.itol, self.reltol, self.abstol) # allocate & initialize memory
+        self._init_solver() # allocate & initialize memory
         if f_data is not None:
             cvode.CVodeSetFdata(self.cvode_mem, 
                 np.ctypeslib.as_ctypes(self.f_data))
         cvode.CVodeSetStopTime(self.cvode_mem, self.tstop) # set stop time
         # Specify how the Jacobian should be approximated
+        self.jac = jac
+        self._jacbuf = np.zeros((self.n, self.n))
+        structural = sparsity is not None
+        if jac == "colored":
+            if sparsity is None:
+                sparsity = detect_sparsity(self.my_f_ode, t[0], y, f_data)
+            self.jac = jac = ColoredJacobian(self.my_f_ode, sparsity, f_data)
+        self.sparsity = None if sparsity is None else np.array(sparsity, 
+            dtype=bool)
+        if mupper == "auto":
+            mupper = mlower = None
+            if structural:
+                mu, ml = bandwidth(self.sparsity)
+                if mu + ml < self.n - 1:
+                    mupper, mlower = mu, ml
+        self.mupper, self.mlower = mupper, mlower
+        # Compiled Jacobian, unless profiling Python callbacks
+        self.native_jac = native_jac
+        self._native_jac = None
+        native = (native_jac is not None) and (f_data is not None) and (
+            not profile)
         if mupper is None:
             cvode.CVDense(self.cvode_mem, self.n)
+            if native:
+                self._set_native_jac("CVDenseSetJacFn", cvode.CVDenseJacFn, 
+                    native_jac[0])
+            elif jac is not None:
+                cvode.CVDenseSetJacFn(self.cvode_mem, 
+                    self._callback(self._dense_jac), None)
         else:
             cvode.CVBand(self.cvode_mem, self.n, mupper, mlower)        
+            if native:
+                self._set_native_jac("CVBandSetJacFn", cvode.CVBandJacFn, 
+                    native_jac[1])
+            elif jac is not None:
+                d = np.subtract.outer(np.arange(self.n), np.arange(self.n))
+                self._bandindex = np.nonzero((-mupper <= d) & (d <= mlower))
+                cvode.CVBandSetJacFn(self.cvode_mem, 
+                    self._callback(self._band_jac), None)
+        self._stats_base = np.zeros(len(SolverStats.counters))
+        self.nrtfn = 0 # number of rootfinding functions, see RootInit()
         self.RootInit(nrtfn, g_rtfn, g_data)
     
     # pylint: disable=W0212
     def __new__(cls, *args, **kwargs):
-        """Used for pickling."""
+        """Record constructor arguments, used for pickling."""
         instance = super(Cvodeint, cls).__new__(cls)
         instance._init_args = args, kwargs
-        instance.__init__(*args, **kwargs)
         return instance
     
     def __reduce__(self):
@@ -461,6 +863,171 @@ class Cvodeint(object):
         return new_with_kwargs, (self.__class__, args, kwargs), None
 
     
+    @staticmethod
+    def _checked(f_ode, t, y, f_data):
+        """Validate *f_ode*, wrapping it with :func:`cvodefun` if needed."""
+        # Ensure that f_ode assigns a value to all elements of the rate vector
+        assert_assigns_all(f_ode, y, f_data)
+        # Ensure that the function returns 0 on success and <0 on exception. 
+        # (CVODE's convention is 
+        # 0 = OK, >0 = recoverable error, <0 = unrecoverable error.)
+        # If not, decorate as if with @cvodefun.
+        success_value = f_ode(t[0], nv(y), nv(y), f_data) # probably 0 or None
+        try:
+            error_value = f_ode(None, None, None, None) # <0 or raise exception
+        except StandardError:
+            error_value = None
+            try:
+                f_ode.traceback = ""
+            except AttributeError:
+                pass
+        if (success_value == 0) and (error_value < 0):
+            return f_ode
+        else:
+            return cvodefun(f_ode)
+    
+    def _callback(self, fun):
+        """Callback to pass to CVODE, timed if *profile* is True."""
+        return timed(fun, self._stats) if self.profile else fun
+    
+    def _init_solver(self, reinit=False):
+        """
+        Call CVodeMalloc(), or CVodeReInit() if *reinit*, at (t0, y).
+        
+        The pysundials wrappers of these functions wrap the right-hand side 
+        in a Python callback. A compiled right-hand side (*native_rhs*) is 
+        instead passed as a plain function pointer to the SUNDIALS library.
+        """
+        if self._native_rhs is None:
+            init = cvode.CVodeReInit if reinit else cvode.CVodeMalloc
+            init(self.cvode_mem, self._f_cvode, self.t0, self.y, self.itol, 
+                self.reltol, self.abstol)
+            return
+        name = "CVodeReInit" if reinit else "CVodeMalloc"
+        if self.itol == cvode.CV_SV:
+            abstol = self.abstol.data
+        else:
+            abstol = ctypes.byref(self.abstol)
+        flag = getattr(cvode.cvode, name)(self.cvode_mem.obj, 
+            self._native_rhs, self.t0, self.y.data, self.itol, self.reltol, 
+            abstol)
+        if flag < 0:
+            raise CvodeException("%s() failed with flag %s" % (name, flag))
+        self.cvode_mem.dealloc = True  # as set by pysundials CVodeMalloc()
+    
+    def _set_native_jac(self, name, functype, address):
+        """
+        Pass a compiled Jacobian to CVODE as a plain function pointer.
+        
+        Like *native_rhs* in :meth:`_init_solver`, this bypasses the 
+        pysundials wrapper, which would wrap it in a Python callback. 
+        Its jac_data is the *f_data* buffer.
+        """
+        self._native_jac = functype(address)
+        flag = getattr(cvode.cvode, name)(self.cvode_mem.obj, 
+            self._native_jac, self.f_data.ctypes.data)
+        if flag < 0:
+            raise CvodeException("%s() failed with flag %s" % (name, flag))
+    
+    def _solver_counters(self):
+        """CVODE counters since the last (re-)initialization, as an array."""
+        mem = self.cvode_mem
+        nsteps = cvode.CVodeGetNumSteps(mem)
+        counts = [nsteps, cvode.CVodeGetNumRhsEvals(mem), 
+            cvode.CVodeGetNumLinSolvSetups(mem), 
+            cvode.CVodeGetNumErrTestFails(mem), 
+            cvode.CVodeGetNumNonlinSolvIters(mem), 
+            cvode.CVodeGetNumNonlinSolvConvFails(mem), 0, 0, 
+            cvode.CVodeGetNumGEvals(mem)]
+        # The linear solver zeroes its counters at the first step after 
+        # CVodeReInit, so they are stale until then.
+        if nsteps:
+            if self.mupper is None:
+                counts[6] = cvode.CVDenseGetNumJacEvals(mem)
+                counts[7] = cvode.CVDenseGetNumRhsEvals(mem)
+            else:
+                counts[6] = cvode.CVBandGetNumJacEvals(mem)
+                counts[7] = cvode.CVBandGetNumRhsEvals(mem)
+        return np.array(counts)
+    
+    def _harvest_stats(self):
+        """Accumulate CVODE counters before they are zeroed by ReInit."""
+        self._stats.add(self._solver_counters() - self._stats_base)
+        self._stats_base[:] = 0
+    
+    @property
+    def stats(self):
+        """
+        Solver statistics accumulated since creation or :meth:`reset_stats`.
+        
+        Returns a :class:`SolverStats` snapshot with CVODE's counters of 
+        steps, right-hand side and Jacobian evaluations, convergence and 
+        error test failures, and the wall time of :meth:`integrate` calls. 
+        With ``profile=True``, the wall time is split into time spent in 
+        Python callbacks and in the solver itself.
+        
+        >>> from example_ode import exp_growth
+        >>> cvodeint = Cvodeint(exp_growth, t=[0, 1], y=[1], profile=True)
+        >>> t, y, flag = cvodeint.integrate()
+        >>> s = cvodeint.stats
+        >>> s.ncalls, s.nsteps == len(t) - 1, s.nfevals >= s.nsteps
+        (1, True, True)
+        >>> 0 < s.callback_time < s.wall_time
+        True
+        >>> cvodeint.reset_stats()
+        >>> cvodeint.stats.nsteps, cvodeint.stats.ncalls
+        (0, 0)
+        """
+        stats = copy.copy(self._stats)
+        stats.add(self._solver_counters() - self._stats_base)
+        return stats
+    
+    def reset_stats(self):
+        """Zero the counters and times reported by :attr:`stats`."""
+        self._stats.reset()
+        self._stats_base = self._solver_counters()
+    
+    def _dense_jac(self, N, J, t, y, fy, jac_data, tmp1, tmp2, tmp3):
+        """
+        Dense Jacobian for CVDenseSetJacFn, wrapping the *jac* argument.
+        
+        CVODE stores the dense matrix column by column in one block, 
+        which we fill through a Numpy view.
+        """
+        # pylint: disable=W0613
+        try:
+            self._jacbuf.fill(0.0)
+            self.jac(t, y, fy, self._jacbuf)
+            cols = np.ctypeslib.as_array(J.data.contents.data[0], 
+                shape=(J.N, J.M))
+            cols[:] = self._jacbuf.T
+            return 0
+        except StandardError:
+            log.debug("Exception in Jacobian", exc_info=True)
+            return -1
+    
+    def _band_jac(self, N, mupper, mlower, J, t, y, fy, jac_data,
+        tmp1, tmp2, tmp3):
+        """
+        Banded Jacobian for CVBandSetJacFn, wrapping the *jac* argument.
+        
+        CVODE stores column j of the band in one block of 
+        ``smu + mlower + 1`` elements, with J[i, j] at position 
+        ``i - j + smu``.
+        """
+        # pylint: disable=W0613
+        try:
+            self._jacbuf.fill(0.0)
+            self.jac(t, y, fy, self._jacbuf)
+            cols = np.ctypeslib.as_array(J.data.contents.data[0], 
+                shape=(N, J.smu + mlower + 1))
+            i, j = self._bandindex
+            cols[j, i - j + J.smu] = self._jacbuf[i, j]
+            return 0
+        except StandardError:
+            log.debug("Exception in Jacobian", exc_info=True)
+            return -1
+    
     def ydoti(self, index):
         """
         Get rate-of-change of y[index] as a function of (t, y, gout, g_data).
@@ -484,14 +1051,15 @@ class Cvodeint(object):
         
         def result(t, y, gout, g_data):  # pylint: disable=W0613
             """Function for CVODE rootfinding."""
-            self.f_ode(t, y, ydot, None)
+            self.f_ode(t, y, ydot, self.f_data)
             gout[0] = ydot[index]
             return 0
         
         return result
         
     def integrate(self, t=None, y=None, nrtfn=None, g_rtfn=None, g_data=None, 
-        assert_flag=None, ignore_flags=False):
+        assert_flag=None, ignore_flags=False, npoints=None, observe=None, 
+        roots=None):
         """
         Integrate over time interval, init'ing solver or rootfinding as needed.
         
@@ -507,6 +1075,19 @@ class Cvodeint(object):
             CVode differs from *assert_flag* (see `flags`)
         :param bool ignore_flags: overrides assert_flag and does not check 
             CVode flag
+        :param int npoints: with adaptive time steps, record only *npoints* 
+            (at least 2) evenly spaced time-points from start to end time, 
+            interpolated with :func:`~pysundials.cvode.CVodeGetDky` as the 
+            solver steps (see :meth:`_integrate_dense`)
+        :param function observe: with adaptive time steps, call 
+            ``observe(t0, t1)`` after each internal step from *t0* to *t1* 
+            instead of recording the trajectory; output then holds only 
+            the initial and final time and state 
+            (see :meth:`_integrate_observed`)
+        :param function roots: with adaptive time steps, call 
+            ``roots(i, rootsfound)`` at each root instead of returning, and 
+            resume without re-initializing the solver unless it returns 
+            True (see :meth:`_integrate_through_roots`)
         :return tuple: 
             * **tout**: time vector 
               (equal to input time *t* if that has len > 2), 
@@ -524,6 +1105,8 @@ class Cvodeint(object):
           steps.
         * If len(t) > 2, integrate from t[0] and return fixed time steps = t.
         * If y is None, resume from current solver state.
+        * If npoints is given, adaptive steps are replaced by *npoints* 
+          evenly spaced time-points.
         
         >>> from cgp.cvodeint.core import Cvodeint
         >>> from cgp.cvodeint.example_ode import exp_growth, exp_growth_sol
@@ -642,12 +1225,25 @@ class Cvodeint(object):
         >>> t[0], t[-1], y[-1]
         (5.0, 10.0, array([-1.69...,  0.090...]))
         """
-        self._ReInit_if_required(t, y)
-        self.RootInit(nrtfn, g_rtfn, g_data)
-        if len(self.t) > 2:
-            result = self._integrate_fixed_steps()
-        else:
-            result = self._integrate_adaptive_steps()
+        if npoints is not None and npoints < 2:
+            raise ValueError("npoints must be at least 2, not %r" % npoints)
+        tic = time.time()
+        try:
+            self._ReInit_if_required(t, y)
+            self.RootInit(nrtfn, g_rtfn, g_data)
+            if len(self.t) > 2:
+                result = self._integrate_fixed_steps()
+            elif npoints is not None:
+                result = self._integrate_dense(npoints)
+            elif observe is not None:
+                result = self._integrate_observed(observe)
+            elif roots is not None:
+                result = self._integrate_through_roots(roots)
+            else:
+                result = self._integrate_adaptive_steps()
+        finally:
+            self._stats.ncalls += 1
+            self._stats.wall_time += time.time() - tic
         
         flag = result[-1]
         self.last_flag = flag
@@ -659,6 +1255,116 @@ class Cvodeint(object):
         else:
             raise CvodeException(flag, result)
     
+    def _getpar(self):
+        """
+        Parameter vector read by the right-hand side, modified in-place.
+
+        For a plain :class:`Cvodeint` this is *f_data*, or ``None`` if the
+        ODE has no parameter vector. Subclasses that keep parameters
+        elsewhere override this to return a float view of their storage.
+        """
+        return self.f_data
+
+    def integrate_ensemble(self, P=None, Y0=None, t=None, nrtfn=None,
+        g_rtfn=None, g_data=None):
+        """
+        Integrate many parameter sets and/or initial states with one solver.
+
+        :param array_like P: parameter vectors, one row per ensemble member.
+            Each row is copied into the vector returned by :meth:`_getpar`
+            before integrating that member.
+        :param array_like Y0: initial states, one row per ensemble member
+            (default: the current state for every member)
+        :param array_like t: fixed output times, len(t) > 2
+            (default: ``self.t``)
+        :param nrtfn, g_rtfn, g_data: rootfinding setup, as for
+            :meth:`integrate`, applied once to all members
+        :return tuple:
+            * **t**: array of shape (m, len(t)) of output times
+            * **Y**: array of shape (m, len(t), n) of states
+            * **flag**: int array of shape (m,); last flag returned by
+              :func:`~pysundials.cvode.CVode` for each member
+
+        A single CVODE solver object and a single set of output buffers are
+        reused for all members; only :func:`~pysundials.cvode.CVodeReInit`
+        is called between them. If one of *P* and *Y0* has a single row, it
+        is used for every member.
+
+        Failures do not abort the batch. If a member fails, or stops early
+        at a root, its remaining output times and states are NaN and its
+        flag tells what happened. Time, state and parameters are restored
+        afterwards.
+
+        >>> growth_rate = np.array([0.0])
+        >>> def ode(t, y, ydot, f_data):
+        ...     ydot[0] = growth_rate[0] * y[0]
+        >>> cvodeint = Cvodeint(ode, t=[0, 1], y=[1.0], f_data=growth_rate)
+        >>> t, Y, flag = cvodeint.integrate_ensemble(P=[[0.0], [1.0]],
+        ...     t=[0, 0.5, 1])
+        >>> Y.shape, flag
+        ((2, 3, 1), array([0, 0]))
+        >>> Y[:, -1].round(4)
+        array([[ 1.    ], [ 2.7183]])
+        >>> growth_rate
+        array([ 0.])
+
+        Initial states may vary instead of, or as well as, parameters.
+
+        >>> t, Y, flag = cvodeint.integrate_ensemble(P=[1.0],
+        ...     Y0=[[1.0], [2.0], [3.0]], t=[0, 0.5, 1])
+        >>> Y[:, -1].round(4)
+        array([[ 2.7183], [ 5.4366], [ 8.1548]])
+        """
+        if t is None:
+            t = self.t
+        t = np.array(t, dtype=float, ndmin=1)
+        if len(t) <= 2:
+            raise CvodeException(
+                "integrate_ensemble() requires fixed output times, len(t) > 2")
+        if (P is None) and (Y0 is None):
+            raise CvodeException("P or Y0 is required")
+        par = self._getpar()
+        if P is not None:
+            if par is None:
+                raise CvodeException("P was given, but the ODE has no "
+                    "parameter vector (f_data is None)")
+            P = np.array(P, dtype=float, ndmin=2)
+        if Y0 is not None:
+            Y0 = np.array(Y0, dtype=float, ndmin=2)
+        m = max(len(x) for x in (P, Y0) if x is not None)
+        for x in P, Y0:
+            if (x is not None) and (len(x) not in (1, m)):
+                raise CvodeException(
+                    "P and Y0 must have the same number of rows, or one row")
+        # Preallocated output buffers, shared by all members
+        T = np.empty(shape=(m, len(t)))
+        Y = np.empty(shape=(m, len(t), self.n))
+        T.fill(np.nan)
+        Y.fill(np.nan)
+        flag = np.zeros(m, dtype=int)
+        oldt, oldy = np.copy(self.t), np.copy(self.y)
+        oldpar = None if par is None else np.copy(par)
+        self.RootInit(nrtfn, g_rtfn, g_data)
+        try:
+            for i in range(m):
+                if P is not None:
+                    par[:] = P[i % len(P)]
+                y0 = oldy if Y0 is None else Y0[i % len(Y0)]
+                self._ReInit_if_required(t, y0)
+                try:
+                    result = self._integrate_fixed_steps(out=(T[i], Y[i]))
+                except CvodeException, exc:
+                    result = exc.result
+                    log.debug("Ensemble member %s failed: %s" % (i, exc))
+                ti, _Yi, flag[i] = result
+                T[i, len(ti):] = np.nan
+                Y[i, len(ti):] = np.nan
+        finally:
+            if par is not None:
+                par[:] = oldpar
+            self._ReInit_if_required(oldt, oldy)
+        return T, Y, flag
+
     def _ReInit_if_required(self, t=None, y=None):
         """
         Interpret/set time, state; call SetStopTime(), ReInit() if needed.
@@ -708,8 +1414,8 @@ class Cvodeint(object):
         self.tstop = self.t[-1]
         if (y is not None) or (t is None) or (len(self.t) >= 2):
             cvode.CVodeSetStopTime(self.cvode_mem, self.tstop)
-            cvode.CVodeReInit(self.cvode_mem, self.my_f_ode, self.t0, self.y, 
-                self.itol, self.reltol, self.abstol)
+            self._harvest_stats()
+            self._init_solver(reinit=True)
         # self.tret.value = cvode.CVodeGetCurrentTime(self.cvode_mem)
 
     def _integrate_adaptive_steps(self):
@@ -729,9 +1435,12 @@ class Cvodeint(object):
             t, y, flag = cvodeint.integrate()
             plt.plot(t, y, '.-')
         """
-        Y = np.empty(shape=(self.chunksize, self.n)) # cdef np.ndarray
-        t = np.empty(shape=(self.chunksize,)) # cdef np.ndarray
-        d1 = self.chunksize # cdef int
+        if self._native is not None:
+            return self._integrate_adaptive_steps_native()
+        arena = self.arena
+        Y = arena.Y # cdef np.ndarray
+        t = arena.t # cdef np.ndarray
+        d1 = len(t) # cdef int
         Y[0] = np.array(self.y, copy=True)
         t[0] = self.t0.value
         i = 1 # cdef int
@@ -753,11 +1462,9 @@ class Cvodeint(object):
         flag = None
         while self.tret < tstop:
             if i >= maxsteps:
-                # truncate to drop unused array elements
-                Y.resize((i, self.n), refcheck=False)
-                t.resize(i, refcheck=False)
+                # drop unused array elements
                 raise CvodeException("Maximum number of steps exceeded", 
-                                     (t, Y, flag))
+                    arena.result(i, self.copy_output) + (flag,))
             # solve ode for one internal time step
             # (pysundials has a typo in the name of the ONE_STEP_TSTOP constant)
             flag = CVode(cvode_mem, tstop, y, 
@@ -774,30 +1481,218 @@ class Cvodeint(object):
                     break
             else:
                 log.debug("Exception: %s: %s" % (i, flags[flag]))
-                # truncate to drop unused array elements
-                Y.resize((i, self.n), refcheck=False)
-                t.resize(i, refcheck=False)
-                raise CvodeException(flag, (t, Y, flag))
+                # drop unused array elements
+                raise CvodeException(flag, 
+                    arena.result(i, self.copy_output) + (flag,))
             i += 1
-            if i >= d1: # enlarge arrays with a new chunk
-                d1 = len(t) + self.chunksize
-                log.warning("Enlarging arrays from %s to %s" % (i, d1))
-                Y.resize((d1, self.n), refcheck=False)
-                t.resize(d1, refcheck=False)
+            if i >= d1: # enlarge arrays geometrically
+                t, Y = arena.grow(i)
+                d1 = len(t)
         else: # if the while loop was skipped because self.tret >= tstop
             flag = CV_TSTOP_RETURN
-        # truncate to drop unused array elements
-        Y.resize((i, self.n), refcheck=False)
-        t.resize(i, refcheck=False)
+        # drop unused array elements
+        return arena.result(i, self.copy_output) + (flag,)
+
+    def _integrate_through_roots(self, roots):
+        """
+        Adaptive time steps, resuming after each root found.
+        
+        Whenever CVODE returns at a root, ``roots(i, rootsfound)`` is called 
+        with the index *i* of the root in the output and the list returned 
+        by :func:`~pysundials.cvode.CVodeGetRootInfo`. Unless it returns 
+        True, stepping resumes from the solver's internal state, avoiding 
+        the re-initialization (and restart at low order) that a new call to 
+        :meth:`integrate` would incur. The root function may change its 
+        behaviour at a root; CVODE evaluates it again there before resuming.
+        
+        Output: t, Y, flag. See Cvodeint.integrate().
+        
+        >>> from example_ode import exp_growth, g_rtfn_y
+        >>> g_data = ctypes.c_float(2.5)
+        >>> cvodeint = Cvodeint(exp_growth, t=[0, 3], y=[1],
+        ...     nrtfn=1, g_rtfn=g_rtfn_y, g_data=ctypes.byref(g_data))
+        >>> found = []
+        >>> def roots(i, rootsfound):
+        ...     found.append(i)
+        ...     g_data.value *= 2  # next root
+        >>> t, y, flag = cvodeint.integrate(roots=roots)
+        >>> y[found].squeeze()
+        array([  2.5,   5. ,  10. ,  20. ])
+        >>> t[-1], cvode.CVodeGetReturnFlagName(flag)
+        (3.0, 'CV_TSTOP_RETURN')
+        """
+        t, Y, flag = self._integrate_adaptive_steps()
+        if flag != cvode.CV_ROOT_RETURN:
+            return t, Y, flag
+        # copy, as the next call may overwrite the output arena
+        tt, YY = [np.array(t)], [np.array(Y)]
+        n = len(t)
+        while (flag == cvode.CV_ROOT_RETURN) and (self.tret < self.tstop):
+            if roots(n - 1, cvode.CVodeGetRootInfo(self.cvode_mem, 
+                self.nrtfn)):
+                break
+            self.t0.value = self.tret.value
+            t, Y, flag = self._integrate_adaptive_steps()
+            # drop the first point, which repeats the root
+            tt.append(np.array(t[1:]))
+            YY.append(np.array(Y[1:]))
+            n += len(t) - 1
+        return np.concatenate(tt), np.concatenate(YY), flag
+    
+    def _integrate_adaptive_steps_native(self):
+        """
+        Like :meth:`_integrate_adaptive_steps`, but stepping in compiled code.
+        
+        The step loop runs in :func:`cgp.cvodeint._stepper.step`, which 
+        returns to Python only to enlarge the output arrays or to finish. 
+        Output: t, Y, flag. See Cvodeint.integrate().
+        """
+        stepper = self._native
+        arena = self.arena
+        t, Y = arena.t, arena.Y
+        Y[0] = np.array(self.y, copy=True)
+        t[0] = self.t0.value
+        # Raw addresses of solver memory, state vector and return time
+        addr = (self.cvode_mem.obj, 
+                ctypes.cast(self.y.data, ctypes.c_void_p).value, 
+                ctypes.cast(self.y.cdata, ctypes.c_void_p).value, 
+                ctypes.addressof(self.tret))
+        i, flag = 1, None
+        while True:
+            i, flag, status = stepper.step(*(addr + 
+                (self.tstop, t, Y, i, self.maxsteps, flag)))
+            if status != stepper.FULL:
+                break
+            t, Y = arena.grow(i)
+        # drop unused array elements
+        t, Y = arena.result(i, self.copy_output)
+        if status == stepper.MAXSTEPS:
+            raise CvodeException("Maximum number of steps exceeded", 
+                                 (t, Y, flag))
+        if status == stepper.ERROR:
+            log.debug("Exception: %s: %s" % (i, flags[flag]))
+            raise CvodeException(flag, (t, Y, flag))
         return t, Y, flag
 
-    def _integrate_fixed_steps(self):
+    def _integrate_dense(self, npoints):
+        """
+        Step adaptively, but record only *npoints* evenly spaced time-points.
+        
+        After each internal step, any output times passed are interpolated 
+        with :func:`~pysundials.cvode.CVodeGetDky`, so memory use depends on 
+        *npoints* rather than the number of steps. If a root is found, 
+        output ends with the state at the root.
+        Output: t, Y, flag. See Cvodeint.integrate().
+        
+        >>> from cgp.cvodeint.example_ode import exp_growth, exp_growth_sol
+        >>> cvodeint = Cvodeint(exp_growth, t=[0, 1], y=[0.1])
+        >>> t, y, flag = cvodeint.integrate(npoints=5)
+        >>> t
+        array([ 0.  ,  0.25,  0.5 ,  0.75,  1.  ])
+        >>> np.allclose(y.squeeze(), exp_growth_sol(t, 0.1))
+        True
+        """
+        tout = np.linspace(self.t0.value, self.tstop, npoints)
+        Y = np.empty(shape=(npoints + 1, self.n))
+        Y[0] = np.array(self.y, copy=True)
+        j = 1 # number of output times recorded
+        i = 1 # step counter, for comparison with maxsteps
+        maxsteps = self.maxsteps
+        tstop = self.tstop
+        cvode_mem = self.cvode_mem
+        tret = self.tret
+        y = self.y
+        dky = nv(np.zeros(self.n))
+        CV_ONE_STEP_TSTOP = cvode.CV_ONE_STE_TSTOP # typo in cvode
+        flag = None
+        while tret.value < tstop:
+            if i >= maxsteps:
+                raise CvodeException("Maximum number of steps exceeded", 
+                                     (tout[:j], Y[:j], flag))
+            flag = cvode.CVode(cvode_mem, tstop, y, ctypes.byref(tret), 
+                CV_ONE_STEP_TSTOP)
+            if flag not in (cvode.CV_SUCCESS, cvode.CV_TSTOP_RETURN, 
+                            cvode.CV_ROOT_RETURN):
+                log.debug("Exception: %s: %s" % (i, flags[flag]))
+                raise CvodeException(flag, (tout[:j], Y[:j], flag))
+            # interpolate at output times passed during this step
+            while (j < npoints) and (tout[j] <= tret.value):
+                cvode.CVodeGetDky(cvode_mem, tout[j], 0, dky)
+                Y[j] = dky
+                j += 1
+            if flag == cvode.CV_ROOT_RETURN:
+                tout = np.r_[tout[:j], tret.value]
+                Y[j] = y
+                j += 1
+                break
+            i += 1
+        else: # if the while loop was skipped because self.tret >= tstop
+            flag = cvode.CV_TSTOP_RETURN
+        return tout[:j], Y[:j], flag
+
+    def _integrate_observed(self, observe):
+        """
+        Step adaptively, calling *observe(t0, t1)* after each internal step.
+        
+        Nothing is recorded along the way, so memory use does not depend on 
+        the number of steps. When *observe* is called, the state at *t1* is 
+        in *self.y*, and :func:`~pysundials.cvode.CVodeGetDky` interpolates 
+        the solution and its derivatives anywhere in ``[t0, t1]``. 
+        Output: t, Y, flag as for Cvodeint.integrate(), but with only the 
+        initial and final time and state.
+        
+        >>> from cgp.cvodeint.example_ode import exp_growth
+        >>> cvodeint = Cvodeint(exp_growth, t=[0, 1], y=[0.1])
+        >>> steps = []
+        >>> t, y, flag = cvodeint.integrate(
+        ...     observe=lambda t0, t1: steps.append((t0, t1)))
+        >>> t, steps[0][0], steps[-1][1], len(steps) > 10
+        (array([ 0.,  1.]), 0.0, 1.0, True)
+        """
+        t = [self.t0.value, None]
+        Y = np.empty(shape=(2, self.n))
+        Y[0] = np.array(self.y, copy=True)
+        i = 1 # step counter, for comparison with maxsteps
+        maxsteps = self.maxsteps
+        tstop = self.tstop
+        cvode_mem = self.cvode_mem
+        tret = self.tret
+        y = self.y
+        CV_ONE_STEP_TSTOP = cvode.CV_ONE_STE_TSTOP # typo in cvode
+        flag = None
+        while tret.value < tstop:
+            if i >= maxsteps:
+                t[1], Y[1] = tret.value, y
+                raise CvodeException("Maximum number of steps exceeded", 
+                                     (np.array(t), Y, flag))
+            t0 = tret.value
+            flag = cvode.CVode(cvode_mem, tstop, y, ctypes.byref(tret), 
+                CV_ONE_STEP_TSTOP)
+            if flag not in (cvode.CV_SUCCESS, cvode.CV_TSTOP_RETURN, 
+                            cvode.CV_ROOT_RETURN):
+                log.debug("Exception: %s: %s" % (i, flags[flag]))
+                t[1], Y[1] = tret.value, y
+                raise CvodeException(flag, (np.array(t), Y, flag))
+            observe(t0, tret.value)
+            if flag == cvode.CV_ROOT_RETURN:
+                break
+            i += 1
+        else: # if the while loop was skipped because self.tret >= tstop
+            flag = cvode.CV_TSTOP_RETURN
+        t[1], Y[1] = tret.value, y
+        return np.array(t), Y, flag
+
+    def _integrate_fixed_steps(self, out=None):
         """
         Repeatedly call CVode() with task CV_ONE_STEP_TSTOP and tout=t[i]
         
         Output: t, Y, flag. See :meth:`integrate`.
         The *maxsteps* setting is ignored when using fixed time steps.
         
+        If *out* is a tuple of preallocated arrays (t, Y) of shape 
+        (len(self.t),) and (len(self.t), n), results are written there and 
+        the returned t, Y are views on them.
+        
         >>> from example_ode import logistic_growth
         >>> cvodeint = Cvodeint(logistic_growth, t=[0, 0.5, 2], y=[0.1])
         >>> cvodeint.integrate()
@@ -812,8 +1707,11 @@ class Cvodeint(object):
             plt.plot(t, y, '.-')
         """
         imax = len(self.t)
-        Y = np.empty(shape=(imax, self.n))
-        t = np.empty(shape=(imax,))
+        if out is None:
+            Y = np.empty(shape=(imax, self.n))
+            t = np.empty(shape=(imax,))
+        else:
+            t, Y = out
         Y[0] = np.array(self.y).copy()
         t[0] = self.t0.value
         # tret = self.tret
@@ -833,8 +1731,11 @@ class Cvodeint(object):
                 continue
             else:
                 break
-        Y.resize((i + 1, self.n), refcheck=False)
-        t.resize(i + 1, refcheck=False)
+        if out is None:
+            Y.resize((i + 1, self.n), refcheck=False)
+            t.resize(i + 1, refcheck=False)
+        else:
+            t, Y = t[:i + 1], Y[:i + 1]
         result = t, Y, flag
         if flag in (cvode.CV_ROOT_RETURN, cvode.CV_SUCCESS):
             return result
@@ -872,7 +1773,10 @@ class Cvodeint(object):
         CvodeException: If g_rtfn or g_data is given, nrtfn is required.
         """
         if nrtfn is not None:
+            if g_rtfn is not None:
+                g_rtfn = self._callback(g_rtfn)
             cvode.CVodeRootInit(self.cvode_mem, int(nrtfn), g_rtfn, g_data)
+            self.nrtfn = int(nrtfn)
         elif (g_rtfn is not None) or (g_data is not None):
             raise CvodeException(
                 "If g_rtfn or g_data is given, nrtfn is required.")
@@ -7,7 +7,88 @@ import numpy as np
 
 from .core import Cvodeint
 from ..utils.dotdict import Dotdict
+from ..utils.ordereddict import OrderedDict
 from cgp.utils.rec2dict import rec2dict
+from cgp.utils.unstruct import unstruct
+
+class WarmStartCache(object):
+    """
+    Bounded LRU cache of converged states, keyed on parameter vectors.
+    
+    Parameters are quantized to *digits* significant digits, so that 
+    nearly equal parameter vectors share a key. If there is no entry for a 
+    key, :meth:`get` returns the state for the nearest cached parameter 
+    vector in relative distance. At most *maxsize* states are kept; 
+    the least recently used entry is evicted first.
+    
+    >>> cache = WarmStartCache(maxsize=2, digits=3)
+    >>> cache.put([1.0, 2.0], [10.0])
+    >>> cache.get([1.0001, 2.0]).tolist()
+    [10.0]
+    >>> cache.put([1.5, 2.0], [15.0])
+    >>> cache.put([3.0, 2.0], [30.0])
+    >>> len(cache)
+    2
+    >>> cache.get([1.4, 2.0]).tolist()
+    [15.0]
+    >>> cache
+    WarmStartCache(maxsize=2, digits=3) with 2 entries, 1 hits, 1 near, 0 misses
+    """
+    
+    def __init__(self, maxsize=100, digits=4):
+        self.maxsize = maxsize
+        self.digits = digits
+        self._data = OrderedDict()
+        self.hits = 0  # exact match after quantization
+        self.near = 0  # nearest neighbour used
+        self.misses = 0  # cache empty
+    
+    def __len__(self):
+        return len(self._data)
+    
+    def __repr__(self):
+        return ("%s(maxsize=%s, digits=%s) with %s entries, "
+            "%s hits, %s near, %s misses" % (self.__class__.__name__, 
+            self.maxsize, self.digits, len(self), self.hits, self.near, 
+            self.misses))
+    
+    def key(self, p):
+        """Parameter vector quantized to a tuple of floats."""
+        return tuple(float("%.*g" % (self.digits, x)) 
+            for x in np.ravel(unstruct(p)))
+    
+    def put(self, p, y):
+        """Store a copy of state *y* for parameters *p*."""
+        k = self.key(p)
+        self._data.pop(k, None)
+        self._data[k] = np.array(unstruct(y), dtype=float).ravel()
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+    
+    def get(self, p):
+        """State cached for parameters *p* or their nearest neighbour."""
+        if not self._data:
+            self.misses += 1
+            return None
+        k = self.key(p)
+        if k in self._data:
+            self.hits += 1
+        else:
+            self.near += 1
+            keys = self._data.keys()
+            P, q = np.array(keys), np.array(k)
+            with np.errstate(invalid="ignore"):
+                rel = (P - q) / (np.abs(P) + np.abs(q))
+            d = (np.nan_to_num(rel) ** 2).sum(axis=1)
+            k = keys[d.argmin()]
+        y = self._data.pop(k)
+        self._data[k] = y  # mark as recently used
+        return y
+    
+    def clear(self):
+        """Remove all entries and reset statistics."""
+        self._data.clear()
+        self.hits = self.near = self.misses = 0
 
 class Namedcvodeint(Cvodeint):
     """
@@ -15,7 +96,10 @@ class Namedcvodeint(Cvodeint):
     
     Constructor arguments are as for :class:`~cgp.cvodeint.core.Cvodeint`, 
     except that *p* is a recarray. Further ``*args, **kwargs``
-    are passed to :class:`~cgp.cvodeint.core.Cvodeint`.
+    are passed to :class:`~cgp.cvodeint.core.Cvodeint`, 
+    except the keyword argument *warmstart*, which if nonzero is the size 
+    of a :class:`WarmStartCache` of converged states, see 
+    :meth:`warm_start`.
         
     With no arguments, this returns the van der Pol model as an example.
         
@@ -108,6 +192,8 @@ class Namedcvodeint(Cvodeint):
     
     def __init__(self, f_ode=None, t=None, y=None, p=None, 
         *args, **kwargs):
+        warmstart = kwargs.pop("warmstart", 0)
+        self.warmstart = WarmStartCache(warmstart) if warmstart else None
         if f_ode is None:
             f_ode, t_, y_, p_ = self.example()
             t = t_ if t is None else t
@@ -133,6 +219,10 @@ class Namedcvodeint(Cvodeint):
         """
         self.originals = dict(pr=self.pr, y=self.y, yr=self.yr)
         self.dtype = Dotdict(y=y.dtype, p=p.dtype)
+        # Stack of saved parameter vectors, see push_parameters(). 
+        # Buffers are kept when popped and reused by the next push.
+        self._frames = []
+        self._depth = 0
     
     def ydoti(self, index):
         """
@@ -187,6 +277,171 @@ class Namedcvodeint(Cvodeint):
         t, Y, flag = super(Namedcvodeint, self).integrate(**kwargs)
         Yr = Y.view(self.dtype.y, np.recarray)
         return t, Yr, flag
+
+    def _getpar(self):
+        """Unstructured view of the parameter recarray *pr*."""
+        return np.asarray(self.pr).view(float)
+
+    def integrate_ensemble(self, P=None, Y0=None, t=None, **kwargs):
+        """
+        Ensemble integration with structured parameters and states.
+
+        As :meth:`~cgp.cvodeint.core.Cvodeint.integrate_ensemble`, except
+        that *P* and *Y0* may be record arrays like *pr* and *y0r*,
+        and the states are returned as a record array of shape (m, len(t), 1).
+
+        >>> vdp = Namedcvodeint()
+        >>> P = np.tile(vdp.pr, 3)
+        >>> P.epsilon = 0.5, 1.0, 2.0
+        >>> t, Yr, flag = vdp.integrate_ensemble(P, t=np.linspace(0, 1, 5))
+        >>> Yr.shape, flag
+        ((3, 5, 1), array([0, 0, 0]))
+        >>> Yr.x[:, 0].squeeze()
+        array([-2., -2., -2.])
+        >>> vdp.pr.epsilon
+        array([ 1.])
+        """
+        if not all(self.__dict__[k] is v for k, v in self.originals.items()):
+            raise AssertionError(self.reassignwarning)
+        if P is not None:
+            P = unstruct(P).reshape(-1, len(self._getpar()))
+        if Y0 is not None:
+            Y0 = unstruct(Y0).reshape(-1, self.n)
+        t, Y, flag = super(Namedcvodeint, self).integrate_ensemble(
+            P, Y0, t, **kwargs)
+        Yr = Y.view(self.dtype.y, np.recarray)
+        return t, Yr, flag
+
+    def warm_start(self):
+        """
+        Start from the cached state nearest to the current parameters.
+        
+        Requires a cache, i.e. ``warmstart=maxsize`` passed to the 
+        constructor. States are cached with :meth:`remember`, which is 
+        called e.g. by :meth:`~cgp.phenotyping.attractor.AttractorMixin.eq` 
+        on convergence.
+        
+        :return bool: True if the state was changed.
+        
+        >>> vdp = Namedcvodeint(warmstart=10)
+        >>> vdp.warm_start()
+        False
+        >>> with vdp.autorestore(_y=[1.0, 2.0]):
+        ...     vdp.remember()
+        >>> with vdp.autorestore(epsilon=1.01):
+        ...     vdp.warm_start(), vdp.y.tolist()
+        (True, [1.0, 2.0])
+        >>> vdp.warmstart.hits, vdp.warmstart.near, vdp.warmstart.misses
+        (0, 1, 1)
+        """
+        if self.warmstart is None:
+            return False
+        y = self.warmstart.get(self._getpar())
+        if y is None:
+            return False
+        self._ReInit_if_required(y=y)
+        return True
+    
+    def remember(self, y=None):
+        """Cache state *y* (default: current state) for current parameters."""
+        if self.warmstart is not None:
+            self.warmstart.put(self._getpar(), self.y if y is None else y)
+    
+    def parameter_vector(self, _p=None, **kwargs):
+        """
+        Preassembled parameter vector for use with :meth:`parameter_frame`.
+        
+        Returns a float array with the current parameters, updated with 
+        the fields of *_p* (a record array or dict) and *kwargs*.
+        
+        >>> vdp = Namedcvodeint()
+        >>> vdp.parameter_vector(epsilon=2.0)
+        array([ 2.])
+        """
+        pr = np.copy(self.pr).view(np.recarray)
+        if _p is not None:
+            if np.asarray(_p).dtype.names:
+                _p = rec2dict(_p)
+            kwargs = dict(_p, **kwargs)
+        for k, v in kwargs.items():
+            if k not in self.dtype.p.names:
+                raise TypeError("Key %s not in parameter vector" % k)
+            pr[k] = v
+        return np.asarray(pr).view(float)
+    
+    def push_parameters(self, par=None):
+        """
+        Save current parameters on a stack and optionally swap in *par*.
+        
+        Each push and :meth:`pop_parameters` copies one parameter vector 
+        into a buffer that is allocated once per nesting depth.
+        The solver is not re-initialized.
+        
+        >>> vdp = Namedcvodeint()
+        >>> vdp.push_parameters([2.0])
+        >>> vdp.pr.epsilon
+        array([ 2.])
+        >>> vdp.pop_parameters()
+        >>> vdp.pr.epsilon
+        array([ 1.])
+        """
+        cur = self._getpar()
+        if self._depth == len(self._frames):
+            self._frames.append(np.empty_like(cur))
+        self._frames[self._depth][:] = cur
+        self._depth += 1
+        if par is not None:
+            cur[:] = par
+    
+    def pop_parameters(self):
+        """Restore the parameters saved by the last :meth:`push_parameters`."""
+        if not self._depth:
+            raise IndexError("pop from empty parameter stack")
+        self._depth -= 1
+        self._getpar()[:] = self._frames[self._depth]
+    
+    def _restore(self, oldt, oldtret, oldy):
+        """
+        Re-initialize at time *oldtret* and state *oldy* unless unchanged.
+        
+        The time span is restored to *oldt*, so that :meth:`integrate` 
+        continues from where the solver was, with the same end time.
+        """
+        if (self.tret.value == oldtret) and np.array_equal(self.t, oldt) and (
+            np.array_equal(self.y, oldy)):
+            return
+        self._ReInit_if_required([oldtret, oldt[-1]], oldy)
+        self.t = oldt
+    
+    @contextmanager
+    def parameter_frame(self, par=None):
+        """
+        Lightweight context manager to swap parameters in and out.
+        
+        :param array_like par: Full parameter vector, e.g. from 
+            :meth:`parameter_vector`.
+        
+        Unlike :meth:`autorestore`, this neither re-initializes the solver 
+        on entry nor clears rootfinding, and on exit it calls CVodeReInit 
+        only if time or state changed within the frame. Frames may be nested.
+        
+        >>> vdp = Namedcvodeint()
+        >>> fast = vdp.parameter_vector(epsilon=2.0)
+        >>> with vdp.parameter_frame(fast):
+        ...     with vdp.parameter_frame():
+        ...         vdp.pr.epsilon = 3.0
+        ...     vdp.pr.epsilon
+        array([ 2.])
+        >>> vdp.pr.epsilon
+        array([ 1.])
+        """
+        oldt, oldtret, oldy = np.copy(self.t), self.tret.value, np.copy(self.y)
+        self.push_parameters(par)
+        try:
+            yield
+        finally:
+            self.pop_parameters()
+            self._restore(oldt, oldtret, oldy)
     
     @contextmanager
     def autorestore(self, _p=None, _y=None, **kwargs):
@@ -249,43 +504,50 @@ class Namedcvodeint(Cvodeint):
         >>> bool(vdp.pr.epsilon == before[1])
         True
         """
-        oldt, oldy, oldpar = np.copy(self.t), np.copy(self.y), np.copy(self.pr)
-        if _p is not None:
-            if np.asarray(_p).dtype.names:
-                _p = rec2dict(_p)
-            for k, v in _p.items():
-                self.pr[k] = v
-        if _y is not None:
-            try:
-                self.y[:] = _y
-                # Assignment to NVector won't check number of elements, so:
-                np.testing.assert_allclose(self.y, _y)
-            except ValueError, exc:
-                msg = "can only convert an array of size 1 to a Python scalar"
-                assert msg in str(exc)
-                self.y[:] = _y.squeeze()
-            except TypeError: # float expected instead of numpy.void instance
-                self.y[:] = _y.item()
-        for k, v in kwargs.items():
-            if k in self.dtype.p.names and k not in self.dtype.y.names:
-                self.pr[k] = v
-                continue
-            if k in self.dtype.y.names and k not in self.dtype.p.names:
-                # Recarraylink does not support item assignment
-                setattr(self.yr, k, v)
-                continue
-            if k not in [self.dtype.y.names + self.dtype.p.names]:
-                raise TypeError("Key %s not in parameter or rate vectors" % k)
-            raise TypeError(
-                "Key %s occurs in both parameter and state vectors" % k)
-        self._ReInit_if_required(y=self.y)
+        oldt, oldtret, oldy = np.copy(self.t), self.tret.value, np.copy(self.y)
+        self.push_parameters()
+        try:
+            if _p is not None:
+                if np.asarray(_p).dtype.names:
+                    _p = rec2dict(_p)
+                for k, v in _p.items():
+                    self.pr[k] = v
+            if _y is not None:
+                try:
+                    self.y[:] = _y
+                    # Assignment to NVector won't check number of elements
+                    np.testing.assert_allclose(self.y, _y)
+                except ValueError, exc:
+                    msg = ("can only convert an array of size 1 "
+                        "to a Python scalar")
+                    assert msg in str(exc)
+                    self.y[:] = _y.squeeze()
+                except TypeError: # float expected, not numpy.void instance
+                    self.y[:] = _y.item()
+            for k, v in kwargs.items():
+                if k in self.dtype.p.names and k not in self.dtype.y.names:
+                    self.pr[k] = v
+                    continue
+                if k in self.dtype.y.names and k not in self.dtype.p.names:
+                    # Recarraylink does not support item assignment
+                    setattr(self.yr, k, v)
+                    continue
+                if k not in [self.dtype.y.names + self.dtype.p.names]:
+                    raise TypeError(
+                        "Key %s not in parameter or rate vectors" % k)
+                raise TypeError(
+                    "Key %s occurs in both parameter and state vectors" % k)
+            self._ReInit_if_required(y=self.y)
+        except:
+            self.pop_parameters()
+            raise
         
         try:
             yield
         finally:
-            self._ReInit_if_required(oldt, oldy)
+            self._restore(oldt, oldtret, oldy)
             self.RootInit(0) # Disable any rootfinding
-            self.pr[:] = oldpar
+            self.pop_parameters()
     
     @contextmanager
     def clamp(self, **kwargs):
@@ -373,8 +635,9 @@ class Namedcvodeint(Cvodeint):
             y[k] = v
         
         # Use original options when rerunning the Cvodeint initialization.
+        # f_data may hold the parameters, as for Cellmlmodel.
         oldkwargs = dict((k, getattr(self, k)) 
-            for k in "chunksize maxsteps reltol abstol".split())
+            for k in "chunksize maxsteps reltol abstol f_data".split())
         
         args, kwargs = self._init_args
         clamped_model = self.__class__(*args, **kwargs)
@@ -418,7 +681,7 @@ class Namedcvodeint(Cvodeint):
         ydot = np.zeros_like(y)
         with self.autorestore(_p=par):
             for i in range(len(t)):
-                self.f_ode(t[i], y[i], ydot[i], None)
+                self.f_ode(t[i], y[i], ydot[i], self.f_data)
         ydot = ydot.squeeze().view(self.dtype.y, np.recarray)
         return ydot
 
@@ -46,10 +46,8 @@ from bottle import route, request
 
 # Numerics
 import numpy as np
-# Bridge to the R statistical software
-from cgp.utils.rnumpy import r, rwrap
 # Caching and on-demand recomputing
-from joblib import Memory
+from cgp.utils.lazymemory import LazyMemory
 
 # Wrapping ODE solver for CellML so it knows about variable names, etc.
 from cgp.physmod.cellmlmodel import Cellmlmodel
@@ -61,12 +59,23 @@ from cgp.virtexp.elphys.paceable import ap_stats_array
 from cgp.utils.unstruct import unstruct
 from cgp.utils.failwith import failwithnanlikefirst
 
-# Sensitivity analysis package for R
-r.library("sensitivity")
 # Initialize caching
-mem = Memory("/tmp/sensitivity_service")
+mem = LazyMemory("/tmp/sensitivity_service")
 
-r.library("sensitivity")
+_r = []
+
+def rsensitivity():
+    """
+    Bridge to the R statistical software, with R's sensitivity package.
+    
+    Importing :mod:`cgp.utils.rnumpy` starts R, so this is deferred until 
+    the first sensitivity analysis.
+    """
+    if not _r:
+        from cgp.utils.rnumpy import r
+        r.library("sensitivity")
+        _r.append(r)
+    return _r[0]
 
 # pylint: disable=W0105
 '''def scalar_pheno(field):
@@ -127,6 +136,7 @@ def mat2par(mat, m, factors):
     
     >>> m = Model(workspace="bondarenko_szigeti_bett_kim_rasmusson_2004_apical",
     ...     exposure="11df840d0150d34c9716cd4cbdd164c8")
+    >>> r = rsensitivity()
     >>> mat2par(r.matrix(range(4), ncol=2), m, ["Cm", "Vmyo"])
     rec.array([ (0.0, 2.0, 1.2e-07, ... 
                 (1.0, 3.0, 1.2e-07, ...
@@ -148,12 +158,14 @@ def scalar_pheno(field, m, factors):
     >>> m = Model(workspace="bondarenko_szigeti_bett_kim_rasmusson_2004_apical",
     ...     exposure="11df840d0150d34c9716cd4cbdd164c8")
     >>> factors = ["Cm", "Vmyo"]  # must be list, not tuple
+    >>> r = rsensitivity()
     >>> caller = r("function(callback, x) callback(x)")
     >>> callback = scalar_pheno("apbase", m, factors)
     >>> input = np.reshape(m.pr[factors].item(), (1, -1))
     >>> print "apbase:", caller(callback, input)
     apbase:...[-82.4202]
     """
+    from cgp.utils.rnumpy import rwrap
     
     @rwrap
     def fun(rmatrix):
@@ -171,6 +183,7 @@ def do_sensitivity(exposure, workspace, protocol, statistic, par=None,
     
     Callback from R.
     
+    >>> r = rsensitivity()
     >>> r("fun <- function(func, x) func(x)")
     RClosure with name <return value from eval>:
     <R function>
@@ -193,6 +206,7 @@ def do_sensitivity(exposure, workspace, protocol, statistic, par=None,
     TODO: Make optional arguments of exposure, lower, upper, etc.
     TODO: Accept json dict of model_kwargs, morris_kwargs
     """
+    r = rsensitivity()
     if model is None:
         m = Model(workspace, exposure, changeset, variant, 
             maxsteps=1e6, chunksize=1e5, reltol=1e-8)
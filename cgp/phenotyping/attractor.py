@@ -18,6 +18,16 @@ class AttractorMixin(object):
         weights = 1.0 / (self.reltol * np.abs(y.view(float)) + self.abstol)
         return ((weights * y ** 2).sum() / weights.sum()) ** 0.5
     
+    def _warm_start(self):
+        """Start from cached converged state, if the model supports it."""
+        if getattr(self, "warmstart", None) is not None:
+            self.warm_start()
+    
+    def _remember(self):
+        """Cache converged state, if the model supports it."""
+        if getattr(self, "warmstart", None) is not None:
+            self.remember()
+    
     def ydotnorm(self, tol):
         """
         Make rootfinding function: :func:`weighted_rms` norm of rate of change.
@@ -26,9 +36,9 @@ class AttractorMixin(object):
         """
         ydot = np.empty_like(self.y)
         
-        def result(t, y, gout, g_data=None):
+        def result(t, y, gout, g_data=None):  # pylint: disable=W0613
             """Rootfinding function for convergence to equilibrium."""
-            self.my_f_ode(t, y, ydot, g_data)
+            self.my_f_ode(t, y, ydot, self.f_data)
             gout[0] = self.weighted_rms(ydot) - tol
             return 0
         
@@ -43,6 +53,11 @@ class AttractorMixin(object):
             dy/dt. The WRMS norm is defined in cvode.h.
         :param float last_only: Include only the last time and state?
         
+        If the model has a cache of converged states (see 
+        :meth:`~cgp.cvodeint.namedcvodeint.Namedcvodeint.warm_start`), 
+        the search starts from the cached state for the nearest parameter 
+        vector, and the steady state is added to the cache.
+        
         ..  plot::
             :include-source:
             
@@ -56,6 +71,7 @@ class AttractorMixin(object):
             >>> t, y, flag = test.eq(last_only=False)
             >>> h = plt.plot(t, y, '-', t[-1], y[-1], 'o')
         """
+        self._warm_start()
         g_rtfn = self.ydotnorm(tol)
         gout = np.zeros(1)
         # CV_ROOT_RETURN may never happen if already converged, so check now
@@ -69,6 +85,7 @@ class AttractorMixin(object):
                 tmax = self.t[-1]
             t, y, flag = self.integrate(t=tmax, nrtfn=1, g_rtfn=g_rtfn, 
                 assert_flag=cvode.CV_ROOT_RETURN)
+        self._remember()
         y = y.squeeze()
         if last_only:
             return t[-1], y[-1]
@@ -115,6 +132,9 @@ class AttractorMixin(object):
         :param int n: Keep history of up to n extrema while searching for 
             limit cycle.
         
+        As for :meth:`eq`, a cache of converged states is used if available. 
+        The cached state is the point on the cycle where the search ended.
+        
         ..  plot::
             :include-source:
             
@@ -133,6 +153,7 @@ class AttractorMixin(object):
         """
         if tmax is None:
             tmax = self.t[-1]
+        self._warm_start()
         extrema = deque([self.next_extremum(tmax, index)], maxlen=n)
         while True:
             t, y, (te, ye) = tup = self.next_extremum(tmax, index)
@@ -146,6 +167,7 @@ class AttractorMixin(object):
                     L = reversed(list(extrema)[:lag])
                     t, y, _ = catrec(*L, globalize_time=False)
                     period = te - te_
+                    self._remember()
                     return t, y.squeeze(), period
 
 # TODO: Separate function to compute statistics from raw trajectory
@@ -0,0 +1,552 @@
+"""
+Generate Python code for a CellML model, without external tools.
+
+:func:`generate` translates the MathML of a CellML 1.0 model, parsed with
+:mod:`lxml`, into Python code with the same layout as that of the CellML API
+code generator (CeLEDS): module-level ``sizeStates``, ``sizeConstants`` and
+``sizeAlgebraic``, and functions ``createLegends()``, ``initConsts()``,
+``computeRates(voi, states, constants)`` and
+``computeAlgebraic(constants, states, voi)``. This is the layout expected by
+:mod:`~cgp.physmod.cellmlmodel`, :mod:`~cgp.physmod.cythonize` and
+:mod:`~cgp.physmod.jacobian`.
+
+>>> cellml = '''<model name="decay" xmlns="http://www.cellml.org/cellml/1.0#">
+... <component name="Main">
+...   <variable name="t" units="second"/>
+...   <variable name="x" units="dimensionless" initial_value="2"/>
+...   <variable name="k" units="per_second" initial_value="0.5"/>
+...   <variable name="r" units="per_second"/>
+...   <math xmlns="http://www.w3.org/1998/Math/MathML">
+...     <apply><eq/><ci>r</ci>
+...       <apply><times/><cn>2</cn><ci>k</ci></apply></apply>
+...     <apply><eq/><apply><diff/><bvar><ci>t</ci></bvar><ci>x</ci></apply>
+...       <apply><minus/><apply><times/><ci>r</ci><ci>x</ci></apply></apply>
+...     </apply>
+...   </math>
+... </component></model>'''
+>>> print generate(etree.fromstring(cellml))
+# Generated by cgp.physmod.cellml2py version 1
+# Size of variable arrays:
+sizeAlgebraic = 0
+sizeStates = 1
+sizeConstants = 2
+from math import *
+from numpy import *
+<BLANKLINE>
+def createLegends():
+    legend_states = [""] * sizeStates
+    legend_rates = [""] * sizeStates
+    legend_algebraic = [""] * sizeAlgebraic
+    legend_voi = ""
+    legend_constants = [""] * sizeConstants
+    legend_voi = 't in component Main (second)'
+    legend_states[0] = 'x in component Main (dimensionless)'
+    legend_constants[0] = 'k in component Main (per_second)'
+    legend_constants[1] = 'r in component Main (per_second)'
+    legend_rates[0] = 'd/dt x in component Main (dimensionless)'
+    return (legend_states, legend_algebraic, legend_voi, legend_constants)
+<BLANKLINE>
+def initConsts():
+    constants = [0.0] * sizeConstants; states = [0.0] * sizeStates;
+    constants[0] = 0.5
+    constants[1] = (2.0 * constants[0])
+    states[0] = 2.0
+    return (states, constants)
+<BLANKLINE>
+def computeRates(voi, states, constants):
+    rates = [0.0] * sizeStates; algebraic = [0.0] * sizeAlgebraic
+    rates[0] = -(constants[1] * states[0])
+    return(rates)
+<BLANKLINE>
+def computeAlgebraic(constants, states, voi):
+    algebraic = array([[0.0] * len(voi)] * sizeAlgebraic)
+    states = array(states)
+    voi = array(voi)
+    return algebraic
+<BLANKLINE>
+def custom_piecewise(cases):
+    \"\"\"Compute result of a piecewise function\"\"\"
+    return select(cases[0::2],cases[1::2])
+<BLANKLINE>
+
+Unlike CeLEDS output, the generated code uses only Numpy functions, so that
+it also works on whole arrays of time points. Variables that depend only on
+constants are computed once in ``initConsts()``, as in CeLEDS. Values are converted between the units of
+connected variables, but offsets (e.g. degrees Celsius) are ignored.
+Imports (CellML 1.1), reactions, algebraic loops and equations not solved
+for a single variable raise :exc:`NotImplementedError`.
+
+:func:`generate_cached` stores the generated code on disk under a hash of
+the CellML source, so that it is generated only once.
+"""
+
+from StringIO import StringIO
+import hashlib
+import math
+import os
+
+from lxml import etree
+
+from cgp.utils.write_if_not_exists import write_atomically
+
+__all__ = ["generate", "generate_cached"]
+
+#: Version of the code generator, part of the cache key of generated code
+version = 1
+
+#: Start of the first line of generated code
+banner = "# Generated by cgp.physmod.cellml2py"
+
+mml = "http://www.w3.org/1998/Math/MathML"
+
+#: MathML functions of one argument and their Python equivalents
+functions = dict(abs="fabs", exp="exp", ln="log", floor="floor",
+    ceiling="ceil", factorial="factorial", sin="sin", cos="cos", tan="tan",
+    sinh="sinh", cosh="cosh", tanh="tanh", arcsin="arcsin",
+    arccos="arccos", arctan="arctan", arcsinh="arcsinh", arccosh="arccosh",
+    arctanh="arctanh")
+
+#: Reciprocal trigonometric functions, as format strings of the argument
+reciprocals = dict(sec="(1.0 / cos(%s))", csc="(1.0 / sin(%s))",
+    cot="(1.0 / tan(%s))", sech="(1.0 / cosh(%s))", csch="(1.0 / sinh(%s))",
+    coth="(1.0 / tanh(%s))")
+
+#: MathML relations and the Numpy functions for them
+relations = dict(eq="equal", neq="not_equal", gt="greater", lt="less",
+    geq="greater_equal", leq="less_equal")
+
+#: MathML logical operators and the Python operators for them
+logical = {"and": "&", "or": "|", "xor": "^"}
+
+#: MathML constants
+constants = dict(pi=repr(math.pi), exponentiale=repr(math.e),
+    true="True", false="False", notanumber='float("nan")',
+    infinity='float("inf")')
+
+#: SI prefixes as powers of ten
+prefixes = dict(yotta=24, zetta=21, exa=18, peta=15, tera=12, giga=9,
+    mega=6, kilo=3, hecto=2, deka=1, deci=-1, centi=-2, milli=-3, micro=-6,
+    nano=-9, pico=-12, femto=-15, atto=-18, zepto=-21, yocto=-24)
+
+#: Scale of predefined CellML units relative to SI units; others are 1.0
+si_scale = dict(gram=1e-3, litre=1e-3, liter=1e-3)
+
+def _local(el):
+    """Tag name of an element, without namespace."""
+    return etree.QName(el).localname
+
+def _children(el):
+    """Child elements, skipping comments and processing instructions."""
+    return [i for i in el if isinstance(i.tag, basestring)]
+
+def _number(s):
+    """
+    Python literal for a number.
+
+    >>> _number(" 3 "), _number("1e-3")
+    ('3.0', '0.001')
+    """
+    return repr(float(s))
+
+class _Model(object):
+    """Variables, units and equations of a CellML model."""
+
+    def __init__(self, root):
+        self.root = root
+        self.cml = etree.QName(root).namespace
+        if root.findall("{%s}import" % self.cml):
+            raise NotImplementedError("CellML imports are not supported")
+        if root.findall(".//{%s}reaction" % self.cml):
+            raise NotImplementedError("CellML reactions are not supported")
+        self.units = self._units(root)
+        # Variable elements keyed by (component, name), in document order
+        self.variables = []
+        self.element = {}
+        self.component_units = {}
+        for comp in root.iterfind("{%s}component" % self.cml):
+            cname = comp.get("name")
+            self.component_units[cname] = self._units(comp)
+            for var in comp.iterfind("{%s}variable" % self.cml):
+                key = cname, var.get("name")
+                self.variables.append(key)
+                self.element[key] = var
+        self.source = self._sources()
+
+    def _units(self, parent):
+        """Units defined directly under *parent*, keyed by name."""
+        return dict((u.get("name"), u)
+            for u in parent.iterfind("{%s}units" % self.cml))
+
+    def scale(self, name, component=None, _seen=()):
+        """Factor converting a value in units *name* to SI units."""
+        units = self.component_units.get(component, {})
+        el = units.get(name, self.units.get(name))
+        if (el is None) or (name in _seen):
+            return si_scale.get(name, 1.0)
+        if el.get("base_units") == "yes":
+            return 1.0
+        result = 1.0
+        for u in el.iterfind("{%s}unit" % self.cml):
+            prefix = u.get("prefix", "0")
+            prefix = prefixes[prefix] if prefix in prefixes else int(prefix)
+            factor = float(u.get("multiplier", 1)) * 10.0 ** prefix
+            factor *= self.scale(u.get("units"), component, _seen + (name,))
+            result *= factor ** float(u.get("exponent", 1))
+        return result
+
+    def _sources(self):
+        """Map each variable to the one it gets its value from."""
+        parent = dict((k, k) for k in self.variables)
+
+        def find(k):
+            while parent[k] != k:
+                k = parent[k]
+            return k
+
+        for conn in self.root.iterfind("{%s}connection" % self.cml):
+            comp = conn.find("{%s}map_components" % self.cml)
+            c1, c2 = comp.get("component_1"), comp.get("component_2")
+            for var in conn.iterfind("{%s}map_variables" % self.cml):
+                k1, k2 = (c1, var.get("variable_1")), (c2, var.get("variable_2"))
+                parent[find(k1)] = find(k2)
+        classes = {}
+        for k in self.variables:
+            classes.setdefault(find(k), []).append(k)
+        source = {}
+        for members in classes.values():
+            out = [k for k in members if "in" not in (
+                self.element[k].get("public_interface"),
+                self.element[k].get("private_interface"))]
+            src = out[0] if out else members[0]
+            for k in members:
+                source[k] = src
+        return source
+
+    def conversion(self, key):
+        """Factor converting the source of variable *key* to its units."""
+        src = self.source[key]
+        if src == key:
+            return 1.0
+        scale = lambda k: self.scale(self.element[k].get("units"), k[0])
+        return scale(src) / scale(key)
+
+    def legend(self, key):
+        """Legend entry for a variable, as in CeLEDS."""
+        return "%s in component %s (%s)" % (key[1], key[0],
+            self.element[key].get("units"))
+
+    def equations(self):
+        """
+        List of (component, kind, variable, expression, factor).
+
+        *kind* is "diff" or "eq", *variable* is the source of the variable
+        being defined, and *expression* is the MathML element for its
+        derivative or value. *factor* converts a derivative with respect to
+        the component's time variable to one with respect to *voi*, the
+        variable of integration, which is also set here.
+        """
+        self.voi = None
+        result = []
+        for comp in self.root.iterfind("{%s}component" % self.cml):
+            cname = comp.get("name")
+            for math_ in comp.iterfind("{%s}math" % mml):
+                for eq in _children(math_):
+                    result.append(self._equation(cname, eq))
+        return result
+
+    def _equation(self, cname, eq):
+        """Parse one equation, see :meth:`equations`."""
+        children = _children(eq)
+        if (_local(eq) != "apply") or (len(children) != 3) or (
+            _local(children[0]) != "eq"):
+            raise NotImplementedError("Not an equation: %s" %
+                etree.tostring(eq))
+        lhs, rhs = children[1:]
+        if not self._is_target(lhs) and self._is_target(rhs):
+            lhs, rhs = rhs, lhs
+        if _local(lhs) == "ci":
+            return cname, "eq", self.source[cname, lhs.text.strip()], rhs, 1.0
+        if self._is_target(lhs):
+            bvar, var = _children(lhs)[1:]
+            time = cname, _children(bvar)[0].text.strip()
+            if self.voi not in (None, self.source[time]):
+                raise NotImplementedError("More than one bound variable")
+            self.voi = self.source[time]
+            return (cname, "diff", self.source[cname, var.text.strip()], rhs,
+                self.conversion(time))
+        raise NotImplementedError("Equation not solved for a variable: %s" %
+            etree.tostring(eq))
+
+    @staticmethod
+    def _is_target(el):
+        """True for <ci> or <apply><diff/><bvar>...</bvar><ci>...</apply>."""
+        if _local(el) == "ci":
+            return True
+        children = _children(el)
+        return ((_local(el) == "apply") and (len(children) == 3) and
+            (_local(children[0]) == "diff") and (_local(children[1]) == "bvar")
+            and (_local(children[2]) == "ci"))
+
+class _Translator(object):
+    """Translate MathML expressions to Python code."""
+
+    def __init__(self, model, cname, names):
+        self.model = model
+        self.cname = cname
+        self.names = names  # source variable -> Python code
+
+    def deps(self, el):
+        """Source variables referred to in expression *el*."""
+        return set(self.model.source[self.cname, ci.text.strip()]
+            for ci in el.iter("{%s}ci" % mml))
+
+    def __call__(self, el):
+        tag = _local(el)
+        method = getattr(self, "do_" + tag, None)
+        if method is None:
+            raise NotImplementedError("MathML element <%s> not supported" %
+                tag)
+        return method(el)
+
+    def do_ci(self, el):  # pylint: disable=C0111
+        key = self.cname, el.text.strip()
+        try:
+            code = self.names[self.model.source[key]]
+        except KeyError:
+            raise NotImplementedError("Variable %s in component %s has no "
+                "value" % key[::-1])
+        factor = self.model.conversion(key)
+        if abs(factor - 1.0) > 1e-12:
+            code = "(%s * %r)" % (code, factor)
+        return code
+
+    def do_cn(self, el):  # pylint: disable=C0111
+        children = _children(el)
+        if el.get("type") == "e-notation":
+            return _number("%se%s" % (el.text, children[0].tail))
+        if el.get("type") == "rational":
+            return "(%s / %s)" % (_number(el.text), _number(children[0].tail))
+        return _number(el.text)
+
+    def do_piecewise(self, el):  # pylint: disable=C0111
+        cases = []
+        for piece in _children(el):
+            if _local(piece) == "piece":
+                value, cond = _children(piece)
+                cases.extend([self(cond), self(value)])
+            else:
+                cases.extend(["True", self(_children(piece)[0])])
+        return "custom_piecewise([%s])" % ", ".join(cases)
+
+    def do_apply(self, el):  # pylint: disable=C0111,R0911,R0912
+        children = _children(el)
+        op = _local(children[0])
+        qualifiers = dict((_local(i), _children(i)[0]) for i in children[1:]
+            if _local(i) in ("degree", "logbase"))
+        args = [self(i) for i in children[1:]
+            if _local(i) not in ("degree", "logbase")]
+        if op == "plus":
+            return args[0] if len(args) == 1 else "(%s)" % " + ".join(args)
+        if op == "minus":
+            if len(args) == 1:
+                return "-%s" % args[0]
+            return "(%s - %s)" % tuple(args)
+        if op == "times":
+            return "(%s)" % " * ".join(args)
+        if op == "divide":
+            return "(%s / %s)" % tuple(args)
+        if op == "power":
+            return "power(%s, %s)" % tuple(args)
+        if op == "root":
+            if "degree" in qualifiers:
+                return "power(%s, 1.0 / %s)" % (args[0],
+                    self(qualifiers["degree"]))
+            return "sqrt(%s)" % args[0]
+        if op == "log":
+            if "logbase" in qualifiers:
+                return "(log(%s) / log(%s))" % (args[0],
+                    self(qualifiers["logbase"]))
+            return "log10(%s)" % args[0]
+        if op in functions:
+            return "%s(%s)" % (functions[op], args[0])
+        if op in reciprocals:
+            return reciprocals[op] % args[0]
+        if op in ("min", "max"):
+            code = args[0]
+            for arg in args[1:]:
+                code = "%simum(%s, %s)" % (op, code, arg)
+            return code
+        if op == "rem":
+            return "fmod(%s, %s)" % tuple(args)
+        if op in relations:
+            pairs = ["%s(%s, %s)" % (relations[op], a, b)
+                for a, b in zip(args[:-1], args[1:])]
+            return pairs[0] if len(pairs) == 1 else "(%s)" % " & ".join(pairs)
+        if op in logical:
+            return "(%s)" % (" %s " % logical[op]).join(args)
+        if op == "not":
+            return "logical_not(%s)" % args[0]
+        raise NotImplementedError("MathML operator <%s> not supported" % op)
+
+    def _constant(self, el):
+        """MathML constant such as <pi/>."""
+        return constants[_local(el)]
+
+    do_pi = do_exponentiale = do_true = do_false = _constant
+    do_notanumber = do_infinity = _constant
+
+def _toposort(keys, deps):
+    """
+    Order *keys* so that each comes after the keys it depends on.
+
+    Ties are broken by the original order.
+
+    >>> _toposort("abc", dict(a="c", b="", c="b"))
+    ['b', 'c', 'a']
+    >>> _toposort("ab", dict(a="b", b="a"))
+    Traceback (most recent call last):
+    NotImplementedError: Algebraic loop involving ['a', 'b']
+    """
+    keys = list(keys)
+    done = set()
+    result = []
+    while len(result) < len(keys):
+        ready = [k for k in keys if (k not in done) and
+            all((d in done) or (d not in keys) for d in deps[k])]
+        if not ready:
+            loop = sorted(k for k in keys if k not in done)
+            raise NotImplementedError("Algebraic loop involving %s" % loop)
+        done.update(ready)
+        result.extend(ready)
+    return result
+
+def generate(tree):
+    """
+    Python code for a CellML model, in the layout of CeLEDS output.
+
+    :param tree: CellML model as an lxml element or element tree.
+    :raises NotImplementedError: if the model uses unsupported features.
+    """
+    root = tree.getroot() if hasattr(tree, "getroot") else tree
+    model = _Model(root)
+    equations = model.equations()
+    if model.voi is None:
+        raise NotImplementedError("Model has no differential equations")
+    # Equation defining each variable
+    defined = dict((eq[2], eq) for eq in equations)
+    kind = dict((var, k) for _c, k, var, _e, _f in equations)
+    states = [k for k in model.variables if kind.get(k) == "diff"]
+    computed = [k for k in model.variables if kind.get(k) == "eq"]
+    literal = [k for k in model.variables if (model.source[k] == k) and
+        (k not in defined) and (k != model.voi) and
+        (model.element[k].get("initial_value") is not None)]
+    # Source variables that each computed variable depends on
+    deps = {}
+    for k in computed:
+        cname, _kind, _var, expr, _factor = defined[k]
+        deps[k] = _Translator(model, cname, {}).deps(expr)
+    computed = _toposort(computed, deps)
+    # Computed variables that depend only on constants are constants too
+    constant = set(literal)
+    for k in computed:
+        if deps[k] <= constant:
+            constant.add(k)
+    const = literal + [k for k in computed if k in constant]
+    algebraic = [k for k in computed if k not in constant]
+    names = {model.voi: "voi"}
+    for fmt, keys in [("states[%s]", states), ("constants[%s]", const),
+        ("algebraic[%s]", algebraic)]:
+        for i, k in enumerate(keys):
+            names[k] = fmt % i
+
+    def code(k):
+        """Python code for the value or derivative of variable k."""
+        cname, _kind, _var, expr, factor = defined[k]
+        result = _Translator(model, cname, names)(expr)
+        if abs(factor - 1.0) > 1e-12:
+            result = "(%s * %r)" % (result, factor)
+        return result
+
+    def initial_value(k):
+        """Python code for the initial value of variable k."""
+        value = model.element[k].get("initial_value")
+        try:
+            return _number(value)
+        except ValueError:  # CellML 1.1 allows a variable name
+            return _Translator(model, k[0], names)(
+                etree.fromstring("<ci xmlns='%s'>%s</ci>" % (mml, value)))
+
+    for k in states:
+        if model.element[k].get("initial_value") is None:
+            raise NotImplementedError("State %s in component %s has no "
+                "initial value" % k[::-1])
+    L = ["%s version %s" % (banner, version), "# Size of variable arrays:",
+        "sizeAlgebraic = %s" % len(algebraic),
+        "sizeStates = %s" % len(states),
+        "sizeConstants = %s" % len(const),
+        "from math import *", "from numpy import *", "",
+        "def createLegends():",
+        '    legend_states = [""] * sizeStates',
+        '    legend_rates = [""] * sizeStates',
+        '    legend_algebraic = [""] * sizeAlgebraic',
+        '    legend_voi = ""',
+        '    legend_constants = [""] * sizeConstants',
+        "    legend_voi = %r" % model.legend(model.voi)]
+    for prefix, keys in [("states", states), ("algebraic", algebraic),
+        ("constants", const)]:
+        L.extend("    legend_%s[%s] = %r" % (prefix, i, model.legend(k))
+            for i, k in enumerate(keys))
+    L.extend("    legend_rates[%s] = %r" % (i, "d/dt " + model.legend(k))
+        for i, k in enumerate(states))
+    L.extend([
+        "    return (legend_states, legend_algebraic, legend_voi, "
+        "legend_constants)", "",
+        "def initConsts():",
+        "    constants = [0.0] * sizeConstants; states = [0.0] * sizeStates;"])
+    L.extend("    %s = %s" % (names[k], initial_value(k)) for k in literal)
+    L.extend("    %s = %s" % (names[k], code(k))
+        for k in const if k in defined)
+    L.extend("    %s = %s" % (names[k], initial_value(k)) for k in states)
+    L.extend(["    return (states, constants)", "",
+        "def computeRates(voi, states, constants):",
+        "    rates = [0.0] * sizeStates; algebraic = [0.0] * sizeAlgebraic"])
+    L.extend("    %s = %s" % (names[k], code(k)) for k in algebraic)
+    L.extend("    rates[%s] = %s" % (i, code(k)) for i, k in enumerate(states))
+    L.extend(["    return(rates)", "",
+        "def computeAlgebraic(constants, states, voi):",
+        "    algebraic = array([[0.0] * len(voi)] * sizeAlgebraic)",
+        "    states = array(states)",
+        "    voi = array(voi)"])
+    L.extend("    %s = %s" % (names[k], code(k)) for k in algebraic)
+    L.extend(["    return algebraic", "",
+        "def custom_piecewise(cases):",
+        '    """Compute result of a piecewise function"""',
+        "    return select(cases[0::2],cases[1::2])", ""])
+    return "\n".join(L)
+
+def generate_cached(cellml, cachedir, tree=None):
+    """
+    Python code for a CellML model, cached on disk under its content hash.
+
+    :param str cellml: CellML source.
+    :param str cachedir: Directory for generated code, created if needed.
+    :param tree: Parsed *cellml*, if available; see :func:`generate`.
+
+    The cache key is the SHA-1 hash of *cellml* and the generator
+    :data:`version`. Code is written by
+    :func:`~cgp.utils.write_if_not_exists.write_atomically`, so that
+    concurrent processes never see a partial file.
+    """
+    key = hashlib.sha1("%s\n%s" % (version, cellml)).hexdigest()
+    filename = os.path.join(cachedir, key + ".py")
+    try:
+        with open(filename) as f:
+            return f.read()
+    except IOError:
+        pass
+    if tree is None:
+        tree = etree.parse(StringIO(cellml))
+    code = generate(tree)
+    with write_atomically(filename) as f:
+        f.write(code)
+    return code
@@ -14,49 +14,78 @@ Shorter naming scheme, e.g. __main__.py in package.
     t, y, flag = vdp.integrate(t=[0, 20])
     plt.plot(t, y.x, t, y.y)
 
-At runtime, this module extends sys.path with $HOME/_cgptoolbox, 
+Constructing a model extends sys.path with $HOME/_cgptoolbox, 
 which contains autogenerated Python modules for CellML models.
+Importing this module has no such side effects, and leaves lxml, joblib 
+and the code generators to be imported when first needed, see 
+:mod:`cgp.utils.importtime`.
 """
 # pylint: disable=W0621, W0142, W0201
 from StringIO import StringIO
 from collections import namedtuple
 from contextlib import closing
 from importlib import import_module
-from tempfile import NamedTemporaryFile as Tempfile, gettempdir
+from tempfile import NamedTemporaryFile as Tempfile, gettempdir, mkdtemp
+import cPickle
 import hashlib
+import imp
 import json
 import os
+import pickle
 import shutil
 import subprocess
 import sys
+import time
+import timeit
 import urllib
 import warnings
 
 import numpy as np
-from lxml import etree
-import joblib
 
 import cgp
+from cgp.cvodeint.core import ColoredJacobian
 from cgp.cvodeint.namedcvodeint import Namedcvodeint
 from cgp.utils.commands import getstatusoutput
 from cgp.utils.dotdict import Dotdict
+from cgp.utils.lazymemory import LazyMemory
 from cgp.utils.ordereddict import OrderedDict
+from cgp.utils.poormanslock import Lock
 from cgp.utils.rec2dict import dict2rec
-from cgp.utils.write_if_not_exists import write_if_not_exists
-from cgp.physmod.cythonize import cythonize_model
+from cgp.utils.write_if_not_exists import (write_if_not_exists, 
+    write_atomically, replace)
+from cgp.physmod.cythonize import cythonize_model, cythonize_jacobian
+from cgp.physmod.jacobian import jacobian_code, rates_sparsity
 
-__all__ = ["Cellmlmodel"]
+__all__ = ["Cellmlmodel", "ModelSpec", "prebuild"]
 
 cgp_tempdir = os.path.expanduser("~/_cgptoolbox")
 
+#: Cache of code generated by :func:`cgp.physmod.cellml2py.generate_cached`
+codegen_dir = os.path.join(cgp_tempdir, "_codegen")
+
+#: Seconds to wait for another process to finish building a model. If a 
+#: build process was killed, remove its stale ``build.lock`` file from the 
+#: model directory.
+build_timeout = 3600
+
+#: Version of the metadata saved by :meth:`Cellmlmodel._save_metadata`
+metadata_version = 1
+
+# In-process caches of CellML source and its hash by URL, and of model 
+# metadata by (URL, hash)
+_sources = {}
+_metadata = {}
+
+# Names of model modules whose generated code only works for scalars, 
+# so that rates_and_algebraic_vectorized() fails
+_scalar_only = set()
+
 # XML namespaces
 mml = "http://www.w3.org/1998/Math/MathML"
 cml = "http://www.cellml.org/cellml/1.0#"
 re = "http://exslt.org/regular-expressions"
 
-parser = etree.XMLParser(recover=True)
-
-mem = joblib.Memory(os.path.join(gettempdir(), "cellmlmodel"), verbose=0)
+mem = LazyMemory(os.path.join(gettempdir(), "cellmlmodel"), verbose=0)
 
 @mem.cache
 def urlcache(url, data=None):
@@ -64,59 +93,76 @@ def urlcache(url, data=None):
     with closing(urllib.urlopen(url, data)) as f:
         return f.read()
 
-# Ensure that $HOME/_cgptoolbox/_cellml2py/ is a valid package directory
-# This makes it easy to force re-generation of code by renaming _cellml2py/
-try:
-    import _cellml2py  # @UnusedImport pylint: disable=W0611,W0403
-except ImportError:
-    initfile = os.path.join(cgp_tempdir, "_cellml2py", "__init__.py")
-    with write_if_not_exists(initfile):
-        pass  # just create an empty __init__.py file
-
-# This must be done *after* creating cgp_tempdir, 
-# otherwise it gets silently ignored, cf.
-# http://docs.python.org/2/using/cmdline.html#envvar-PYTHONPATH
-if cgp_tempdir not in sys.path:
-    sys.path.append(cgp_tempdir)
+def parse_xml(text):
+    """Parse XML with lxml, recovering from errors as far as possible."""
+    from lxml import etree  # deferred import to minimize startup time
+    return etree.parse(StringIO(text), etree.XMLParser(recover=True))
+
+_have_package = False
+
+def _ensure_package():
+    """
+    Make $HOME/_cgptoolbox/_cellml2py/ an importable package, once per process.
+    
+    Renaming _cellml2py/ is an easy way to force re-generation of code.
+    """
+    global _have_package  # pylint: disable=W0603
+    if _have_package:
+        return
+    try:
+        import _cellml2py  # @UnusedImport pylint: disable=W0611,W0403
+    except ImportError:
+        initfile = os.path.join(cgp_tempdir, "_cellml2py", "__init__.py")
+        with write_if_not_exists(initfile):
+            pass  # just create an empty __init__.py file
+    # This must be done *after* creating cgp_tempdir, 
+    # otherwise it gets silently ignored, cf.
+    # http://docs.python.org/2/using/cmdline.html#envvar-PYTHONPATH
+    if cgp_tempdir not in sys.path:
+        sys.path.append(cgp_tempdir)
+    _have_package = True
+
+#: Path to the cellml-api source tree, for :func:`generate_code`
+cellml_api = os.environ.get("CELLML_API", "/home/jonvi/hg/cellml-api")
 
 @mem.cache
 def generate_code(url_or_cellml, language="python"):
     """
-    Generate Python code for CellML model at url. Wraps cellml-api/testCeLEDS.
-    
-    Written as a replacement for the code generation at models.cellml.org, 
-    which was broken at the time of writing:
-     
-    https://tracker.physiomeproject.org/show_bug.cgi?id=3199
+    Generate code for CellML model at url. Wraps cellml-api/testCeLEDS.
     
-    This function encapsulates the command-line usage::
+    Python code is generated in-process by 
+    :func:`cgp.physmod.cellml2py.generate_cached`. For other languages, 
+    this encapsulates the command-line usage, where ``cellml-api`` is 
+    :data:`cellml_api`, by default taken from the environment variable 
+    CELLML_API::
     
     cd cellml-api
-    ./testCeLEDS http://models.cellml.org/workspace/tentusscher_noble_noble_panfilov_2004/@@rawfile/3e0eeae90b16221bb1ca327a5572de482990cacc/tentusscher_noble_noble_panfilov_2004_a.cellml CeLEDS/languages/Python.xml
+    ./testCeLEDS http://models.cellml.org/workspace/tentusscher_noble_noble_panfilov_2004/@@rawfile/3e0eeae90b16221bb1ca327a5572de482990cacc/tentusscher_noble_noble_panfilov_2004_a.cellml CeLEDS/languages/C.xml
     
     >>> print generate_code("http://models.cellml.org/workspace/"
     ... "tentusscher_noble_noble_panfilov_2004/@@rawfile/"
     ... "3e0eeae90b16221bb1ca327a5572de482990cacc/"
     ... "tentusscher_noble_noble_panfilov_2004_a.cellml")
+    # Generated by cgp.physmod.cellml2py version ...
     # Size of variable arrays:
-    sizeAlgebraic = 67
+    sizeAlgebraic = ...
     sizeStates = 17
-    sizeConstants = 46
     ...
-    algebraic[21] = 1125.00*exp(-pow(states[0]+27.0000, 2.00000)/240.000)+80...
-    if __name__ == "__main__":
-        (voi, states, algebraic) = solve_model()
-        plot_model(voi, states, algebraic)
+    def computeRates(voi, states, constants):
+    ...
     """
-    args = ["/home/jonvi/hg/cellml-api/testCeLEDS", 
-            "-", 
-            "/home/jonvi/hg/cellml-api/CeLEDS/languages/{}.xml".format(
-                language.capitalize())]
+    from cgp.physmod import cellml2py  # deferred import to minimize startup time
     url_or_cellml = url_or_cellml.strip()
     if url_or_cellml.startswith("<"):
         src = url_or_cellml
     else:
         src = urlcache(url_or_cellml)
+    if language == "python":
+        return cellml2py.generate_cached(src, codegen_dir)
+    args = [os.path.join(cellml_api, "testCeLEDS"), 
+            "-", 
+            os.path.join(cellml_api, "CeLEDS/languages/{}.xml".format(
+                language.capitalize()))]
     with Tempfile() as cellml, Tempfile() as pycode:  # pylint:disable=C0321
         cellml.write(src)  # Maybe this should be src.encode("utf-8")
         cellml.seek(0)
@@ -246,10 +292,12 @@ def dtypes(legend):
 py_addendum = '''
 ### Added by cellmlmodel.py ###
 
-# @todo: The following module-level variables are shared across instances.
-#        It might be better to wrap them in a class, allowing each instance of 
-#        the same model to have its own parameter vector.
+# The following module-level variables hold default values. 
+# Each Cellmlmodel instance passes its own parameter vector as f_data, 
+# so that instances of the same model do not interfere.
 
+import ctypes
+import sys
 import numpy as np
 
 ftype = np.float64 # explicit type declaration, can be used with cython
@@ -262,6 +310,38 @@ y0[:], p[:] = initConsts()
 
 exc_info = None
 
+# ode() and rates_and_algebraic() accept a per-instance f_data buffer
+per_instance = True
+# f_data address and Numpy view of the most recent call, replaced as a 
+# whole so that threads never see the view of another address
+_fdata_view = None, None
+
+def parameters(f_data):
+    """
+    Parameter vector at the start of f_data, or the module-level default.
+    
+    f_data is a float array holding parameters followed by workspace for 
+    algebraic variables. It arrives as a Numpy array when called from Python 
+    and as a memory address when called by CVODE. Only the view of the most 
+    recent address is kept, so memory does not grow with the number of 
+    instances that have been integrated.
+    
+    >>> parameters(None) is p
+    True
+    """
+    global _fdata_view
+    if f_data is None:
+        return p
+    if not isinstance(f_data, np.ndarray):
+        address, view = _fdata_view
+        if address != f_data:
+            ptr = ctypes.cast(f_data, ctypes.POINTER(ctypes.c_double))
+            view = np.ctypeslib.as_array(ptr, 
+                shape=(sizeConstants + sizeAlgebraic,))
+            _fdata_view = f_data, view
+        f_data = view
+    return f_data[:sizeConstants]
+
 # Sundials calling convention: https://computation.llnl.gov/casc/sundials/documentation/cv_guide/node6.html#SECTION00661000000000000000
 
 def ode(t, y, ydot, f_data):
@@ -269,7 +349,8 @@ def ode(t, y, ydot, f_data):
     Compute rates of change for differential equation model.
     
     Rates are written into ydot[:]. 
-    f_data is ignored, but required by the CVODE interface.
+    f_data holds the parameters, see parameters(). 
+    If f_data is None, the module-level parameter vector p is used.
     
     The function returns 0 on success and -1 on failure.
     
@@ -291,16 +372,18 @@ def ode(t, y, ydot, f_data):
     global exc_info
     exc_info = None
     try:
-        ydot[:] = computeRates(t, y, p)
+        ydot[:] = computeRates(t, y, parameters(f_data))
         return 0
     except StandardError:
         exc_info = sys.exc_info()
         return -1
 
-def rates_and_algebraic(t, y):
+def rates_and_algebraic(t, y, par=None):
     """
     Compute rates and algebraic variables for a given state trajectory.
     
+    par is the parameter vector, by default the module-level p.
+    
     Unfortunately, the CVODE machinery does not offer a way to return rates and 
     algebraic variables during integration. This function re-computes the rates 
     and algebraics at each time step for the given state.
@@ -317,13 +400,36 @@ def rates_and_algebraic(t, y):
     # y can be NVector, unstructured or structured Numpy array.
     # If y is NVector, its data will get copied into a Numpy array.
     y = np.array(y).view(float)
+    if par is None:
+        par = p
     ydot = np.zeros_like(y)
     alg = np.zeros((imax, len(algebraic)))
     for i in range(imax):
-        ydot[i] = computeRates(t[i], y[i], p)
+        ydot[i] = computeRates(t[i], y[i], par)
         if len(algebraic):
             # need np.atleast_1d() because computeAlgebraic() uses len(t)
-            alg[i] = computeAlgebraic(p, y[i], np.atleast_1d(t[i])).squeeze()
+            alg[i] = computeAlgebraic(par, y[i], np.atleast_1d(t[i])).squeeze()
+    return ydot, alg
+
+def rates_and_algebraic_vectorized(t, y, par=None):
+    """
+    Like rates_and_algebraic(), but evaluating all time points in one pass.
+    
+    Each rate and algebraic expression is evaluated once, with whole 
+    columns of the state trajectory as Numpy arrays. This fails if the 
+    generated code only works for scalars, e.g. if it calls rootfind_*().
+    """
+    t = np.atleast_1d(np.asarray(t, dtype=ftype))
+    y = np.array(y).view(float).reshape(len(t), sizeStates)
+    if par is None:
+        par = p
+    states = y.T
+    ydot = np.zeros_like(y)
+    for i, rate in enumerate(computeRates(t, states, par)):
+        ydot[:, i] = rate  # broadcasts if the rate is constant
+    alg = np.zeros((len(t), sizeAlgebraic))
+    if sizeAlgebraic:
+        alg[:] = np.transpose(computeAlgebraic(par, states, t))
     return ydot, alg
 '''
 
@@ -351,6 +457,54 @@ def guess_url(self, urlpattern="exposure/{exposure}/{variant}.cellml"):
         self.changeset = self.get_changeset()
     return self.cellml_home + urlpattern.format(**self.__dict__)
 
+def build_extension(dirname, extname, pyx, setup):
+    """
+    Compile Cython code to an extension module, return (command, output).
+    
+    The build runs in a private temporary subdirectory of *dirname*. Then 
+    the .pyx and setup.py files are moved to *dirname*, followed by the 
+    compiled module, using atomic renames. The setup file of modules other 
+    than "cy" is named setup_<extname>.py. Thus other processes can import 
+    the module from *dirname* at any time without seeing a partial file.
+    The caller should hold a lock to avoid duplicate builds, see 
+    :meth:`Cellmlmodel._build_lock`.
+    
+    :param str extname: Name of the extension module, as in *setup*.
+    :param str pyx, setup: Contents of the .pyx and setup.py files, 
+        e.g. from :func:`~cgp.physmod.cythonize.cythonize_model`.
+    """
+    suffixes = [s for s, _mode, kind in imp.get_suffixes() 
+        if kind == imp.C_EXTENSION]
+    tmpdir = mkdtemp(prefix=".build-", dir=dirname)
+    try:
+        with open(os.path.join(tmpdir, extname + ".pyx"), "w") as f:
+            f.write(pyx)
+        with open(os.path.join(tmpdir, "setup.py"), "w") as f:
+            f.write(setup)
+        cmd = "python setup.py build_ext --inplace"
+        status, output = getstatusoutput(cmd, cwd=tmpdir)
+        # Apparently, errors fail to cause status != 0.
+        # However, output does include any error messages.
+        if "cannot find -lsundials_cvode" in output:
+            raise OSError("Cython-compilation of ODE right-hand side "
+                "failed because SUNDIALS was not found.\n"
+                "Status code: %s\nCommand: %s\n"
+                "Output (including errors):\n%s" % (status, cmd, output))
+        if status != 0:
+            raise RuntimeError("'%s'\nreturned status %s:\n%s" % 
+                (cmd, status, output))
+        built = [extname + s for s in suffixes 
+            if os.path.exists(os.path.join(tmpdir, extname + s))]
+        setupname = "setup.py" if extname == "cy" else (
+            "setup_%s.py" % extname)
+        # The compiled module goes last, when its sources are in place
+        for src, dst in zip([extname + ".pyx", "setup.py"] + built[:1], 
+            [extname + ".pyx", setupname] + built[:1]):
+            replace(os.path.join(tmpdir, src), os.path.join(dirname, dst))
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+    return cmd, output
+
 class Cellmlmodel(Namedcvodeint):
     """
     Class to solve CellML model equations.
@@ -362,18 +516,29 @@ class Cellmlmodel(Namedcvodeint):
         t, Yr, flag = vdp.integrate(t=[0, 20])
         plt.plot(t,Yr.view(float))
     
-    The constructor will download autogenerated Python code from cellml.org if
-    possible, and otherwise look for a corresponding .py.orig file in 
-    ``$HOME/_cgptoolbox/_cellml2py`/``. This code is wrapped to be compatible 
-    with CVode, and saved as a .py file in the same directory.
+    The constructor generates Python code from the CellML source with 
+    :mod:`cgp.physmod.cellml2py`, falling back to a code generation web 
+    service for CellML features it does not support. This code is wrapped to 
+    be compatible with CVode, and saved as a .py file in 
+    ``$HOME/_cgptoolbox/_cellml2py/``.
     
     If ``use_cython=True`` (the default), the code is rewrapped for `Cython
-    <http://www.cython.org>`_ and compiled for speed. Compiled models reside in
-    ``$HOME/_cgptoolbox/_cellml2py/cython/`` where each compiled model has a 
-    subdirectory containing several files. The .pyx file and setup.py file can 
-    be tweaked by hand if required, and manually recompiled by changing to that 
-    directory and running ``python setup.py build_ext --inplace``. The compiled 
-    module has extension .so (Linux) or .pyd (Windows).
+    <http://www.cython.org>`_ and compiled for speed. Each model has a 
+    subdirectory of ``$HOME/_cgptoolbox/_cellml2py/`` named by the hash of 
+    its CellML source, holding the Python code, the cy.pyx and setup.py files 
+    and the compiled module cy.so (Linux) or cy.pyd (Windows). The .pyx file 
+    and setup.py file can be tweaked by hand if required, and manually 
+    recompiled by changing to that directory and running 
+    ``python setup.py build_ext --inplace``. The model name, legends and 
+    dtypes are cached there too, so constructing the model again skips 
+    parsing the CellML source, see :meth:`_load_metadata`.
+    
+    Code is generated and compiled only once per model, even if many 
+    processes start at the same time; see :meth:`_build_lock`. Before a 
+    cluster run, build the models in advance with :func:`prebuild`, or from 
+    the command line::
+    
+        python -m cgp --prebuild <model> [<model> ...]
         
     Compiling the model causes some minor differences in behaviour, see
     :func:`~cgp.test.test_cellmlmodel.test_compiled_behaviour` for details.
@@ -384,14 +549,14 @@ class Cellmlmodel(Namedcvodeint):
     
     def __hash__(self):
         """Hash for Cellmlmodel."""
-        return hash((self.cellml, repr(self._init_args)))
+        return hash((self.hash, repr(self._init_args)))
     
     def __init__(self,  # pylint: disable=W0102,E1002,R
         url=None,
         workspace=None, exposure=None, changeset=None, variant=None,
         localfile=None,  
         t=[0, 1], y=None, p=None, rename={}, use_cython=True, purge=False, 
-        **kwargs):
+        jacobian=False, lookup=None, **kwargs):
         """
         Wrap autogenerated CellML->Python for use with pysundials
         
@@ -442,10 +607,28 @@ class Cellmlmodel(Namedcvodeint):
         ap_cvode.Tentusscher.__init__().
         
         use_cython: if True, wrap the model for Cython and compile.
-        Cython files are placed in 
-        ``$HOME/_cgptoolbox/_cellml2py/cython/modulename/``, 
-        and _cellml2py.cython.modulename.modulename is used 
-        in place of _cellml2py.modulename.
+        The compiled module _cellml2py.<hash>.cy is used in place of 
+        _cellml2py.<hash>.py. CVODE then calls the compiled right-hand side 
+        through a C function pointer, see *native_rhs* in 
+        :class:`~cgp.cvodeint.core.Cvodeint`; pass ``native_rhs=None`` to 
+        call it through Python instead, as for an uncompiled model.
+        
+        jacobian: if True, generate an analytic Jacobian for CVODE, 
+        see :meth:`_import_jacobian`. For compiled models, CVODE calls it 
+        through C function pointers, see *native_jac* in 
+        :class:`~cgp.cvodeint.core.Cvodeint`. If "colored", use finite differences 
+        with column coloring (:class:`~cgp.cvodeint.core.ColoredJacobian`), 
+        with the sparsity pattern found by static analysis of the rate 
+        equations. Pass ``mupper="auto"`` to use a banded solver if the 
+        sparsity pattern allows.
+        
+        lookup: dict mapping state names to (low, high, step), e.g. 
+        ``{"V": (-100, 80, 0.05)}``. Rate expressions that depend on 
+        parameters and only one of these states, such as the voltage-dependent 
+        opening and closing rates of gating variables, are tabulated on the 
+        grid and interpolated linearly, see 
+        :func:`~cgp.physmod.cythonize.optimize_code`. Requires use_cython. 
+        Check the accuracy with :meth:`lookup_error`.
         
         >>> Cellmlmodel().dtype
         Dotdict({'a': None,
@@ -458,6 +641,9 @@ class Cellmlmodel(Namedcvodeint):
         
         See class docstring: ?Cellmlmodel for details.
         """
+        if lookup and not use_cython:
+            raise ValueError("Lookup tables require use_cython=True")
+        _ensure_package()
         if not any([url, workspace, exposure, changeset, variant, localfile]):
             url = ("http://models.cellml.org/workspace/"
                 "vanderpol_vandermark_1928/@@rawfile/"
@@ -472,14 +658,14 @@ class Cellmlmodel(Namedcvodeint):
             self.url = guess_url(self)
         else:
             self.url = url or guess_url(self)
-        self.cellml = urlcache(self.url)
-        self.tree = etree.parse(StringIO(self.cellml), parser)
-        try:
-            self.name = etree.ETXPath("//{%s}model/@name" % cml)(self.tree)[0]
-        except IndexError:
-            self.name = etree.ETXPath("//{%s}model/@name" % cml.replace(
-                "1.0", "1.1"))(self.tree)[0]
-        self.hash = "_" + hashlib.sha1(self.cellml).hexdigest()[:6]
+        if purge:
+            _sources.pop(self.url, None)
+        if self.url not in _sources:
+            cellml = urlcache(self.url)
+            _sources[self.url] = cellml, hashlib.sha1(cellml).hexdigest()
+        self.cellml, sha1 = _sources[self.url]
+        self._tree = None
+        self.hash = "_" + sha1[:6]
         self.package = "_cellml2py." + self.hash
         self.packagedir = os.path.join(cgp_tempdir, "_cellml2py", self.hash)
         if purge:
@@ -489,17 +675,26 @@ class Cellmlmodel(Namedcvodeint):
                 shutil.rmtree(self.packagedir)
             except OSError:
                 pass
+            _metadata.pop((self.url, self.hash), None)
+        meta = self._load_metadata()
+        self.name = meta["name"] if meta else self._parse_name()
         _head, tail = os.path.split(self.url.strip("/"))
-        with write_if_not_exists(os.path.join(self.packagedir, tail)) as f:
-            f.write(self.cellml)
+        if not os.path.exists(os.path.join(self.packagedir, tail)):
+            with write_atomically(os.path.join(self.packagedir, tail)) as f:
+                f.write(self.cellml)
         if use_cython:
             self._import_cython()
         else:
             self._import_python()
         if y is None:
             y = self.model.y0
-        self.legend = legend(self.model)
-        dtype = dtypes(self.legend)
+        if meta:
+            self.legend = OrderedDict(meta["legend"])
+            dtype = Dotdict(meta["dtype"])
+        else:
+            self.legend = legend(self.model)
+            dtype = dtypes(self.legend)
+            self._save_metadata(self.legend, dtype)
         # Rename fields if requested
         for i in "a", "y", "p":
             if i in rename:
@@ -508,23 +703,189 @@ class Cellmlmodel(Namedcvodeint):
                     if nam in rename[i]:
                         L[j] = (rename[i][nam], typ)
                 dtype[i] = np.dtype(L)
+        if lookup:
+            self.model = self._import_lookup(lookup, dtype.y.names)
+        pr = self._storage(dtype)
+        if self.f_data_buffer is not None:
+            kwargs["f_data"] = self.f_data_buffer
+        kwargs.setdefault("native_rhs", getattr(self.model, "rhs_address", 
+            None))
+        n = len(self.model.y0)
+        sparsity = np.zeros((n, n), dtype=bool)
+        if jacobian == "colored":
+            kwargs.setdefault("jac", "colored")
+            try:
+                for i, j in rates_sparsity(self.py_code):
+                    sparsity[i, j] = True
+                kwargs.setdefault("sparsity", sparsity)
+            except NotImplementedError:
+                pass  # Cvodeint will detect sparsity by probing
+        elif jacobian:
+            jacmodule = self._import_jacobian()
+            if jacmodule:
+                kwargs.setdefault("jac", self._jacobian_function(jacmodule))
+                kwargs.setdefault("native_jac", self._native_jacobian(
+                    jacmodule))
+                for i, j in jacmodule.nonzero:
+                    sparsity[i, j] = True
+                kwargs.setdefault("sparsity", sparsity)
+        self._jacobian = jacobian
+        super(Cellmlmodel, self).__init__(self.model.ode, t, 
+            y.view(dtype.y), pr, **kwargs)
+        assert all(dtype[k] == self.dtype[k] for k in self.dtype)
+        self.dtype.update(dtype)
+        self.originals["y0r"] = self.y0r
+        if p:
+            self._getpar()[:] = p
+        # Attributes added later, e.g. by subclasses, are kept by spec()
+        self._base_attrs = frozenset(self.__dict__)
+    
+    @property
+    def tree(self):
+        """
+        The CellML source parsed with lxml, or None if not available.
+        
+        Parsing is deferred until first use, because constructing a model 
+        with cached metadata does not need it; see :meth:`_load_metadata`.
+        """
+        if (self._tree is None) and self.cellml:
+            self._tree = parse_xml(self.cellml)
+        return self._tree
+    
+    def _parse_name(self):
+        """Name of the model, from the CellML 1.0 or 1.1 source."""
+        from lxml import etree  # deferred import to minimize startup time
+        try:
+            name = etree.ETXPath("//{%s}model/@name" % cml)(self.tree)[0]
+        except IndexError:
+            name = etree.ETXPath("//{%s}model/@name" % cml.replace(
+                "1.0", "1.1"))(self.tree)[0]
+        return str(name)  # not an lxml "smart string", which can't pickle
+    
+    def _load_metadata(self):
+        """
+        Cached name, legend and dtypes of this model, or None if not cached.
+        
+        Metadata are saved by :meth:`_save_metadata` as ``metadata.pickle`` 
+        in the model directory, so constructing the model again needs 
+        neither the parsed CellML nor the legends of the generated module. 
+        Each process also keeps them in memory, keyed by the URL and the 
+        hash of the CellML source.
+        """
+        key = self.url, self.hash
+        if key not in _metadata:
+            try:
+                with open(os.path.join(self.packagedir, "metadata.pickle"), 
+                    "rb") as f:
+                    meta = cPickle.load(f)
+            except StandardError:
+                return None  # missing, or from an incompatible version
+            if meta.get("version") != metadata_version:
+                return None
+            _metadata[key] = meta
+        return _metadata[key]
+    
+    def _save_metadata(self, legend_, dtype):
+        """Save metadata for :meth:`_load_metadata`."""
+        meta = dict(version=metadata_version, name=self.name, 
+            legend=legend_.items(), dtype=dict(dtype))
+        with write_atomically(os.path.join(self.packagedir, 
+            "metadata.pickle"), "wb") as f:
+            cPickle.dump(meta, f, cPickle.HIGHEST_PROTOCOL)
+        _metadata[self.url, self.hash] = meta
+    
+    def _storage(self, dtype):
+        """
+        Set *algebraic*, *y0r*, *f_data_buffer*; return parameter recarray.
+        
+        If the generated module supports it, each instance has its own 
+        parameters, default initial state and workspace for algebraic 
+        variables. Parameters and workspace share one array, 
+        *f_data_buffer*, which is passed to the right-hand side as *f_data*. 
+        Compiled models also keep quantities that depend only on parameters 
+        there, see :func:`~cgp.physmod.cythonize.optimize_code`. 
+        Otherwise, these are views of module-level arrays shared by all 
+        instances of the model, and *f_data_buffer* is None.
+        """
+        m = self.model
+        if getattr(m, "per_instance", False):
+            self.f_data_buffer = np.concatenate([m.p, m.algebraic, 
+                getattr(m, "workspace", [])])
+            par = self.f_data_buffer[:len(m.p)]
+            algebraic = self.f_data_buffer[len(m.p):
+                len(m.p) + len(m.algebraic)]
+            y0 = np.copy(m.y0)
+        else:
+            self.f_data_buffer = None
+            par, algebraic, y0 = m.p, m.algebraic, m.y0
+        self._par = par
         # if there are no parameters or algebraic variables, make empty recarray
         try:
-            pr = self.model.p.view(dtype.p, np.recarray)
+            pr = par.view(dtype.p, np.recarray)
         except TypeError:
             pr = np.array([]).view(np.recarray)
         try:
-            self.algebraic = self.model.algebraic.view(dtype.a, np.recarray)
+            self.algebraic = algebraic.view(dtype.a, np.recarray)
         except TypeError:
             self.algebraic = np.array([]).view(np.recarray)
-        self.y0r = self.model.y0.view(dtype.y, np.recarray)
-        super(Cellmlmodel, self).__init__(self.model.ode, t, 
-            y.view(dtype.y), pr, **kwargs)
-        assert all(dtype[k] == self.dtype[k] for k in self.dtype)
+        self.y0r = y0.view(dtype.y, np.recarray)
+        return pr
+    
+    def spec(self):
+        """
+        Compact, picklable :class:`ModelSpec` for rebuilding this model.
+        
+        >>> vdp = Cellmlmodel()
+        >>> vdp.pr.epsilon = 2.0
+        >>> new = pickle.loads(pickle.dumps(vdp.spec())).build()
+        >>> new.pr.epsilon, new.dtype == vdp.dtype
+        (array([ 2.]), True)
+        """
+        return ModelSpec(self)
+    
+    def _init_from_spec(self, spec, module):
+        """Initialize from a :class:`ModelSpec`, given the imported module."""
+        for k in ModelSpec.identifiers:
+            setattr(self, k, getattr(spec, k))
+        self.cellml = self._tree = None  # not needed for integration
+        self.model = module
+        self._read_py_code()
+        self.legend = legend(module)
+        dtype = Dotdict(spec.dtype)
+        pr = self._storage(dtype)
+        kwargs = dict(spec.kwargs)
+        if self.f_data_buffer is not None:
+            kwargs["f_data"] = self.f_data_buffer
+        kwargs.setdefault("native_rhs", getattr(module, "rhs_address", None))
+        self._jacobian = spec.jacobian
+        if spec.jacobian == "colored":
+            kwargs["jac"] = "colored"
+        elif spec.jacobian:
+            jacmodule = self._import_jacobian()
+            if jacmodule:
+                kwargs["jac"] = self._jacobian_function(jacmodule)
+                kwargs.setdefault("native_jac", self._native_jacobian(
+                    jacmodule))
+        super(Cellmlmodel, self).__init__(module.ode, spec.t, 
+            spec.y.view(dtype.y), pr, check=False, **kwargs)
         self.dtype.update(dtype)
         self.originals["y0r"] = self.y0r
-        if p:
-            self.model.p[:] = p
+        self._base_attrs = frozenset(self.__dict__)
+    
+    def _build_lock(self):
+        """
+        Lock held while generating or compiling code for this model.
+        
+        Code is built once per model hash. Concurrent processes, e.g. the 
+        tasks of an array job on a cluster, wait for the lock and then import 
+        what the first process built. Each artifact is published atomically, 
+        so a process that imports without waiting never sees a partial file. 
+        A process that waits longer than :data:`build_timeout` gets IOError.
+        """
+        with write_if_not_exists(os.path.join(self.packagedir, "__init__.py")):
+            pass  # just create empty __init__.py to make a package
+        return Lock(os.path.join(self.packagedir, "build.lock"), 
+            retry_delay=1, max_wait=build_timeout)
     
     def _import_python(self):
         """Import Python module with right-hand-side for this model."""
@@ -532,22 +893,40 @@ class Cellmlmodel(Namedcvodeint):
         try:
             self.model = import_module(".py", self.package)
         except ImportError:
-            with write_if_not_exists(os.path.join(self.packagedir, 
-                                                  "__init__.py")) as f:
-                pass  # just create empty __init__.py to make a package
-            with write_if_not_exists(os.path.join(self.packagedir, 
-                self.url.rsplit("/", 1)[-1])) as f:
-                f.write(urlcache(self.url))
-            with write_if_not_exists(py_file) as f:
-                if self.localfile:
-                    f.write(urlcache(
-                        "http://bebiservice.umb.no/bottle/cellml2py", 
-                        data=urllib.urlencode(dict(cellml=self.cellml))))
-                else:
-                    f.write(
-                        urlcache("http://bebiservice.umb.no/bottle/cellml2py/" 
-                        + self.url))
+            with self._build_lock():
+                # Another process may have built it while we waited
+                if not os.path.exists(py_file):
+                    with write_atomically(py_file) as f:
+                        f.write(self._generate_py())
             self.model = import_module(".py", self.package)
+        self._read_py_code()
+    
+    def _generate_py(self):
+        """
+        Python code for this model, including :data:`py_addendum`.
+        
+        The code is generated in-process from the parsed CellML by 
+        :func:`cgp.physmod.cellml2py.generate_cached`. Models using CellML 
+        features that it does not support fall back to the code generation 
+        web service.
+        """
+        from cgp.physmod import cellml2py  # deferred import to minimize startup time
+        try:
+            code = cellml2py.generate_cached(self.cellml, codegen_dir, 
+                self.tree)
+        except NotImplementedError, exc:
+            warnings.warn("Using code generation web service for %s: %s" % 
+                (self.name, exc))
+            if self.localfile:
+                return urlcache("http://bebiservice.umb.no/bottle/cellml2py", 
+                    data=urllib.urlencode(dict(cellml=self.cellml)))
+            return urlcache("http://bebiservice.umb.no/bottle/cellml2py/" 
+                + self.url)
+        return code + py_addendum
+    
+    def _read_py_code(self):
+        """Read Python code for this model into *py_code*."""
+        py_file = os.path.join(self.packagedir, "py.py")
         try:
             with open(py_file, "rU") as f:
                 self.py_code = f.read()
@@ -562,6 +941,93 @@ class Cellmlmodel(Namedcvodeint):
         except ImportError:
             self.model = self.cythonize()
     
+    def _import_lookup(self, lookup, names):
+        """
+        Import compiled module with lookup tables for this model.
+        
+        :param dict lookup: Mapping of state name to (low, high, step).
+        :param names: Names of the state variables, in order.
+        
+        Each set of tables gets its own module, named by a hash of *lookup*, 
+        so models with and without tables can be used side by side.
+        """
+        from cgp.physmod import cellml2py  # deferred import to minimize startup time
+        if not self.py_code.startswith(cellml2py.banner):
+            raise NotImplementedError("Lookup tables need code generated by "
+                "cgp.physmod.cellml2py, %s uses the web service" % self.name)
+        tables = {}
+        for name, (lo, hi, step) in lookup.items():
+            if name not in names:
+                raise ValueError("No state variable %r for lookup table" 
+                    % name)
+            if not (lo < hi) or (step <= 0):
+                raise ValueError("Lookup table for %s needs low < high and "
+                    "step > 0, got %s" % (name, (lo, hi, step)))
+            tables[names.index(name)] = (float(lo), float(hi), float(step))
+        extname = "lut_" + hashlib.sha1(repr(sorted(tables.items()))
+            ).hexdigest()[:6]
+        module = self._build_cython(extname, lookup=tables)
+        if not getattr(module, "lookup_tables", None):
+            warnings.warn("No rate expressions of %s could be tabulated" % 
+                ", ".join(lookup))
+        return module
+    
+    def _import_jacobian(self):
+        """
+        Import module with analytic Jacobian for this model, or return None.
+        
+        The Jacobian is generated from the rate equations in the Python code 
+        by :func:`cgp.physmod.jacobian.jacobian_code`. For compiled models 
+        whose code was generated by :mod:`cgp.physmod.cellml2py`, it is 
+        compiled by :func:`cgp.physmod.cythonize.cythonize_jacobian` as the 
+        extension module ``jac``, which CVODE can call without Python 
+        callbacks. Otherwise, e.g. for code from the web service, it is 
+        saved as ``jac.py`` alongside the model code. If the equations 
+        cannot be differentiated, a warning is issued and CVODE will fall 
+        back to finite differences.
+        """
+        from cgp.physmod import cellml2py  # deferred import to minimize startup time
+        if getattr(self.model, "per_instance", False) and (
+            self.py_code.startswith(cellml2py.banner)):
+            try:
+                return self._build_cython("jac", cythonize=cythonize_jacobian)
+            except NotImplementedError:
+                pass  # not differentiable, or needs Python calls
+        jac_file = os.path.join(self.packagedir, "jac.py")
+        try:
+            return import_module(".jac", self.package)
+        except ImportError:
+            try:
+                code = jacobian_code(self.py_code)
+            except NotImplementedError, exc:
+                warnings.warn("No analytic Jacobian for %s: %s" % 
+                    (self.name, exc))
+                return None
+            with self._build_lock():
+                if not os.path.exists(jac_file):
+                    with write_atomically(jac_file) as f:
+                        f.write("from .py import *  # model namespace\n")
+                        f.write(code)
+            return import_module(".jac", self.package)
+    
+    def _jacobian_function(self, jacmodule):
+        """Return analytic Jacobian as a function of (t, y, fy, J)."""
+        p = self._par
+        
+        def jac(t, y, fy, J):  # pylint: disable=W0613
+            """Write Jacobian of model at (t, y) into J."""
+            J[:] = jacmodule.computeJacobian(t, y, p)
+        
+        return jac
+    
+    def _native_jacobian(self, jacmodule):
+        """Addresses (dense, band) of compiled Jacobian, or None."""
+        if self.f_data_buffer is None:
+            return None
+        address = (getattr(jacmodule, "dense_jac_address", None), 
+            getattr(jacmodule, "band_jac_address", None))
+        return None if None in address else address
+    
     def save_legend(self, *args, **kwargs):
         """
         Save :data:`legend` for CellML model as CSV.
@@ -609,8 +1075,24 @@ class Cellmlmodel(Namedcvodeint):
         """
         t = np.atleast_1d(t).astype(float)
         y = np.atleast_2d(y)
+        m = self.model
+        fun = getattr(m, "rates_and_algebraic_vectorized", None)
+        if (fun is None) or (m.__name__ in _scalar_only):
+            fun = m.rates_and_algebraic
+        kwargs = {}
+        if (self.f_data_buffer is not None) and hasattr(m, "workspace"):
+            # Compiled models keep parameter-only quantities in f_data
+            kwargs["work"] = self.f_data_buffer[len(m.p) + len(m.algebraic):]
         with self.autorestore(_p=par):
-            ydot, alg = self.model.rates_and_algebraic(t, y)
+            par = None if self.f_data_buffer is None else self._getpar()
+            try:
+                ydot, alg = fun(t, y, par, **kwargs)
+            except StandardError:
+                if fun is m.rates_and_algebraic:
+                    raise
+                # Fall back to evaluating one time point at a time
+                _scalar_only.add(m.__name__)
+                ydot, alg = m.rates_and_algebraic(t, y, par, **kwargs)
         ydot = ydot.squeeze().view(self.dtype.y, np.recarray)
         alg = alg.squeeze().view(self.dtype.a, np.recarray)
         return ydot, alg
@@ -620,45 +1102,44 @@ class Cellmlmodel(Namedcvodeint):
         Return Cython code for this model (further hand-tweaking may be needed).
         
         This just imports and calls 
-        :func:`cgp.physmod.cythonize.cythonize_model`.
+        :func:`cgp.physmod.cythonize.cythonize_model`, then compiles the 
+        module with :func:`build_extension` while holding the build lock, 
+        unless another process already did.
         """
-        modulename_cython = self.package + ".cy"
-        modelname = self.hash
-        modelfilename = os.path.join(self.packagedir, "cy.pyx")
+        return self._build_cython("cy")
+    
+    def _build_cython(self, extname, cythonize=cythonize_model, **options):
+        """
+        Import or build the compiled module *extname* of this model.
+        
+        The Cython code is generated by *cythonize*, by default 
+        :func:`~cgp.physmod.cythonize.cythonize_model`, which gets the 
+        options.
+        """
+        from cgp.physmod import cellml2py  # deferred import to minimize startup time
+        modulename_cython = self.package + "." + extname
         try:
             __import__(modulename_cython)
             return sys.modules[modulename_cython]
         except ImportError:
-            pyx, setup = cythonize_model(self.py_code, modelname)
-            pyx = urlcache("http://bebiservice.umb.no/bottle/cellml2cy", 
-                data=urllib.urlencode(dict(cellml=self.cellml)))
-            pyxname = modelfilename.replace("%s.py" % modelname, 
-                "cython/%s/m.pyx" % modelname)
-            dirname, _ = os.path.split(pyxname)
-            setupname = os.path.join(dirname, "setup.py")
-            # make the cython and model directories "packages"
-            cyinitname = os.path.join(dirname, os.pardir, "__init__.py")
-            modelinitname = os.path.join(dirname, "__init__.py")
-            with write_if_not_exists(cyinitname):
-                pass # just create an empty __init__.py file
-            with write_if_not_exists(modelinitname):
-                pass # just create an empty __init__.py file
-            with open(pyxname, "w") as f:
-                f.write(pyx)
-            with open(setupname, "w") as f:
-                f.write(setup)
-            cmd = "python setup.py build_ext --inplace"
-            status, output = getstatusoutput(cmd, cwd=dirname)
-            # Apparently, errors fail to cause status != 0.
-            # However, output does include any error messages.
-            if "cannot find -lsundials_cvode" in output:
-                raise OSError("Cython-compilation of ODE right-hand side "
-                    "failed because SUNDIALS was not found.\n"
-                    "Status code: %s\nCommand: %s\n"
-                    "Output (including errors):\n%s" % (status, cmd, output))
-            if status != 0:
-                raise RuntimeError("'%s'\nreturned status %s:\n%s" % 
-                    (cmd, status, output))
+            pass
+        with self._build_lock():
+            try:
+                __import__(modulename_cython)
+                return sys.modules[modulename_cython]
+            except ImportError:
+                pass
+            # Cythonize the generated code without the Python addendum
+            code = self.py_code.partition(py_addendum.split("\n")[1])[0]
+            pyx, setup = cythonize(code, self.hash, extname=extname, 
+                **options)
+            if (cythonize is cythonize_model) and not code.startswith(
+                cellml2py.banner):
+                # generated by the web service, which also cythonizes
+                pyx = urlcache("http://bebiservice.umb.no/bottle/cellml2cy", 
+                    data=urllib.urlencode(dict(cellml=self.cellml)))
+            cmd, output = build_extension(self.packagedir, extname, pyx, 
+                setup)
             try:
                 __import__(modulename_cython)
                 return sys.modules[modulename_cython]
@@ -669,6 +1150,30 @@ class Cellmlmodel(Namedcvodeint):
                     "The output of the compilation command was:\n%s"
                     % (exc.__class__.__name__, exc, cmd, output))
     
+    def lookup_error(self):
+        """
+        Interpolation error of the lookup tables for the current parameters.
+        
+        Returns a recarray with the *state* and rate *expression* of each 
+        table, the maximum absolute error *abserr* of linear interpolation 
+        between grid points, and *relerr*, the error relative to the largest 
+        absolute value of the expression on the grid. Halving the step of a 
+        table divides the error by about four.
+        
+        See the *lookup* argument to :class:`Cellmlmodel`.
+        """
+        m = self.model
+        tables = getattr(m, "lookup_tables", [])
+        errors = m.lookup_errors(self._getpar()) if tables else []
+        names = self.dtype.y.names
+        L = [(names[k], expr, err, err / maxval if maxval else 0.0) 
+            for (k, _offset, _n, _lo, _step, expr), (err, maxval) 
+            in zip(tables, errors)]
+        dtype = [("state", object), ("expression", object), 
+            ("abserr", float), ("relerr", float)]
+        return np.rec.fromrecords(L, dtype=dtype) if L else np.recarray(
+            0, dtype=dtype)
+    
     def makebench(self):
         """
         Return IPython code for benchmarking compiled vs. uncompiled ode.
@@ -745,7 +1250,8 @@ print cap
         # The href is direct for the beeler_reuter_1977 model; 
         # others are prefixed with "exposure/"
         url = self.cellml_home + fmt.format(**self.__dict__)
-        tree = etree.parse(StringIO(urlcache(url)), parser)
+        from lxml import etree  # deferred import to minimize startup time
+        tree = parse_xml(urlcache(url))
         query = ('//{http://www.w3.org/1999/xhtml}' +
             'a[text()="Latest Exposure"]/@href')
         try:
@@ -771,7 +1277,8 @@ print cap
         '371151b156888430521cbf15a9cfa5e8d854cf37'
         """
         url = self.cellml_home + fmt.format(**self.__dict__)
-        tree = etree.parse(StringIO(urlcache(url)), parser)
+        from lxml import etree  # deferred import to minimize startup time
+        tree = parse_xml(urlcache(url))
         query = ('//{http://www.w3.org/1999/xhtml}' +
             'a[contains(text(), "Download This File")]/@href')
         try:
@@ -793,13 +1300,262 @@ print cap
          'bondarenko_szigeti_bett_kim_rasmusson_2004_septal']
         """
         url = self.cellml_home + fmt.format(**self.__dict__)
-        tree = etree.parse(StringIO(urlcache(url)), parser)
+        from lxml import etree  # deferred import to minimize startup time
+        tree = parse_xml(urlcache(url))
         query = ('//{http://www.w3.org/1999/xhtml}' +
             'a[contains(@class, "contenttype-exposurefile")]')
         el = etree.ETXPath(query)(tree)
         return [e.attrib["href"].rsplit("/", 2)[-2][:-len(".cellml")] 
             for e in el]
 
+class ModelSpec(object):
+    """
+    Compact, versioned and picklable description of a :class:`Cellmlmodel`.
+    
+    Pickling a :class:`Cellmlmodel` stores its constructor arguments, 
+    so unpickling repeats the whole construction: downloading or reading 
+    the CellML source, parsing it with lxml, importing the generated code 
+    and probing the right-hand side. A spec instead holds the name of the 
+    already generated (and possibly compiled) module, the dtypes, 
+    solver settings, and the current time, state and parameter vectors. 
+    :meth:`build` imports the module and creates a ready-to-integrate model.
+    
+    Attributes added by subclasses after :meth:`Cellmlmodel.__init__`, 
+    e.g. *scenarios* of :class:`~cgp.virtexp.elphys.examples.Bond`, 
+    are included and must be picklable. Rootfinding settings are not.
+    If the generated module cannot be imported, e.g. in a process on 
+    another machine, :meth:`build` falls back to the full constructor.
+    
+    >>> vdp = Cellmlmodel()
+    >>> spec = vdp.spec()
+    >>> spec
+    ModelSpec(version=1, cls=Cellmlmodel, module='_cellml2py...')
+    >>> len(pickle.dumps(spec, 2)) < len(vdp.cellml)
+    True
+    >>> t, y, flag = spec.build().integrate(t=[0, 1])
+    >>> t0, y0, flag0 = vdp.integrate(t=[0, 1])
+    >>> np.allclose(y[-1].view(float), y0[-1].view(float))
+    True
+    """
+    version = 1
+    # Attributes identifying the model and its generated code
+    identifiers = ("url workspace exposure changeset variant localfile "
+        "name hash package packagedir").split()
+    
+    def __init__(self, model):
+        self.spec_version = self.version
+        self.cls = model.__class__
+        self.init_args = model._init_args  # pylint: disable=W0212
+        self.module = model.model.__name__
+        for k in self.identifiers:
+            setattr(self, k, getattr(model, k))
+        self.dtype = dict(model.dtype)
+        self.t = np.array(model.t, dtype=float)
+        self.tret = model.tret.value
+        self.last_flag = model.last_flag
+        self.y = np.array(model.y, dtype=float)
+        self.y0 = np.array(model.y0r).view(float)
+        self.p = np.copy(model._getpar())  # pylint: disable=W0212
+        abstol = getattr(model.abstol, "value", None)  # scalar realtype
+        if abstol is None:
+            abstol = np.array(model.abstol)  # NVector
+        self.kwargs = dict(reltol=model.reltol, abstol=abstol, 
+            chunksize=model.chunksize, maxsteps=model.maxsteps, 
+            mupper=model.mupper, mlower=model.mlower, stepper=model.stepper, 
+            copy_output=model.copy_output, profile=model.profile, 
+            sparsity=model.sparsity, 
+            warmstart=model.warmstart.maxsize if model.warmstart else 0)
+        if model.native_rhs is None:
+            # addresses differ between processes; only record opting out
+            self.kwargs["native_rhs"] = None
+        if model.native_jac is None:
+            self.kwargs["native_jac"] = None
+        self.jacobian = False
+        if isinstance(model.jac, ColoredJacobian):
+            self.jacobian = "colored"
+        elif model.jac is not None:
+            if model._jacobian:  # pylint: disable=W0212
+                self.jacobian = True
+            else:
+                self.kwargs["jac"] = model.jac  # user-supplied function
+        base = model._base_attrs  # pylint: disable=W0212
+        self.attrs = dict((k, v) for k, v in model.__dict__.items() 
+            if (k not in base) and (k != "_base_attrs"))
+    
+    def __repr__(self):
+        return "%s(version=%s, cls=%s, module=%r)" % (
+            self.__class__.__name__, self.spec_version, self.cls.__name__, 
+            self.module)
+    
+    def build(self):  # pylint: disable=W0212
+        """Return a model with the specified settings, time and state."""
+        if self.spec_version != self.version:
+            raise ValueError("Model spec has version %s, expected %s" % 
+                (self.spec_version, self.version))
+        _ensure_package()
+        try:
+            module = import_module(self.module)
+        except ImportError:
+            warnings.warn("Generated module %s not found, reconstructing %s" 
+                % (self.module, self.name))
+            args, kwargs = self.init_args
+            obj = self.cls(*args, **kwargs)
+            obj._ReInit_if_required(self.t, self.y)
+        else:
+            args, kwargs = self.init_args
+            obj = self.cls.__new__(self.cls, *args, **kwargs)
+            obj._init_from_spec(self, module)
+        if obj.tret.value != self.tret:
+            # Continue from the time of the saved state
+            obj._ReInit_if_required([self.tret, self.t[-1]], self.y)
+            obj.t = self.t
+        obj.last_flag = self.last_flag
+        obj.__dict__.update(self.attrs)
+        obj._getpar()[:] = self.p
+        obj.y0r.view(float)[:] = self.y0
+        return obj
+
+def bench_unpickle(model, t=None):
+    """
+    Time to first integration for a model unpickled whole or via its spec.
+    
+    :param model: A :class:`Cellmlmodel`, whose class must be picklable.
+    :param t: Time argument to :meth:`integrate`.
+    :return dict: Seconds from :func:`pickle.loads` until the first call to 
+        :meth:`integrate` has returned, for ``"model"`` (the whole object) 
+        and ``"spec"`` (:meth:`Cellmlmodel.spec`).
+    
+    Run this in a fresh process to include the cost of importing the 
+    generated module, as in a newly started worker.
+    
+    >>> bench_unpickle(Cellmlmodel())  # doctest: +SKIP
+    {'model': 0.0412..., 'spec': 0.0021...}
+    """
+    result = {}
+    for key, obj in ("model", model), ("spec", model.spec()):
+        s = pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+        tic = time.time()
+        new = pickle.loads(s)
+        if key == "spec":
+            new = new.build()
+        with new.autorestore():
+            new.integrate(t=t)
+        result[key] = time.time() - tic
+    return result
+
+def bench_optimize(localfiles=None, repeat=3):
+    """
+    Right-hand-side evaluations per second, before and after optimization.
+    
+    :param list localfiles: Names of models in cgp/physmod/_cellml, 
+        by default all of them.
+    :param int repeat: Take the best of this many calls to the bench() 
+        function of the compiled module, which calls ode() 10000 times.
+    :return dict: Mapping model name to evaluations per second when compiled 
+        with ``optimize=False`` and ``optimize=True`` in 
+        :func:`~cgp.physmod.cythonize.cythonize_model`.
+    
+    Each model is compiled twice, in temporary directories.
+    
+    >>> bench_optimize(["hodgkin_huxley_1952", "li_uhc"])  # doctest: +SKIP
+    {'hodgkin_huxley_1952': (..., ...), 'li_uhc': (..., ...)}
+    """
+    cellmldir = os.path.join(cgp.__path__[0], "physmod", "_cellml")
+    if localfiles is None:
+        localfiles = sorted(os.path.splitext(i)[0] 
+            for i in os.listdir(cellmldir) if i.endswith(".cellml"))
+    result = {}
+    for name in localfiles:
+        m = Cellmlmodel(localfile=name, use_cython=False)
+        code = m.py_code.partition(py_addendum.split("\n")[1])[0]
+        rates = []
+        for optimize in False, True:
+            pyx, setup = cythonize_model(code, m.hash, optimize=optimize)
+            dirname = mkdtemp()
+            try:
+                build_extension(dirname, "cy", pyx, setup)
+                module = imp.load_module("cy", *imp.find_module("cy", 
+                    [dirname]))
+                del sys.modules["cy"]
+                best = min(timeit.repeat(module.bench, number=1, 
+                    repeat=repeat))
+                rates.append(10000 / best)
+            finally:
+                shutil.rmtree(dirname, ignore_errors=True)
+        result[name] = tuple(rates)
+    return result
+
+def bench_rhs(model, number=10000, repeat=3):
+    """
+    Microseconds per right-hand-side call through a CVODE function pointer.
+    
+    :param model: A :class:`Cellmlmodel`.
+    :param int number: Calls per timing.
+    :param int repeat: Take the best of this many timings.
+    :return dict: ``"python"``: the model's ode() behind the ctypes 
+        callback that pysundials gives CVODE; ``"native"``: the compiled 
+        function at *rhs_address*, if the model has one.
+    
+    Both are called as CVODE would call them, with the model's current 
+    state and *f_data*. The timings include the cost of calling a ctypes 
+    function pointer from Python, which CVODE does not pay, so their 
+    difference is the overhead of the Python path.
+    
+    >>> bench_rhs(Cellmlmodel(localfile="hodgkin_huxley_1952"))
+    ... # doctest: +SKIP
+    {'native': 3.0..., 'python': 10.1...}
+    """
+    from pysundials import cvode
+    calls = dict(python=cvode.WrapCallbackCVRhsFn(model.my_f_ode))
+    address = getattr(model.model, "rhs_address", None)
+    if address is not None:
+        calls["native"] = cvode.CVRhsFn(address)
+    ydot = cvode.NVector(np.zeros(len(model.y)))
+    f_data = model.f_data_buffer
+    args = (model.t0, model.y.data, ydot.data, 
+        None if f_data is None else f_data.ctypes.data)
+    result = {}
+    for key, fun in calls.items():
+        seconds = min(timeit.repeat(lambda: fun(*args), number=number, 
+            repeat=repeat))
+        result[key] = 1e6 * seconds / number
+    return result
+
+def prebuild(model, use_cython=True, jacobian=False):
+    """
+    Generate and compile code for a CellML model, return its directory.
+    
+    :param str model: Workspace name at cellml.org, URL of a CellML file, 
+        path to a CellML file, or name of a file in cgp/physmod/_cellml 
+        (with or without the .cellml extension).
+    :param bool use_cython: Compile the model?
+    :param bool jacobian: Also generate an analytic Jacobian?
+    
+    Run this once before starting many processes that use the model, e.g. 
+    an array job on a cluster, so that they can all import the compiled 
+    model at once. This is also available from the command line::
+    
+        python -m cgp --prebuild <model> [<model> ...]
+    
+    >>> prebuild("fitzhugh_1961", use_cython=False)
+    '/.../_cellml2py/_...'
+    """
+    localfile = model[:-len(".cellml")] if model.endswith(".cellml") else model
+    if "://" in model or model.startswith("file:"):
+        kwargs = dict(url=model)
+    elif os.path.exists(os.path.join(cgp.__path__[0], "physmod", "_cellml", 
+        localfile + ".cellml")):
+        kwargs = dict(localfile=localfile)
+    elif os.path.isfile(model):
+        kwargs = dict(url="file:" + 
+            urllib.pathname2url(os.path.abspath(model)))
+    else:
+        kwargs = dict(workspace=model)
+    m = Cellmlmodel(use_cython=use_cython, **kwargs)
+    if jacobian:
+        m._import_jacobian()  # pylint: disable=W0212
+    return m.packagedir
+
 def test_cellmlmodel():
     """
     >>> c = Cellmlmodel("http://models.cellml.org/workspace/"
@@ -1,15 +1,44 @@
 """Cythonize the generated Python code for a CellML model."""
+from collections import namedtuple
+from copy import deepcopy
+import ast
+import math
+import operator
 import re # Used to replace certain functions with Cython versions
+import textwrap
 
 from ..utils import codegen
 
-def cythonize_model(s, modelname=""):
+# Functions that generated rate code may call without holding the GIL:
+# C math functions declared in the Cython template, the cy_ comparisons,
+# and builtins that Cython translates to C for double arguments.
+NOGIL_CALLS = set("""exp log log10 sqrt pow floor ceil fabs abs
+    sin cos tan asin acos atan sinh cosh tanh
+    cy_equal cy_less cy_greater cy_less_equal cy_greater_equal""".split())
+
+def cythonize_model(s, modelname="", optimize=True, lookup=None, 
+    extname="cy"):
     """
     Cythonize the generated Python code for a CellML model.
     
     :param str s: original Python source code
     :param str modelname: name of model
+    :param bool optimize: simplify the rate equations with 
+        :func:`optimize_code`?
+    :param dict lookup: lookup tables for :func:`optimize_code`, mapping 
+        state index to (low, high, step)
+    :param str extname: name of the extension module built by setup.py
     :rtype str: Cython source code
+    
+    If the rate equations need no Python calls, the module has an integer 
+    *rhs_address*, the address of a C function with the signature of 
+    CVODE's right-hand side, which CVODE can call directly instead of 
+    going through the Python function ode(). Otherwise, it is None.
+    
+    With lookup tables, the module has a list *lookup_tables* of 
+    (state index, offset, number of points, low, step, expression) and a 
+    function ``lookup_errors(par=None)`` that returns the maximum absolute 
+    interpolation error and maximum absolute value of each table.
     """
     # declare constants as float to avoid integer division of constants
     s = s.replace(
@@ -34,11 +63,24 @@ from pysundials.cvode import NVector
 ftype = np.float64 # explicit type declaration, can be used with cython
 ctypedef np.float64_t dtype_t
 
-cdef extern from "math.h":
+cdef extern from "math.h" nogil:
     dtype_t log(dtype_t x)
+    dtype_t log10(dtype_t x)
     dtype_t exp(dtype_t x)
+    dtype_t sqrt(dtype_t x)
+    dtype_t pow(dtype_t x, dtype_t y)
     dtype_t floor(dtype_t x)
+    dtype_t ceil(dtype_t x)
     dtype_t fabs(dtype_t x)
+    dtype_t sin(dtype_t x)
+    dtype_t cos(dtype_t x)
+    dtype_t tan(dtype_t x)
+    dtype_t asin(dtype_t x)
+    dtype_t acos(dtype_t x)
+    dtype_t atan(dtype_t x)
+    dtype_t sinh(dtype_t x)
+    dtype_t cosh(dtype_t x)
+    dtype_t tanh(dtype_t x)
 
 cdef extern from "Python.h":
     ctypedef struct PyObject
@@ -59,16 +101,43 @@ ydot = np.zeros(sizeStates, dtype=ftype)
 p = np.zeros(sizeConstants, dtype=ftype)
 algebraic = np.zeros(sizeAlgebraic, dtype=ftype)
 
+# Quantities that depend only on parameters, followed by the parameter 
+# values they were computed from, see cgp.physmod.cythonize.optimize_code()
+cpdef int sizeWorkspace = WORKSPACE_SIZE
+workspace = np.empty(sizeWorkspace, dtype=ftype)
+workspace.fill(np.nan)  # not computed for any parameter values yet
+
 # Pointers to array of dtype_t, fast access from Cython
 cdef dtype_t* py0 = bufarr(y0)
 cdef dtype_t* pydot = bufarr(ydot)
 cdef dtype_t* pp = bufarr(p)
 cdef dtype_t* palgebraic = bufarr(algebraic)
+cdef dtype_t* pworkspace = bufarr(workspace)
+
+# ode() and rates_and_algebraic() accept a per-instance f_data buffer
+per_instance = True
+
+cdef inline dtype_t* bufpar(f_data):
+    """
+    Parameters followed by workspace, or the module-level p.
+    
+    The workspace holds algebraic variables, then the precomputed 
+    quantities in the module-level workspace. 
+    f_data is a Numpy array when called from Python, 
+    and a memory address when called by CVODE.
+    """
+    if f_data is None:
+        return pp
+    if isinstance(f_data, np.ndarray):
+        return bufarr(f_data)
+    return <dtype_t*><size_t>f_data
 
 cpdef int ode(dtype_t t, y, ydot, f_data):
     cdef dtype_t *py, *pydot # pointers to buffers
-    cdef str msg = "Use of f_data not implemented; use global array p instead"
-    assert f_data is None, msg
+    # parameters and algebraic workspace, per instance unless f_data is None
+    cdef dtype_t *ppar = bufpar(f_data)
+    cdef dtype_t *palg = palgebraic if f_data is None else ppar + sizeConstants
+    cdef dtype_t *pwork = pworkspace if f_data is None else palg + sizeAlgebraic
     # make this work with both numpy.ndarray and pysundials.cvode.NVector
     if isinstance(y, NVector):
         py = bufnv(y)
@@ -87,11 +156,12 @@ cpdef int ode(dtype_t t, y, ydot, f_data):
         pydot[i] = 0.0
     # algebraic.fill(0.0)
     for i in range(sizeAlgebraic):
-        palgebraic[i] = 0.0
-    compute_rates(t, py, pydot, pp, palgebraic)
+        palg[i] = 0.0
+    COMPUTE_RATES_CALL
     return 0
 
-def rates_and_algebraic(np.ndarray[dtype_t, ndim=1] t, y):
+def rates_and_algebraic(np.ndarray[dtype_t, ndim=1] t, y, par=None, 
+    work=None):
     """
     Compute rates and algebraic variables for a given state trajectory.
     
@@ -99,6 +169,9 @@ def rates_and_algebraic(np.ndarray[dtype_t, ndim=1] t, y):
     algebraic variables during integration. This function re-computes the rates 
     and algebraics at each time step for the given state.
     
+    par is the parameter vector, by default the module-level p. 
+    work is as for rates_and_algebraic_into().
+    
     >>> from cgp.physmod.cellmlmodel import Cellmlmodel
     >>> workspace = "bondarenko_szigeti_bett_kim_rasmusson_2004"
     >>> bond = Cellmlmodel(workspace, t=[0, 20])
@@ -118,19 +191,60 @@ def rates_and_algebraic(np.ndarray[dtype_t, ndim=1] t, y):
     >>> np.testing.assert_almost_equal(alg, algp, decimal=5)
     """
     cdef int imax = len(t)
-    y = y.view(ftype)
-    ydot = np.zeros_like(y)
-    alg = np.zeros((imax, len(algebraic)))
-    cdef double* py
-    cdef double* pydot
-    cdef double * palgebraic
-    cdef int i
+    ydot = np.empty((imax, sizeStates), dtype=ftype)
+    alg = np.empty((imax, sizeAlgebraic), dtype=ftype)
+    return rates_and_algebraic_into(t, y, ydot, alg, par, work)
+
+def rates_and_algebraic_into(np.ndarray[dtype_t, ndim=1] t, y, 
+    np.ndarray[dtype_t, ndim=2, mode="c"] ydot, 
+    np.ndarray[dtype_t, ndim=2, mode="c"] alg, par=None, work=None):
+    """
+    Like rates_and_algebraic(), but writing into caller-supplied arrays.
+    
+    ydot and alg must be C-contiguous float arrays of shape 
+    (len(t), sizeStates) and (len(t), sizeAlgebraic). Nothing is allocated 
+    if y is a C-contiguous float array and par is None or a float array, 
+    so the buffers can be reused across calls.
+    
+    work holds the quantities that depend only on parameters, which are 
+    recomputed only when par differs from the values they were computed 
+    from. It is a float array of length sizeWorkspace, such as the part of 
+    a model's f_data buffer that follows the parameters and algebraic 
+    variables. By default, the module-level workspace is used.
+    """
+    cdef int imax = len(t)
+    if (ydot.shape[0] != imax) or (ydot.shape[1] != sizeStates):
+        raise ValueError("ydot must have shape (%s, %s)" % (imax, sizeStates))
+    if (alg.shape[0] != imax) or (alg.shape[1] != sizeAlgebraic):
+        raise ValueError("alg must have shape (%s, %s)" % 
+            (imax, sizeAlgebraic))
+    y = np.ascontiguousarray(y).view(ftype)
+    if y.size != imax * sizeStates:
+        raise ValueError("y must have %s rows of %s states" % 
+            (imax, sizeStates))
+    if par is not None:
+        par = np.ascontiguousarray(par, dtype=ftype)
+    cdef dtype_t* ppar = bufpar(par)
+    cdef dtype_t* py = bufarr(y)
+    cdef dtype_t* pydot = bufarr(ydot)
+    cdef dtype_t* palg = bufarr(alg)
+    if work is None:
+        work = workspace
+    elif (not isinstance(work, np.ndarray)) or (work.dtype != ftype) or (
+        not work.flags.c_contiguous) or (len(work) != sizeWorkspace):
+        raise ValueError("work must be a C-contiguous float array of "
+            "length %s" % sizeWorkspace)
+    cdef dtype_t* pwork = bufarr(work)
+    cdef int i, j
+    for i in range(imax * sizeStates):
+        pydot[i] = 0.0
+    for i in range(imax * sizeAlgebraic):
+        palg[i] = 0.0
     for i in range(imax):
-        py = bufarr(y[i])
-        pydot = bufarr(ydot[i])
-        palgebraic = bufarr(alg[i])
-        compute_rates(t[i], py, pydot, pp, palgebraic)
-        compute_algebraic(t[i], py, pp, palgebraic)
+        j = i * sizeStates
+        compute_rates(t[i], py + j, pydot + j, ppar, 
+            palg + i * sizeAlgebraic, pwork)
+        compute_algebraic(t[i], py + j, ppar, palg + i * sizeAlgebraic)
     return ydot, alg
 
 
@@ -151,31 +265,72 @@ def computeRates(voi, states, constants):
     L = [repcp(line) for line in compute_rates_code.split("\n")]
     # Replace some functions with Cython replacements
     L = [prepend("cy_", w, line) for line in L]
+    L = [re.sub(r"\bpower\(", "pow(", line) for line in L]
     compute_rates_code = "\n".join(L)
+    # release the GIL while computing rates, unless Python calls remain
+    nogil = releases_gil(compute_rates_code.replace(s0.strip(), ""))
+    opt = Optimized(None, [], 0, [])
+    if optimize and nogil:
+        head, _sep, body = compute_rates_code.partition(s0.strip())
+        opt = optimize_code(body, hoist=True, lookup=lookup)
+        compute_rates_code = head + s0.strip() + opt.body
+    s = s.replace("WORKSPACE_SIZE", str(opt.size))
+    nogil = " nogil" if nogil else ""
+    if nogil:
+        call = ("with nogil:\n"
+                "        compute_rates(t, py, pydot, ppar, palg, pwork)")
+    else:
+        call = "compute_rates(t, py, pydot, ppar, palg, pwork)"
+    s = s.replace("COMPUTE_RATES_CALL", call)
     s += compute_rates_code.replace(s0.strip(), """
 
 ## BEGIN Added by cythonize_model() ##
 
-cdef inline bint cy_equal(dtype_t x, dtype_t y):
+cdef inline bint cy_equal(dtype_t x, dtype_t y) nogil:
     return x == y
 
-cdef inline bint cy_greater(dtype_t x, dtype_t y):
+cdef inline bint cy_greater(dtype_t x, dtype_t y) nogil:
     return x > y
 
-cdef inline bint cy_less(dtype_t x, dtype_t y):
+cdef inline bint cy_less(dtype_t x, dtype_t y) nogil:
     return x < y
 
-cdef inline bint cy_greater_equal(dtype_t x, dtype_t y):
+cdef inline bint cy_greater_equal(dtype_t x, dtype_t y) nogil:
     return x >= y
 
-cdef inline bint cy_less_equal(dtype_t x, dtype_t y):
+cdef inline bint cy_less_equal(dtype_t x, dtype_t y) nogil:
     return x <= y
 
+cdef inline dtype_t interpolate(dtype_t* table, int i, dtype_t f) nogil:
+    return table[i] + f * (table[i + 1] - table[i])
+
 cimport cython
 @cython.cdivision(True)
-cdef void compute_rates(dtype_t voi, dtype_t* states, dtype_t* rates, dtype_t* constants, dtype_t* algebraic):
+cdef void compute_rates(dtype_t voi, dtype_t* states, dtype_t* rates, dtype_t* constants, dtype_t* algebraic, dtype_t* work)%s:
     pass  # in case function body is empty
-""") + "\n"
+""" % nogil) + "\n"
+    if opt.precompute:
+        s += """
+@cython.cdivision(True)
+cdef void precompute(dtype_t* constants, dtype_t* work) nogil:
+    # Quantities that depend only on parameters, see optimize_code()
+    cdef int _i
+    cdef dtype_t _x, _v
+""" + "".join("    %s\n" % line for line in opt.precompute)
+        for j, (_k, offset, n, lo, step, _expr) in enumerate(opt.tables):
+            s += lookup_fill % dict(j=j, offset=offset, n=n, lo=lo, 
+                step=step, h=1e-3 * step)
+    if opt.tables:
+        s += """
+@cython.cdivision(True)
+cdef dtype_t lookup_exact(int j, dtype_t x, dtype_t* constants, dtype_t* work) nogil:
+    # Exact value of expression j in lookup_tables at state x
+""" + "".join("    if j == %s:\n        return %s\n" % (j, expr) 
+            for j, (_k, _o, _n, _l, _s, expr) in enumerate(opt.tables))
+        s += "    return 0\n\nlookup_tables = %r\n" % opt.tables
+        s += lookup_errors
+    # CVODE can call compute_rates() directly if it needs no Python calls
+    s += native_rhs if nogil else "\nrhs_address = None\n"
 
 
     # make compute_algebraic() a cythonized version of computeAlgebraic()
@@ -195,13 +350,20 @@ def computeAlgebraic(constants, states, voi):
     L = [repcp(line) for line in compute_algebraic_code.split("\n")]
     # Replace some functions with Cython replacements
     L = [prepend("cy_", w, line) for line in L]
+    L = [re.sub(r"\bpower\(", "pow(", line) for line in L]
     compute_algebraic_code = "\n".join(L) + "\n"
+    nogil = releases_gil(compute_algebraic_code.replace(s0, ""))
+    if optimize and nogil:
+        head, _sep, body = compute_algebraic_code.partition(s0)
+        body = optimize_code(body).body
+        compute_algebraic_code = head + s0 + body + "\n"
+    nogil = " nogil" if nogil else ""
     s += compute_algebraic_code.replace(s0, """
 
 @cython.cdivision(True)
-cdef void compute_algebraic(dtype_t voi, dtype_t* states, dtype_t* constants, dtype_t* algebraic):
+cdef void compute_algebraic(dtype_t voi, dtype_t* states, dtype_t* constants, dtype_t* algebraic)%s:
     pass # in case there is no function body left after eliminating s0
-""") + "\n"
+""" % nogil) + "\n"
 
 
     s += '''
@@ -236,9 +398,68 @@ y0[:], p[:] = initConsts()
 
 ## END Added by cythonize_model() ##
 '''
-    # Percent literals must be doubled when using string interpolation,
-    # e.g. %%M%% to get %M%
-    setup = '''
+    return s, setup_template % dict(modelname=modelname, extname=extname)
+
+def cythonize_jacobian(s, modelname="", extname="jac"):
+    """
+    Cython code for the analytic Jacobian of a CellML model.
+    
+    :param str s: Python source code generated by 
+        :mod:`cgp.physmod.cellml2py`
+    :param str modelname: name of model
+    :param str extname: name of the extension module built by setup.py
+    :return: Cython source code and setup.py, as for :func:`cythonize_model`
+    :raises NotImplementedError: if the rates cannot be differentiated, 
+        or their derivatives need Python calls
+    
+    The Jacobian from :func:`cgp.physmod.jacobian.jacobian_code` becomes a 
+    nogil C function that writes the structurally nonzero entries in place. 
+    The module has integers *dense_jac_address* and *band_jac_address*, 
+    the addresses of C functions with the signatures of CVODE's 
+    CVDenseJacFn and CVBandJacFn, see 
+    :class:`cgp.cvodeint.core.Cvodeint` (native_jac=...). Their jac_data 
+    must be the per-instance f_data buffer of the model. Like the Python 
+    version, it also has ``computeJacobian(voi, states, constants)`` and 
+    the list of indices ``nonzero``.
+    """
+    from .jacobian import jacobian_code
+    code = jacobian_code(s)
+    sizes = re.findall(r"^(size(?:Algebraic|States|Constants)) = (\d+)$", 
+        s, re.M)
+    nonzero = re.search(r"^nonzero = (.*)$", code, re.M).group(1)
+    w = "equal less greater less_equal greater_equal".split()
+    body = code.partition("    jac = np.zeros((sizeStates, sizeStates))\n")[2]
+    L = []
+    derivatives = []
+    for line in body.splitlines():
+        target, _sep, value = line.strip().partition(" = ")
+        if target in ("rates", "algebraic") or target.startswith("return"):
+            continue  # rates and algebraic are buffers in the C function
+        value = re.sub(r"\bpower\(", "pow(", prepend("cy_", w, repcp(value)))
+        m = re.match(r"jac\[(\d+), (\d+)\]$", target)
+        if m:
+            # row i of column j, skipped if outside the band
+            i, j = int(m.group(1)), int(m.group(2))
+            L.append("    if %s <= ml and %s <= mu: jac[%s * ld + off + %s] = %s"
+                % (i - j, j - i, j, i, value))
+        else:
+            if target.startswith("d_"):
+                derivatives.append(target)
+            L.append("    %s = %s" % (target, value))
+    body = "\n".join(L)
+    if not releases_gil(body):
+        raise NotImplementedError("Jacobian of %s needs Python calls" % 
+            modelname)
+    if derivatives:
+        body = "    cdef dtype_t %s\n%s" % (", ".join(derivatives), body)
+    pyx = native_jacobian % dict(modelname=modelname, body=body, 
+        nonzero=nonzero, sizes="".join("cpdef int %s = %s\n" % i 
+            for i in sizes))
+    return pyx, setup_template % dict(modelname=modelname, extname=extname)
+
+# setup.py for a compiled extension of a model. Percent literals must be 
+# doubled when using string interpolation, e.g. %%M%% to get %M%
+setup_template = '''
 """
 %(modelname)s setup file.
 Usage: python setup.py build_ext --inplace
@@ -260,7 +481,7 @@ import numpy as np
 import platform
 import os
 
-extname = "cy"
+extname = "%(extname)s"
 HOME = os.environ["HOME"]
 
 if platform.system() == "Windows":
@@ -291,7 +512,204 @@ setup(
     ext_modules = ext_modules
 )
 '''
-    return s, setup % dict(modelname=modelname)
+
+# Analytic Jacobian for CVODE, see cythonize_jacobian(). Matrix entry (i, j) 
+# is jac[j * ld + off + i]: ld = M and off = 0 for a dense matrix, 
+# ld = smu + ml and off = smu for a band matrix, whose columns hold 
+# smu + ml + 1 entries starting at row j - smu, as laid out by SUNDIALS 2.3 
+# (sundials_dense.h, sundials_band.h). Entries more than mu above or ml 
+# below the diagonal are skipped.
+native_jacobian = """# %(modelname)s Jacobian generated by cgp.physmod.cythonize.cythonize_jacobian()
+cimport cython
+cimport numpy as np
+import numpy as np
+
+ctypedef np.float64_t dtype_t
+
+cdef extern from "math.h" nogil:
+    dtype_t log(dtype_t x)
+    dtype_t log10(dtype_t x)
+    dtype_t exp(dtype_t x)
+    dtype_t sqrt(dtype_t x)
+    dtype_t pow(dtype_t x, dtype_t y)
+    dtype_t floor(dtype_t x)
+    dtype_t ceil(dtype_t x)
+    dtype_t fabs(dtype_t x)
+    dtype_t sin(dtype_t x)
+    dtype_t cos(dtype_t x)
+    dtype_t tan(dtype_t x)
+    dtype_t asin(dtype_t x)
+    dtype_t acos(dtype_t x)
+    dtype_t atan(dtype_t x)
+    dtype_t sinh(dtype_t x)
+    dtype_t cosh(dtype_t x)
+    dtype_t tanh(dtype_t x)
+
+cdef inline bint cy_equal(dtype_t x, dtype_t y) nogil:
+    return x == y
+
+cdef inline bint cy_greater(dtype_t x, dtype_t y) nogil:
+    return x > y
+
+cdef inline bint cy_less(dtype_t x, dtype_t y) nogil:
+    return x < y
+
+cdef inline bint cy_greater_equal(dtype_t x, dtype_t y) nogil:
+    return x >= y
+
+cdef inline bint cy_less_equal(dtype_t x, dtype_t y) nogil:
+    return x <= y
+
+%(sizes)s
+nonzero = %(nonzero)s
+
+ctypedef struct NVectorContent:
+    long length
+    int own_data
+    dtype_t* data
+
+ctypedef struct NVectorStruct:
+    NVectorContent* content
+    void* ops
+
+ctypedef struct DenseMatStruct:
+    long M
+    long N
+    dtype_t** data
+
+ctypedef struct BandMatStruct:
+    long size
+    long mu
+    long ml
+    long smu
+    dtype_t** data
+
+@cython.cdivision(True)
+cdef void compute_jacobian(dtype_t voi, dtype_t* states, dtype_t* constants, dtype_t* algebraic, dtype_t* rates, dtype_t* jac, long ld, long off, long mu, long ml) nogil:
+%(body)s
+    pass  # in case function body is empty
+
+cdef int dense_jac(long N, DenseMatStruct* J, dtype_t t, NVectorStruct* y, 
+    NVectorStruct* fy, void* jac_data, NVectorStruct* tmp1, 
+    NVectorStruct* tmp2, NVectorStruct* tmp3) nogil:
+    # jac_data holds parameters, then algebraic variables; tmp1 takes rates
+    cdef dtype_t* constants = <dtype_t*>jac_data
+    cdef long i
+    for i in range(J.M * J.N):
+        J.data[0][i] = 0.0
+    compute_jacobian(t, y.content.data, constants, constants + sizeConstants, 
+        tmp1.content.data, J.data[0], J.M, 0, N, N)
+    return 0
+
+cdef int band_jac(long N, long mupper, long mlower, BandMatStruct* J, 
+    dtype_t t, NVectorStruct* y, NVectorStruct* fy, void* jac_data, 
+    NVectorStruct* tmp1, NVectorStruct* tmp2, NVectorStruct* tmp3) nogil:
+    # Like dense_jac(), for a band matrix
+    cdef dtype_t* constants = <dtype_t*>jac_data
+    cdef long i
+    for i in range(J.size * (J.smu + J.ml + 1)):
+        J.data[0][i] = 0.0
+    compute_jacobian(t, y.content.data, constants, constants + sizeConstants, 
+        tmp1.content.data, J.data[0], J.smu + J.ml, J.smu, mupper, mlower)
+    return 0
+
+# Addresses of dense_jac() and band_jac(), to pass to CVODE
+dense_jac_address = <size_t>dense_jac
+band_jac_address = <size_t>band_jac
+
+def computeJacobian(voi, states, constants):
+    \"\"\"Jacobian matrix d rates[i] / d states[j] at (voi, states).\"\"\"
+    cdef np.ndarray[dtype_t, ndim=1] y = np.array(states, dtype=np.float64)
+    cdef np.ndarray[dtype_t, ndim=1] par = np.array(constants, 
+        dtype=np.float64)
+    cdef np.ndarray[dtype_t, ndim=1] alg = np.zeros(sizeAlgebraic)
+    cdef np.ndarray[dtype_t, ndim=1] rates = np.zeros(sizeStates)
+    cdef np.ndarray[dtype_t, ndim=2] jacT = np.zeros((sizeStates, sizeStates))
+    compute_jacobian(voi, <dtype_t*>y.data, <dtype_t*>par.data, 
+        <dtype_t*>alg.data, <dtype_t*>rates.data, <dtype_t*>jacT.data, 
+        sizeStates, 0, sizeStates, sizeStates)
+    return jacT.T.copy()
+"""
+
+# Fill lookup table j in precompute(), bridging removable singularities
+lookup_fill = """    for _i in range(%(n)r):
+        _x = %(lo)r + _i * %(step)r
+        _v = lookup_exact(%(j)r, _x, constants, work)
+        if _v - _v != 0:  # not finite, e.g. 0/0
+            _v = 0.5 * (lookup_exact(%(j)r, _x - %(h)r, constants, work) + 
+                lookup_exact(%(j)r, _x + %(h)r, constants, work))
+        work[%(offset)r + _i] = _v
+"""
+
+# Right-hand side with the C signature of CVODE's CVRhsFn. Its address, 
+# rhs_address, lets CVODE call it without the Python callback machinery 
+# of pysundials, see cgp.cvodeint.core.Cvodeint(native_rhs=...).
+native_rhs = """
+# Serial N_Vector as laid out by SUNDIALS 2.3 (nvector_serial.h); 
+# pysundials.nvecserial declares the same structs for ctypes.
+ctypedef struct NVectorContent:
+    long length
+    int own_data
+    dtype_t* data
+
+ctypedef struct NVectorStruct:
+    NVectorContent* content
+    void* ops
+
+cdef int rhs(dtype_t t, NVectorStruct* y, NVectorStruct* ydot, 
+    void* f_data) nogil:
+    # Like ode(); f_data is NULL or the per-instance buffer
+    cdef dtype_t *ppar = pp if f_data == NULL else <dtype_t*>f_data
+    cdef dtype_t *palg = palgebraic if f_data == NULL else ppar + sizeConstants
+    cdef dtype_t *pwork = pworkspace if f_data == NULL else palg + sizeAlgebraic
+    cdef dtype_t *pydot = ydot.content.data
+    cdef int i
+    for i in range(sizeStates):
+        pydot[i] = 0.0
+    for i in range(sizeAlgebraic):
+        palg[i] = 0.0
+    compute_rates(t, y.content.data, pydot, ppar, palg, pwork)
+    return 0
+
+# Address of rhs(), to pass to CVODE in place of ode()
+rhs_address = <size_t>rhs
+"""
+
+lookup_errors = """
+def lookup_errors(par=None):
+    '''
+    Interpolation error of each lookup table, for parameters par.
+    
+    Returns a list of (maximum absolute error, maximum absolute value) 
+    of each expression in lookup_tables, at the midpoints between grid 
+    points, where linear interpolation errs the most. Points where the 
+    exact value is not finite are skipped.
+    
+    par is the parameter vector, by default the module-level p.
+    '''
+    if par is not None:
+        par = np.ascontiguousarray(par, dtype=ftype)
+    work = np.copy(workspace)
+    cdef dtype_t* ppar = bufpar(par)
+    cdef dtype_t* pwork = bufarr(work)
+    cdef int i, j, n, offset
+    cdef dtype_t lo, step, exact, err, maxerr, maxval
+    precompute(ppar, pwork)
+    result = []
+    for j, (_k, offset, n, lo, step, _expr) in enumerate(lookup_tables):
+        maxerr = maxval = 0
+        for i in range(n - 1):
+            exact = lookup_exact(j, lo + (i + 0.5) * step, ppar, pwork)
+            if exact - exact != 0:
+                continue
+            err = fabs(interpolate(pwork + offset, i, 0.5) - exact)
+            if err > maxerr:
+                maxerr = err
+            if fabs(exact) > maxval:
+                maxval = fabs(exact)
+        result.append((maxerr, maxval))
+    return result
+"""
 
 def rep(s, old, new):
     """
@@ -396,6 +814,482 @@ def repcp(s):
         s = s[:ibefore] + cp2cond(s[ibefore:iafter]) + s[iafter:]
     return s
 
+def releases_gil(code):
+    """
+    True if the cythonized function body in *code* can run without the GIL.
+    
+    This holds if every function it calls is in :data:`NOGIL_CALLS`. 
+    Generated code that calls back into Python, such as the rootfind_*() 
+    helpers of some models, must keep the GIL.
+    
+    >>> releases_gil("rates[0] = exp(-states[0]) if cy_less(voi, 1.0) else 0")
+    True
+    >>> releases_gil("rootfind_0(voi, constants, rates, states, algebraic)")
+    False
+    """
+    keywords = "if else and or not in return".split()
+    called = re.findall(r"\b([A-Za-z_]\w*)\s*\(", code)
+    return all((f in NOGIL_CALLS) or (f in keywords) for f in called)
+
+#: Result of :func:`optimize_code`
+Optimized = namedtuple("Optimized", "body precompute size tables")
+
+def optimize_code(body, hoist=False, lookup=None):
+    """
+    Simplify the body of a cythonized rate function.
+    
+    :param str body: Assignment statements, one per line, indented.
+    :param bool hoist: Move subexpressions that depend only on parameters 
+        to a separate precompute step?
+    :param dict lookup: With *hoist*, mapping of state index to 
+        (low, high, step) for lookup tables.
+    :return: :data:`Optimized` tuple of *body*, the new function body; 
+        *precompute*, the statements of the precompute step; *size*, the 
+        number of elements of work[...] that they use; and *tables*, a list 
+        of (state index, offset in work, number of points, low, step, 
+        expression) for each lookup table, with the state called x in the 
+        expression.
+    
+    The code is parsed with :mod:`ast`, rewritten, and turned back into 
+    source with :func:`cgp.utils.codegen.to_source`:
+    
+    * Arithmetic on numeric literals is evaluated, and pow() with a small 
+      integer exponent becomes multiplication.
+    * With *hoist*, maximal subexpressions of constants[...] are computed by 
+      the statements in *precompute*, which store them in work[...]. They are 
+      followed by copies of the parameter values they were computed from. 
+      The new body starts by running *precompute* if those differ from the 
+      current parameters.
+    * With *lookup*, maximal subexpressions that call a math function and 
+      depend on parameters and a single state in *lookup* are tabulated over 
+      its grid by the precompute step (see :func:`cythonize_model`). 
+      The new body interpolates linearly in the table if the state is within 
+      its range, and evaluates the exact expression otherwise.
+    * Subexpressions that occur more than once are assigned to temporary 
+      variables (common subexpression elimination).
+    
+    The code is returned unchanged if it has anything but assignments, 
+    or calls anything but the functions in :data:`NOGIL_CALLS`.
+    
+    >>> opt = optimize_code(\'\'\'
+    ...     algebraic[0] = exp(states[0]/constants[1])*pow(states[1], 2.0)
+    ...     rates[0] = exp(states[0]/constants[1])*(2.0*3.0)\'\'\')
+    >>> print opt.body
+    <BLANKLINE>
+        cdef dtype_t _cse0
+        _cse0 = exp((states[0] / constants[1]))
+        algebraic[0] = (_cse0 * (states[1] * states[1]))
+        rates[0] = (_cse0 * 6.0)
+    
+    Hoisting a parameter expression, here the leak current of the 
+    Hodgkin-Huxley model.
+    
+    >>> opt = optimize_code(\'\'\'
+    ...     algebraic[0] = constants[2]*(states[0] - (constants[3] - 10.6))\'\'\',
+    ...     hoist=True)
+    >>> print opt.body
+    <BLANKLINE>
+        if (work[1] != constants[3]):
+            precompute(constants, work)
+        algebraic[0] = (constants[2] * (states[0] - work[0]))
+    >>> opt.precompute
+    ['work[0] = (constants[3] - 10.6)', 'work[1] = constants[3]']
+    
+    A lookup table for a gating rate over -100 <= V <= 100, in steps of 0.5.
+    
+    >>> opt = optimize_code(\'\'\'
+    ...     algebraic[0] = constants[0]*exp(-states[0]/18.0)*states[1]\'\'\',
+    ...     hoist=True, lookup={0: (-100.0, 100.0, 0.5)})
+    >>> print opt.body
+    <BLANKLINE>
+        cdef int _i0
+        cdef dtype_t _f0
+        cdef bint _in0
+        if (work[401] != constants[0]):
+            precompute(constants, work)
+        _f0 = (states[0] - -100.0) * 2.0
+        _in0 = (_f0 >= 0) and (_f0 < 400)
+        _i0 = <int>_f0 if _in0 else 0
+        _f0 = _f0 - _i0
+        algebraic[0] = ((interpolate((work + 0), _i0, _f0) if _in0 else (constants[0] * exp(((-states[0]) / 18.0)))) * states[1])
+    >>> opt.tables
+    [(0, 0, 401, -100.0, 0.5, '(constants[0] * exp(((-x) / 18.0)))')]
+    """
+    stmts = ast.parse(textwrap.dedent(body)).body
+    if not (releases_gil(body) and all(isinstance(stmt, ast.Assign) and 
+        len(stmt.targets) == 1 for stmt in stmts)):
+        return Optimized(body, [], 0, [])
+    simplify = _Simplify()
+    for stmt in stmts:
+        stmt.value = simplify.visit(stmt.value)
+    declarations = []
+    lines = []
+    precompute = []
+    tables = []
+    size = 0
+    if hoist:
+        hoister = _Hoist()
+        for stmt in stmts:
+            stmt.value = hoister.visit(stmt.value)
+        precompute = ["work[%s] = %s" % (i, codegen.to_source(expr)) 
+            for i, expr in enumerate(hoister.hoisted)]
+        size = len(precompute)
+        tabulate = _Tabulate(lookup or {}, size)
+        for stmt in stmts:
+            stmt.value = tabulate.visit(stmt.value)
+        tables = tabulate.tables
+        size = tabulate.size
+        for k in sorted(set(table[0] for table in tables)):
+            lo, _hi, step = lookup[k]
+            n = tabulate.npoints[k]
+            declarations.extend(i % k for i in 
+                ["cdef int _i%s", "cdef dtype_t _f%s", "cdef bint _in%s"])
+            lines.extend(i.format(k=k, lo=lo, scale=1.0 / step, n=n - 1) 
+                for i in ["_f{k} = (states[{k}] - {lo!r}) * {scale!r}", 
+                    "_in{k} = (_f{k} >= 0) and (_f{k} < {n})", 
+                    "_i{k} = <int>_f{k} if _in{k} else 0", 
+                    "_f{k} = _f{k} - _i{k}"])
+        snapshot = sorted(set(node.slice.value.n 
+            for expr in hoister.hoisted + tabulate.tabulated 
+            for node in ast.walk(expr) if isinstance(node, ast.Subscript) 
+            and (node.value.id == "constants")))
+        precompute.extend("work[%s] = constants[%s]" % (size + i, k) 
+            for i, k in enumerate(snapshot))
+        check = ["work[%s] != constants[%s]" % (size + i, k) 
+            for i, k in enumerate(snapshot)]
+        size += len(snapshot)
+        if tables and not snapshot:
+            # Nothing to compare, so flag whether precompute() has run
+            precompute.append("work[%s] = 0" % size)
+            check = ["work[%s] != 0" % size]
+            size += 1
+        if check:
+            lines[:0] = ["if (%s):" % " or\n        ".join(check), 
+                "    precompute(constants, work)"]
+    stmts, temps = _cse(stmts)
+    if temps:
+        declarations.insert(0, "cdef dtype_t " + ", ".join(temps))
+    lines = declarations + lines
+    lines.extend(codegen.to_source(stmt) for stmt in stmts)
+    body = "".join("\n    " + line for line in lines)
+    return Optimized(body, precompute, size, tables)
+
+def _num(value, node):
+    """Numeric literal for value, or node if value is not finite."""
+    if math.isinf(value) or math.isnan(value):
+        return node
+    return ast.copy_location(ast.Num(value), node)
+
+def _isnum(node):
+    return isinstance(node, ast.Num)
+
+def _called(node):
+    """Name of function called by an ast.Call node, or None."""
+    return node.func.id if isinstance(node.func, ast.Name) else None
+
+def _mul(a, b):
+    return ast.BinOp(a, ast.Mult(), b)
+
+def _div(a, b):
+    return ast.BinOp(a, ast.Div(), b)
+
+def _sqrt(x):
+    return ast.Call(ast.Name("sqrt", ast.Load()), [x], [], None, None)
+
+# Replacements for pow(x, n), by n. Repeated x are merged by _cse().
+POW_REWRITES = {
+    1: lambda x: x,
+    2: lambda x: _mul(x, deepcopy(x)),
+    3: lambda x: _mul(_mul(x, deepcopy(x)), deepcopy(x)),
+    4: lambda x: _mul(_mul(x, deepcopy(x)), _mul(deepcopy(x), deepcopy(x))),
+    0.5: _sqrt,
+    -1: lambda x: _div(ast.Num(1.0), x),
+    -2: lambda x: _div(ast.Num(1.0), _mul(x, deepcopy(x))),
+    }
+
+FOLD_BINOPS = {ast.Add: operator.add, ast.Sub: operator.sub, 
+    ast.Mult: operator.mul, ast.Div: operator.truediv}
+
+FOLD_CALLS = dict((k, getattr(math, k)) for k in """exp log log10 sqrt pow 
+    floor ceil fabs sin cos tan asin acos atan sinh cosh tanh""".split())
+
+class _Simplify(ast.NodeTransformer):
+    """Evaluate arithmetic on numeric literals, simplify pow()."""
+    
+    def visit_BinOp(self, node):
+        self.generic_visit(node)
+        op = FOLD_BINOPS.get(type(node.op))
+        if op and _isnum(node.left) and _isnum(node.right):
+            a, b = node.left.n, node.right.n
+            # keep integer division as it is, since C and Python differ
+            if isinstance(node.op, ast.Div) and not (
+                isinstance(a, float) and isinstance(b, float)):
+                return node
+            try:
+                return _num(op(a, b), node)
+            except ArithmeticError:
+                return node
+        return node
+    
+    def visit_UnaryOp(self, node):
+        self.generic_visit(node)
+        if isinstance(node.op, ast.USub) and _isnum(node.operand):
+            return _num(-node.operand.n, node)
+        return node
+    
+    def visit_Call(self, node):
+        self.generic_visit(node)
+        name = _called(node)
+        if (name in FOLD_CALLS) and node.args and all(_isnum(arg) 
+            for arg in node.args):
+            try:
+                return _num(FOLD_CALLS[name](*[a.n for a in node.args]), node)
+            except (ArithmeticError, ValueError):
+                return node
+        if (name == "pow") and (len(node.args) == 2) and _isnum(node.args[1]):
+            rewrite = POW_REWRITES.get(node.args[1].n)
+            if rewrite:
+                return rewrite(node.args[0])
+        return node
+
+def _parameter_only(node):
+    """True if node depends on constants[...] and numeric literals only."""
+    if isinstance(node, (ast.Num, ast.operator, ast.unaryop, ast.cmpop, 
+        ast.boolop)):
+        return True
+    if isinstance(node, ast.Name):
+        return node.id in ("True", "False")
+    if isinstance(node, ast.Subscript):
+        return (isinstance(node.value, ast.Name) and 
+            (node.value.id == "constants") and 
+            isinstance(node.slice, ast.Index) and _isnum(node.slice.value))
+    if isinstance(node, ast.Call):
+        return (_called(node) in NOGIL_CALLS) and all(_parameter_only(arg) 
+            for arg in node.args)
+    if isinstance(node, (ast.BinOp, ast.UnaryOp, ast.IfExp, ast.BoolOp, 
+        ast.Compare)):
+        return all(_parameter_only(child) 
+            for child in ast.iter_child_nodes(node))
+    return False
+
+class _Hoist(ast.NodeTransformer):
+    """Replace parameter-only subexpressions with work[i]."""
+    
+    def __init__(self):
+        self.hoisted = []  # expressions to be computed by precompute()
+        self.index = {}  # ast.dump(expression) -> index in hoisted
+    
+    def visit(self, node):
+        if isinstance(node, ast.expr) and _parameter_only(node):
+            kinds = set(type(i) for i in ast.walk(node))
+            # only worthwhile if some computation is saved
+            if ast.Subscript in kinds and kinds & set([ast.Call, ast.BinOp]):
+                key = ast.dump(node)
+                if key not in self.index:
+                    self.index[key] = len(self.hoisted)
+                    self.hoisted.append(node)
+                return ast.Subscript(ast.Name("work", ast.Load()), 
+                    ast.Index(ast.Num(self.index[key])), ast.Load())
+        return super(_Hoist, self).visit(node)
+
+def _state_dependence(node):
+    """
+    Set of indices of the states that node depends on.
+    
+    Returns None if node depends on anything but states[...], constants[...], 
+    work[...] and numeric literals, or is not arithmetic or math functions.
+    """
+    if isinstance(node, (ast.Num, ast.operator, ast.unaryop)):
+        return set()
+    if isinstance(node, ast.Subscript):
+        if (isinstance(node.value, ast.Name) and 
+            isinstance(node.slice, ast.Index) and _isnum(node.slice.value)):
+            if node.value.id == "states":
+                return set([node.slice.value.n])
+            if node.value.id in ("constants", "work"):
+                return set()
+        return None
+    if isinstance(node, ast.Call):
+        name = _called(node)
+        if (name not in NOGIL_CALLS) or name.startswith("cy_"):
+            return None
+        children = node.args
+    elif isinstance(node, (ast.BinOp, ast.UnaryOp)):
+        children = list(ast.iter_child_nodes(node))
+    else:
+        return None
+    result = set()
+    for child in children:
+        states = _state_dependence(child)
+        if states is None:
+            return None
+        result |= states
+    return result
+
+class _Tabulate(ast.NodeTransformer):
+    """
+    Replace subexpressions of one state and parameters with lookup tables.
+    
+    *lookup* maps state index to (low, high, step). Tables are stored in 
+    work[...] from *offset*.
+    """
+    
+    def __init__(self, lookup, offset):
+        self.lookup = lookup
+        self.size = offset  # next free element of work
+        self.npoints = dict((k, int(round((hi - lo) / step)) + 1) 
+            for k, (lo, hi, step) in lookup.items())
+        self.tables = []  # (state, offset, npoints, low, step, expression)
+        self.tabulated = []  # tabulated expressions
+        self.index = {}  # ast.dump(expression) -> offset of table
+    
+    def visit(self, node):
+        if isinstance(node, ast.expr):
+            states = _state_dependence(node)
+            if (states and (len(states) == 1) and 
+                (list(states)[0] in self.lookup) and 
+                any(isinstance(i, ast.Call) for i in ast.walk(node))):
+                k = list(states)[0]
+                key = ast.dump(node)
+                if key not in self.index:
+                    lo, _hi, step = self.lookup[k]
+                    expr = codegen.to_source(
+                        _StateAsX(k).visit(deepcopy(node)))
+                    self.index[key] = self.size
+                    self.tables.append((k, self.size, self.npoints[k], 
+                        lo, step, expr))
+                    self.tabulated.append(node)
+                    self.size += self.npoints[k]
+                interpolation = ast.Call(ast.Name("interpolate", ast.Load()), 
+                    [ast.BinOp(ast.Name("work", ast.Load()), ast.Add(), 
+                    ast.Num(self.index[key])), ast.Name("_i%s" % k, ast.Load()), 
+                    ast.Name("_f%s" % k, ast.Load())], [], None, None)
+                return ast.IfExp(ast.Name("_in%s" % k, ast.Load()), 
+                    interpolation, node)
+        return super(_Tabulate, self).visit(node)
+
+class _StateAsX(ast.NodeTransformer):
+    """Replace states[k] with x."""
+    
+    def __init__(self, k):
+        self.k = k
+    
+    def visit_Subscript(self, node):
+        if (isinstance(node.value, ast.Name) and (node.value.id == "states") 
+            and _state_dependence(node) == set([self.k])):
+            return ast.Name("x", ast.Load())
+        return self.generic_visit(node)
+
+def _subexpressions(node, conditional=False):
+    """
+    Yield (subexpression, conditional) for node and its descendants.
+    
+    *conditional* is True for the branches of conditional expressions and 
+    the short-circuited operands of "and" and "or", which may not be 
+    evaluated.
+    """
+    yield node, conditional
+    if isinstance(node, ast.IfExp):
+        children = [(node.test, conditional), (node.body, True), 
+            (node.orelse, True)]
+    elif isinstance(node, ast.BoolOp):
+        children = [(node.values[0], conditional)] + [(i, True) 
+            for i in node.values[1:]]
+    else:
+        children = [(i, conditional) for i in ast.iter_child_nodes(node)]
+    for child, cond in children:
+        for i in _subexpressions(child, cond):
+            yield i
+
+def _cse_candidate(node):
+    """True for arithmetic and math function calls."""
+    if isinstance(node, ast.BinOp):
+        return True
+    if isinstance(node, ast.Call):
+        name = _called(node)
+        return (name in NOGIL_CALLS) and not name.startswith("cy_")
+    return False
+
+def _location(node):
+    """Key identifying the variable or array element read or assigned."""
+    return re.sub(r",? ?ctx=\w+\(\)", "", ast.dump(node))
+
+def _number(node, table, numbers):
+    """
+    Give structurally equal subexpressions the same number.
+    
+    Numbers are stored in *numbers* by id(node); *table* maps the structure 
+    of each node to its number. Integer and float literals are kept apart.
+    """
+    if isinstance(node, ast.AST):
+        key = (type(node).__name__,) + tuple(_number(getattr(node, field), 
+            table, numbers) for field in node._fields)
+        numbers[id(node)] = table.setdefault(key, len(table))
+        return numbers[id(node)]
+    if isinstance(node, list):
+        return tuple(_number(i, table, numbers) for i in node)
+    return type(node).__name__, repr(node)
+
+class _Replace(ast.NodeTransformer):
+    """Replace subexpressions having a given number with a name."""
+    
+    def __init__(self, number, numbers, name):
+        self.number = number
+        self.numbers = numbers
+        self.name = name
+    
+    def visit(self, node):
+        if self.numbers.get(id(node)) == self.number:
+            return ast.Name(self.name, ast.Load())
+        return super(_Replace, self).visit(node)
+
+def _cse(stmts):
+    """
+    Eliminate common subexpressions in a list of ast.Assign statements.
+    
+    Returns the new list of statements and a list of temporary variable 
+    names. Each temporary is assigned just before the first statement that 
+    uses it. Subexpressions occurring only in branches of conditional 
+    expressions are left alone, to avoid computing what is not needed.
+    The largest repeated subexpression is taken first, so that its parts 
+    are counted only once.
+    """
+    stmts = list(stmts)
+    temps = []
+    while True:
+        numbers = {}
+        table = {}
+        found = {}  # number -> [node, statement indices, conditional]
+        for i, stmt in enumerate(stmts):
+            _number(stmt.value, table, numbers)
+            for node, conditional in _subexpressions(stmt.value):
+                if _cse_candidate(node):
+                    key = numbers[id(node)]
+                    entry = found.setdefault(key, [node, [], True])
+                    entry[1].append(i)
+                    entry[2] = entry[2] and conditional
+        candidates = []
+        for key, (node, where, conditional) in found.items():
+            if (len(where) < 2) or conditional:
+                continue
+            # The operands must not be assigned between first and last use
+            reads = set(_location(i) for i in ast.walk(node) 
+                if isinstance(i, (ast.Name, ast.Subscript)))
+            if any(_location(stmts[j].targets[0]) in reads 
+                for j in range(where[0], where[-1])):
+                continue
+            size = len(list(ast.walk(node)))
+            candidates.append((size, key, node, where[0]))
+        if not candidates:
+            return stmts, temps
+        _size, key, node, first = max(candidates)
+        name = "_cse%s" % len(temps)
+        temps.append(name)
+        replace = _Replace(key, numbers, name)
+        for stmt in stmts[first:]:
+            stmt.value = replace.visit(stmt.value)
+        stmts.insert(first, ast.Assign([ast.Name(name, ast.Store())], node))
+
 def prepend(prefix, words, string):
     """
     Prepend prefix to certain words in a string.
@@ -0,0 +1,368 @@
+"""
+Generate an analytic Jacobian from the Python code for a CellML model.
+
+The code generated from CellML computes rates in a function
+``computeRates(voi, states, constants)`` as a sequence of assignments to
+``algebraic[i]`` and ``rates[i]``. :func:`jacobian_code` differentiates each
+assignment with respect to the state variables it depends on, applying the
+chain rule through the algebraic variables, and emits a function
+``computeJacobian(voi, states, constants)`` that returns the matrix
+``J[i, j] = d rates[i] / d states[j]``. Only structurally nonzero entries are
+computed, and their indices are stored in the module-level list ``nonzero``.
+
+>>> src = '''
+... def computeRates(voi, states, constants):
+...     rates = [0.0] * sizeStates; algebraic = [0.0] * sizeAlgebraic
+...     algebraic[0] = constants[0]*(1.0-pow(states[0], 2))
+...     rates[0] = states[1]
+...     rates[1] = algebraic[0]*states[1]-states[0]
+...     return(rates)
+... '''
+>>> ns = dict(sizeStates=2, sizeAlgebraic=1)
+>>> exec jacobian_code(src) in ns
+>>> ns["nonzero"]
+[(0, 1), (1, 0), (1, 1)]
+>>> ns["computeJacobian"](0.0, [2.0, 3.0], [1.0])
+array([[  0.,   1.],
+       [-13.,  -3.]])
+"""
+
+import ast
+
+from ..utils import codegen
+
+__all__ = ["jacobian_code", "rates_sparsity"]
+
+#: Derivatives of functions of one argument, as format strings of the
+#: argument *a*.
+unary_derivatives = dict(
+    exp="exp(%(a)s)",
+    log="(1.0 / %(a)s)",
+    log10="(1.0 / (%(a)s * log(10.0)))",
+    sqrt="(0.5 / sqrt(%(a)s))",
+    fabs="(1.0 if %(a)s >= 0 else -1.0)",
+    abs="(1.0 if %(a)s >= 0 else -1.0)",
+    sin="cos(%(a)s)",
+    cos="(-sin(%(a)s))",
+    tan="(1.0 / pow(cos(%(a)s), 2))",
+    sinh="cosh(%(a)s)",
+    cosh="sinh(%(a)s)",
+    tanh="(1.0 - pow(tanh(%(a)s), 2))",
+    atan="(1.0 / (1.0 + pow(%(a)s, 2)))",
+    arctan="(1.0 / (1.0 + pow(%(a)s, 2)))",
+    )
+
+#: Functions that are piecewise constant, with derivative zero almost
+#: everywhere.
+piecewise_constant = set("""floor ceil equal not_equal less greater less_equal
+    greater_equal and_ or_ not_ xor_ logical_and logical_or logical_not
+    logical_xor""".split())
+
+def to_source(node):
+    """
+    Python source code for an expression node, safe to embed in expressions.
+
+    >>> to_source(ast.parse("a * (b if c else d)").body[0].value)
+    '(a * (b if c else d))'
+    """
+    generator = codegen.SourceGenerator(" " * 4)
+    generator.visit(node)
+    return "".join(str(s) for s in generator.result)
+
+def _add(a, b):
+    """Sum of derivative expressions, where None means zero."""
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return "(%s + %s)" % (a, b)
+
+def _neg(a):
+    """Negation of derivative expression, where None means zero."""
+    return None if a is None else "(-%s)" % a
+
+def _mul(a, b):
+    """Product of derivative expressions, where None means zero."""
+    if (a is None) or (b is None):
+        return None
+    if a == "1.0":
+        return b
+    if b == "1.0":
+        return a
+    return "(%s * %s)" % (a, b)
+
+class Differentiator(object):
+    """
+    Differentiate expressions with respect to state variables.
+
+    Intermediate variables such as ``algebraic[i]`` are differentiated
+    by the chain rule, referring to variables ``d_algebraic_i_j`` for
+    the derivative of ``algebraic[i]`` with respect to ``states[j]``.
+
+    >>> d = Differentiator()
+    >>> expr = ast.parse("states[0] * exp(states[1])").body[0].value
+    >>> d.deps(expr)
+    set([0, 1])
+    >>> d.diff(expr, 0)
+    'exp(states[1])'
+    >>> d.diff(expr, 1)
+    '(states[0] * exp(states[1]))'
+    """
+
+    def __init__(self, states="states", intermediates=("algebraic", "rates")):
+        self.states = states
+        self.intermediates = intermediates
+        # deps[name, i] is the set of state indices that name[i] depends on
+        self.deps_ = {}
+
+    def key(self, node):
+        """Return (name, index) for a subscript with constant index, else None."""
+        if (isinstance(node, ast.Subscript) and
+            isinstance(node.value, ast.Name) and
+            isinstance(node.slice, ast.Index) and
+            isinstance(node.slice.value, ast.Num)):
+            return node.value.id, node.slice.value.n
+
+    def dname(self, key, j):
+        """Name of variable holding the derivative of *key* wrt states[j]."""
+        return "d_%s_%s_%s" % (key[0], key[1], j)
+
+    def deps(self, node):
+        """Set of indices of state variables that *node* may depend on."""
+        result = set()
+        for child in ast.walk(node):
+            key = self.key(child)
+            if key is None:
+                continue
+            if key[0] == self.states:
+                result.add(key[1])
+            elif key[0] in self.intermediates:
+                result |= self.deps_.get(key, set())
+        return result
+
+    def diff(self, node, j):
+        """
+        Source code for derivative of *node* wrt states[j], or None if zero.
+
+        :raises NotImplementedError: for unsupported expressions.
+        """
+        method = getattr(self, "diff_" + node.__class__.__name__, None)
+        if method is None:
+            raise NotImplementedError("Cannot differentiate %s: %s" %
+                (node.__class__.__name__, to_source(node)))
+        return method(node, j)
+
+    def diff_Num(self, node, j):  # pylint: disable=W0613,C0111
+        return None
+
+    def diff_Name(self, node, j):  # pylint: disable=W0613,C0111
+        return None  # time or other scalar, independent of states
+
+    def diff_Compare(self, node, j):  # pylint: disable=W0613,C0111
+        return None
+
+    def diff_BoolOp(self, node, j):  # pylint: disable=W0613,C0111
+        return None
+
+    def diff_Subscript(self, node, j):  # pylint: disable=C0111
+        key = self.key(node)
+        if key is None:
+            raise NotImplementedError("Cannot differentiate subscript %s" %
+                to_source(node))
+        if key[0] == self.states:
+            return "1.0" if key[1] == j else None
+        if key[0] in self.intermediates:
+            if j in self.deps_.get(key, ()):
+                return self.dname(key, j)
+        return None
+
+    def diff_UnaryOp(self, node, j):  # pylint: disable=C0111
+        if isinstance(node.op, ast.USub):
+            return _neg(self.diff(node.operand, j))
+        if isinstance(node.op, ast.UAdd):
+            return self.diff(node.operand, j)
+        return None  # not
+
+    def diff_IfExp(self, node, j):  # pylint: disable=C0111
+        body, orelse = self.diff(node.body, j), self.diff(node.orelse, j)
+        if (body is None) and (orelse is None):
+            return None
+        return "(%s if %s else %s)" % (body or "0.0", to_source(node.test),
+            orelse or "0.0")
+
+    def diff_BinOp(self, node, j):  # pylint: disable=C0111
+        a, b = to_source(node.left), to_source(node.right)
+        da, db = self.diff(node.left, j), self.diff(node.right, j)
+        if isinstance(node.op, ast.Add):
+            return _add(da, db)
+        if isinstance(node.op, ast.Sub):
+            return _add(da, _neg(db))
+        if isinstance(node.op, ast.Mult):
+            return _add(_mul(da, b), _mul(a, db))
+        if isinstance(node.op, ast.Div):
+            dq = None if da is None else "(%s / %s)" % (da, b)
+            if db is not None:
+                dq = _add(dq, "(-%s * %s / pow(%s, 2))" % (a, db, b))
+            return dq
+        if isinstance(node.op, ast.Pow):
+            return self._diff_pow(a, b, da, db)
+        raise NotImplementedError("Cannot differentiate %s" % to_source(node))
+
+    def _diff_pow(self, a, b, da, db):
+        """Derivative of a ** b."""
+        result = None
+        if da is not None:
+            result = _mul("(%s * pow(%s, %s - 1))" % (b, a, b), da)
+        if db is not None:
+            result = _add(result,
+                _mul("(pow(%s, %s) * log(%s))" % (a, b, a), db))
+        return result
+
+    def diff_Call(self, node, j):  # pylint: disable=C0111
+        if not isinstance(node.func, ast.Name):
+            raise NotImplementedError("Cannot differentiate call to %s" %
+                to_source(node.func))
+        name = node.func.id
+        if name == "custom_piecewise":
+            return self._diff_piecewise(node.args[0].elts, j)
+        dargs = [self.diff(arg, j) for arg in node.args]
+        if all(d is None for d in dargs) or (name in piecewise_constant):
+            return None
+        args = [to_source(arg) for arg in node.args]
+        if (name in unary_derivatives) and (len(args) == 1):
+            return _mul(unary_derivatives[name] % dict(a=args[0]), dargs[0])
+        if (name in ("pow", "power")) and (len(args) == 2):
+            return self._diff_pow(args[0], args[1], *dargs)
+        raise NotImplementedError("Cannot differentiate function %s" % name)
+
+    def _diff_piecewise(self, elts, j):
+        """Derivative of custom_piecewise([cond, value, cond, value, ...])."""
+        cond = [to_source(i) for i in elts[0::2]]
+        dval = [self.diff(i, j) for i in elts[1::2]]
+        if all(d is None for d in dval):
+            return None
+        ifelse = " ".join("%s if %s else" % (d or "0.0", c)
+            for c, d in zip(cond, dval))
+        return "(%s 0.0)" % ifelse
+
+def rate_function(py_code, funcname="computeRates"):
+    """Syntax tree of the rate function in CellML Python code."""
+    tree = ast.parse(py_code)
+    try:
+        return [i for i in tree.body if isinstance(i, ast.FunctionDef) and
+                i.name == funcname][0]
+    except IndexError:
+        raise NotImplementedError("Function %s not found" % funcname)
+
+def rates_sparsity(py_code, funcname="computeRates"):
+    """
+    Structural sparsity pattern of the rate function, by static analysis.
+
+    Unlike :func:`jacobian_code`, this only tracks which state variables
+    each assignment refers to, so it works for any functions in the
+    equations. The pattern is conservative: dependencies only through
+    conditions or piecewise constant functions are included.
+
+    :return: Sorted list of (row, column) indices where
+        ``d rates[row] / d states[column]`` may be nonzero.
+
+    >>> rates_sparsity('''
+    ... def computeRates(voi, states, constants):
+    ...     rates = [0.0] * sizeStates; algebraic = [0.0] * sizeAlgebraic
+    ...     algebraic[0] = myfunction(states[1], constants[0])
+    ...     rates[0] = algebraic[0] if states[2] > 0 else 0.0
+    ...     rates[2] = -states[2]
+    ...     return(rates)
+    ... ''')
+    [(0, 1), (0, 2), (2, 2)]
+    """
+    func = rate_function(py_code, funcname)
+    d = Differentiator(states=func.args.args[1].id)
+    nonzero = set()
+    for stmt in func.body:
+        if isinstance(stmt, ast.Return):
+            continue
+        if not isinstance(stmt, ast.Assign) or len(stmt.targets) != 1:
+            raise NotImplementedError("Cannot analyze statement: %s" %
+                codegen.to_source(stmt))
+        key = d.key(stmt.targets[0])
+        if (key is not None) and (key[0] in d.intermediates):
+            d.deps_[key] = d.deps(stmt.value)
+            if key[0] == "rates":
+                nonzero.update((key[1], j) for j in d.deps_[key])
+    return sorted(nonzero)
+
+def jacobian_code(py_code, funcname="computeRates"):
+    """
+    Python code for the Jacobian of the rate function in CellML Python code.
+
+    :param str py_code: Python source code generated from CellML.
+    :param str funcname: Name of the function that computes rates.
+    :return str: Python source code defining ``computeJacobian(voi, states,
+        constants)`` and the list ``nonzero`` of (row, column) indices of
+        structurally nonzero entries. The code must be executed in the
+        namespace of the model module, e.g. ``from .py import *``.
+    :raises NotImplementedError: if the rate function contains statements or
+        functions that cannot be differentiated.
+
+    Conditional expressions are differentiated branch by branch.
+
+    >>> src = '''
+    ... def computeRates(voi, states, constants):
+    ...     rates = [0.0] * sizeStates; algebraic = [0.0] * sizeAlgebraic
+    ...     rates[0] = custom_piecewise([less(voi, 1.0), states[0], True, 0.0])
+    ...     return(rates)
+    ... '''
+    >>> print jacobian_code(src)
+    # Jacobian generated by cgp.physmod.jacobian.jacobian_code()
+    import numpy as np
+    <BLANKLINE>
+    nonzero = [(0, 0)]
+    <BLANKLINE>
+    def computeJacobian(voi, states, constants):
+        jac = np.zeros((sizeStates, sizeStates))
+        rates = ([0.0] * sizeStates)
+        algebraic = ([0.0] * sizeAlgebraic)
+        rates[0] = custom_piecewise([less(voi, 1.0), states[0], True, 0.0])
+        d_rates_0_0 = (1.0 if less(voi, 1.0) else 0.0 if True else 0.0)
+        jac[0, 0] = d_rates_0_0
+        return jac
+    <BLANKLINE>
+    """
+    func = rate_function(py_code, funcname)
+    argnames = [arg.id for arg in func.args.args]
+    d = Differentiator(states=argnames[1])
+    body = []
+    nonzero = set()
+    for stmt in func.body:
+        if isinstance(stmt, ast.Return):
+            continue
+        if not isinstance(stmt, ast.Assign) or len(stmt.targets) != 1:
+            raise NotImplementedError("Cannot differentiate statement: %s" %
+                codegen.to_source(stmt))
+        target, value = stmt.targets[0], stmt.value
+        body.append("%s = %s" % (codegen.to_source(target), to_source(value)))
+        key = d.key(target)
+        if key is None:
+            continue  # initialization of arrays
+        if key[0] not in d.intermediates:
+            raise NotImplementedError("Cannot differentiate assignment to %s"
+                % key[0])
+        deps = set()
+        for j in sorted(d.deps(value)):
+            dj = d.diff(value, j)
+            if dj is None:
+                continue
+            deps.add(j)
+            body.append("%s = %s" % (d.dname(key, j), dj))
+            if key[0] == "rates":
+                body.append("jac[%s, %s] = %s" % (key[1], j, d.dname(key, j)))
+                nonzero.add((key[1], j))
+        d.deps_[key] = deps
+    lines = ["# Jacobian generated by cgp.physmod.jacobian.jacobian_code()",
+        "import numpy as np", "", "nonzero = %s" % sorted(nonzero), "",
+        "def computeJacobian(%s):" % ", ".join(argnames),
+        "    jac = np.zeros((sizeStates, sizeStates))"]
+    lines.extend("    " + line for line in body)
+    lines.append("    return jac")
+    return "\n".join(lines) + "\n"
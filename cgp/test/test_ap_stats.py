@@ -0,0 +1,83 @@
+"""Tests for :mod:`cgp.virtexp.elphys.ap_stats`."""
+# pylint: disable=C0111
+
+import numpy as np
+
+from ..virtexp.elphys.ap_stats import apd, apd_many, ap_stats_dtype, OnlineAPD
+
+p_repol = np.r_[0.25, 0.5, 0.75, 0.9]
+
+def beats(seed=0):
+    """Ragged batch of noisy action potentials, plus aberrant trajectories."""
+    rng = np.random.RandomState(seed)
+    t, v = [], []
+    for n in rng.randint(20, 300, size=50):
+        ti = np.sort(rng.uniform(0, 100, size=n))
+        ti[0] = 0
+        vi = (-80 + 120 * ti / 3 * np.exp(1 - ti / 3) + 
+            rng.normal(scale=5, size=n))
+        t.append(ti)
+        v.append(vi)
+    t.extend([np.arange(9.0)] * 3 + [np.arange(10.0)])
+    v.extend([[6, 7, 8, 15, 16, 16, 14, 9, 8], np.ones(9), 
+        [43, 43, 44, 50, 110, 1456, 33790, 61249, 52139], 
+        [42, 43, 43, 44, 50, 110, 1456, 33790, 61249, 52139]])
+    return t, v
+
+def desired(t, v, **kwargs):
+    """Statistics by calling apd() once per beat."""
+    names = "amp base peak ttp decayrate".split()
+    rows = []
+    for ti, vi in zip(t, v):
+        s = apd(ti, vi, p_repol, **kwargs)
+        rows.append([float(s[k]) for k in names] + list(s["t_repol"]))
+    return np.array(rows)
+
+def test_apd_many():
+    """Batched statistics agree with apd() beat by beat."""
+    t, v = beats()
+    for interpolate in True, False:
+        actual = apd_many(t, v, p_repol, interpolate=interpolate)
+        assert actual.dtype == ap_stats_dtype(p_repol)
+        np.testing.assert_array_equal(actual.view(float).reshape(len(t), -1), 
+            desired(t, v, interpolate=interpolate))
+
+def test_apd_many_cai():
+    """Calcium transient statistics go in the ct... fields."""
+    t, v = beats()
+    cai = [1 + 0.01 * (vi - vi.min()) for vi in map(np.asarray, v)]
+    actual = apd_many(t, v, p_repol, cai_list=cai)
+    assert actual.dtype.names[-1] == "ctd90"
+    ct = np.column_stack([actual[k] for k in actual.dtype.names[9:]])
+    np.testing.assert_array_equal(ct, desired(t, cai))
+
+def test_apd_many_decay_p():
+    t, v = beats()
+    actual = apd_many(t, v, p_repol, decay_p=(0.5, 0.75)).apdecayrate
+    np.testing.assert_array_equal(actual, 
+        desired(t, v, decay_p=(0.5, 0.75))[:, 4])
+
+def test_online_apd():
+    """Step-by-step statistics match apd() on a finely sampled trajectory."""
+    def interp(t, k):
+        x = np.exp(1 - t / 3)
+        return -80 + 40 * t * x if k == 0 else 40 * x * (1 - t / 3)
+    online = OnlineAPD(p_repol)
+    steps = np.r_[0, np.cumsum(np.random.RandomState(1).uniform(0, 2, 60))]
+    for t0, t1 in zip(steps[:-1], steps[1:]):
+        online.update(t0, t1, interp)
+    actual = online.stats()
+    t = np.linspace(0, steps[-1], 1000001)
+    desired = apd(t, interp(t, 0), p_repol)
+    for k in "base", "peak", "amp", "t_repol", "decayrate":
+        np.testing.assert_allclose(actual[k], desired[k], rtol=1e-6)
+    # exact, unlike the grid point nearest the peak
+    assert abs(actual["ttp"] - 3) < 1e-12
+
+def test_online_apd_not_repolarized():
+    online = OnlineAPD(p_repol)
+    for t0, t1 in (0, 1), (1, 2):
+        online.update(t0, t1, lambda t, k: np.sin(t) if k == 0 else np.cos(t))
+    stats = online.stats()
+    assert abs(stats["ttp"] - np.pi / 2) < 1e-12
+    assert np.isnan(stats["t_repol"][-1])
@@ -0,0 +1,105 @@
+"""Tests for :mod:`cgp.physmod.cellml2py`."""
+# pylint: disable=C0111,W0122
+
+import glob
+import hashlib
+import os
+import shutil
+import tempfile
+
+import numpy as np
+from lxml import etree
+from nose.tools import raises
+
+import cgp
+from ..physmod import cellml2py
+
+cellmldir = os.path.join(cgp.__path__[0], "physmod", "_cellml")
+
+def namespace(cellml):
+    ns = {}
+    exec cellml2py.generate(etree.fromstring(cellml)) in ns
+    return ns
+
+# Time in milliseconds, but seconds in component A
+units = """<model name="units" xmlns="http://www.cellml.org/cellml/1.0#">
+<units name="ms"><unit units="second" prefix="milli"/></units>
+<units name="per_s"><unit units="second" exponent="-1"/></units>
+<component name="env">
+  <variable name="t" units="ms" public_interface="out"/>
+  <variable name="k" units="ms" initial_value="500" public_interface="out"/>
+</component>
+<component name="A">
+  <variable name="t" units="second" public_interface="in"/>
+  <variable name="k" units="second" public_interface="in"/>
+  <variable name="x" units="dimensionless" initial_value="0"/>
+  <variable name="r" units="per_s" initial_value="2"/>
+  <math xmlns="http://www.w3.org/1998/Math/MathML">
+    <apply><eq/><apply><diff/><bvar><ci>t</ci></bvar><ci>x</ci></apply>
+      <apply><times/><ci>r</ci><ci>k</ci><ci>t</ci></apply></apply>
+  </math>
+</component>
+<connection><map_components component_1="A" component_2="env"/>
+  <map_variables variable_1="t" variable_2="t"/>
+  <map_variables variable_1="k" variable_2="k"/>
+</connection></model>"""
+
+def test_units():
+    """Values and derivatives are converted to the units of each component."""
+    ns = namespace(units)
+    y, p = ns["initConsts"]()
+    # dx/dt = r * k * t per second, with k = 0.5 s, t = 1000 ms = 1 s
+    np.testing.assert_allclose(ns["computeRates"](1000.0, y, p), [1e-3])
+
+def test_bundled_models():
+    """Generated code runs, also vectorized over time points."""
+    for filename in glob.glob(os.path.join(cellmldir, "*.cellml")):
+        ns = {}
+        exec cellml2py.generate(etree.parse(filename)) in ns
+        y, p = ns["initConsts"]()
+        assert len(y) == ns["sizeStates"]
+        assert np.isfinite(ns["computeRates"](0.0, y, p)).all()
+        t = np.array([0.0, 1.0])
+        rates = ns["computeRates"](t, np.transpose([y, y]), p)
+        for j, tj in enumerate(t):
+            np.testing.assert_allclose([(r * np.ones_like(t))[j] 
+                for r in rates], ns["computeRates"](tj, y, p))
+
+def test_source():
+    """Alert if code generation changes format."""
+    code = cellml2py.generate(etree.parse(os.path.join(cellmldir,
+        "fitzhugh_1961.cellml")))
+    assert code.startswith(cellml2py.banner)
+    assert hashlib.sha1(code).hexdigest() == (
+        "c332a1666099f2e8fc417aadcfb0c8d063c932f9")
+
+@raises(NotImplementedError)
+def test_algebraic_loop():
+    namespace("""<model name="loop" xmlns="http://www.cellml.org/cellml/1.0#">
+    <component name="A">
+      <variable name="t" units="second"/>
+      <variable name="x" units="dimensionless" initial_value="0"/>
+      <variable name="a" units="dimensionless"/>
+      <variable name="b" units="dimensionless"/>
+      <math xmlns="http://www.w3.org/1998/Math/MathML">
+        <apply><eq/><ci>a</ci><ci>b</ci></apply>
+        <apply><eq/><ci>b</ci><apply><plus/><ci>a</ci><ci>x</ci></apply></apply>
+        <apply><eq/><apply><diff/><bvar><ci>t</ci></bvar><ci>x</ci></apply>
+          <ci>a</ci></apply>
+      </math>
+    </component></model>""")
+
+def test_generate_cached():
+    cachedir = tempfile.mkdtemp()
+    try:
+        code = cellml2py.generate_cached(units, cachedir)
+        assert code == cellml2py.generate(etree.fromstring(units))
+        filenames = os.listdir(cachedir)
+        assert len(filenames) == 1
+        # Cached code is returned without parsing the CellML again
+        with open(os.path.join(cachedir, filenames[0]), "a") as f:
+            f.write("# cached\n")
+        assert cellml2py.generate_cached(units, cachedir).endswith(
+            "# cached\n")
+    finally:
+        shutil.rmtree(cachedir)
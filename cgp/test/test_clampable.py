@@ -1,6 +1,9 @@
 """Tests for `cgp.virtexp.elphys.clampable`."""
 
+from multiprocessing.pool import ThreadPool
+
 import numpy as np
+from nose.tools import assert_equal, raises
 
 from cgp.virtexp.elphys import clampable
 
@@ -18,3 +21,52 @@ def test_pairbcast():
     for i in bc:
         for j in i[1:-1]:
             np.testing.assert_equal(j, (1, 1))
+
+class Dummy(clampable.Clampable):
+    """Stand-in for a model, with a protocol method and a spec."""
+    builds = 0
+    
+    def spec(self):  # pylint: disable=R0201
+        return DummySpec()
+    
+    def square(self, protocol, nthin=None):  # pylint: disable=R0201,W0613
+        if protocol < 0:
+            raise ValueError("Negative protocol")
+        return [protocol * protocol]
+
+class DummySpec(object):
+    def build(self):  # pylint: disable=R0201
+        Dummy.builds += 1
+        return Dummy()
+
+def test_sweep():
+    """Parallel sweeps rebuild the model once per worker, as ordered."""
+    model = Dummy()
+    protocols = range(10)
+    desired = [(p, [p * p]) for p in protocols]
+    assert_equal(list(model.sweep("square", protocols)), desired)
+    pool = ThreadPool(2)
+    try:
+        for ordered in True, False:
+            Dummy.builds = 0
+            actual = list(model.sweep("square", protocols, pool=pool, 
+                chunksize=3, ordered=ordered))
+            assert_equal(sorted(actual), desired)
+            if ordered:
+                assert_equal(actual, desired)
+            assert 1 <= Dummy.builds <= 2
+            assert_equal(clampable._sweep_models, {})  # released after sweep
+        sweep = model.sweep("square", protocols, pool=pool)
+        next(sweep)
+        assert clampable._sweep_models
+        sweep.close()
+        assert_equal(clampable._sweep_models, {})
+        actual = list(model.sweep("square", [1, -1, 2], pool=pool, 
+            log_exceptions=True))
+        assert_equal(actual, [(1, [1]), (2, [4])])
+    finally:
+        pool.close()
+
+@raises(ValueError)
+def test_sweep_exception():
+    list(Dummy().sweep("square", [1, -1, 2], pool=ThreadPool(1)))
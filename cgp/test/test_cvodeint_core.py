@@ -1,6 +1,7 @@
 """Tests for :mod:`..cvodeint.core`."""
 
 from doctest import _ellipsis_match # comparison with ... ellipsis
+from unittest import SkipTest
 
 import numpy as np
 from nose.tools import raises
@@ -223,4 +224,170 @@ def test_pickling():
     new = pickle.loads(s)
     for desired, actual in zip(old.integrate(), new.integrate()):
         np.testing.assert_array_equal(desired, actual)
-    
+    
+
+def test_integrate_ensemble():
+    """Ensemble members match separate integrations; failures are reported."""
+    r = np.array([0.5])
+    
+    def ode(t, y, ydot, f_data):
+        """Exponential growth at rate r[0], failing if r[0] < 0."""
+        if r[0] < 0:
+            raise StandardError("Negative growth rate")
+        ydot[0] = r[0] * y[0]
+    
+    c = Cvodeint(ode, t=[0, 1], y=[1.0], f_data=r)
+    tout = np.linspace(0, 1, 5)
+    P = [[0.5], [-1.0], [2.0]]
+    t, Y, flag = c.integrate_ensemble(P, t=tout)
+    np.testing.assert_equal(flag[[0, 2]], cvode.CV_SUCCESS)
+    assert flag[1] < 0
+    assert np.isnan(Y[1, 2:]).all()
+    for i in 0, 2:
+        np.testing.assert_allclose(t[i], tout)
+        np.testing.assert_allclose(Y[i].squeeze(), 
+            example_ode.exp_growth_sol(tout, 1.0, r=P[i][0]), rtol=1e-6)
+    # Parameters and state are restored
+    np.testing.assert_equal(r, 0.5)
+    np.testing.assert_equal(c.y, [1.0])
+
+@raises(CvodeException)
+def test_integrate_ensemble_adaptive():
+    """Ensemble integration requires fixed output times."""
+    c = Cvodeint(example_ode.exp_growth, t=[0, 1], y=[1.0])
+    c.integrate_ensemble(Y0=[[1.0], [2.0]], t=[0, 1])
+
+def _skip_unless_native(c):
+    """Skip the test if the compiled stepper could not be built for *c*."""
+    if c._native is None:  # pylint: disable=W0212
+        raise SkipTest("cgp.cvodeint._stepper is unavailable")
+
+def test_native_stepper():
+    """The native stepper reproduces the Python step loop exactly."""
+    kwargs = dict(t=[0, 2], y=[0.1], reltol=1e-3, chunksize=5)
+    c0 = Cvodeint(example_ode.logistic_growth, **kwargs)
+    c1 = Cvodeint(example_ode.logistic_growth, stepper="native", **kwargs)
+    _skip_unless_native(c1)
+    for desired, actual in zip(c0.integrate(), c1.integrate()):
+        np.testing.assert_array_equal(desired, actual)
+
+@raises(CvodeException)
+def test_native_stepper_maxsteps():
+    """The native stepper honors maxsteps."""
+    c = Cvodeint(example_ode.logistic_growth, t=[0, 2], y=[0.1], maxsteps=3, 
+        stepper="native")
+    _skip_unless_native(c)
+    c.integrate()
+
+def test_integrate_dense():
+    """Dense output matches the solution at evenly spaced times."""
+    c = Cvodeint(example_ode.logistic_growth, t=[0, 2], y=[0.1], reltol=1e-8)
+    t, y, flag = c.integrate(npoints=11)
+    np.testing.assert_allclose(t, np.linspace(0, 2, 11))
+    ys = example_ode.logistic_growth_sol(t, [0.1])
+    np.testing.assert_allclose(y.squeeze(), ys, rtol=1e-6)
+    np.testing.assert_equal(flag, cvode.CV_TSTOP_RETURN)
+
+def test_integrate_dense_root():
+    """Dense output ends at a root."""
+    c = Cvodeint(example_ode.exp_growth, t=[0, 2], y=[1.0])
+    
+    def g_rtfn(t, y, gout, g_data):  # pylint: disable=W0613
+        """Root where y = 2."""
+        gout[0] = y[0] - 2
+        return 0
+    
+    t, y, flag = c.integrate(npoints=5, nrtfn=1, g_rtfn=g_rtfn)
+    np.testing.assert_equal(flag, cvode.CV_ROOT_RETURN)
+    np.testing.assert_allclose(t[:-1], [0, 0.5])
+    np.testing.assert_allclose(t[-1], np.log(2), rtol=1e-6)
+    np.testing.assert_allclose(y[-1], 2, rtol=1e-6)
+
+@raises(ValueError)
+def test_integrate_dense_npoints():
+    """Dense output needs at least the start and end time."""
+    c = Cvodeint(example_ode.logistic_growth, t=[0, 2], y=[0.1])
+    c.integrate(npoints=1)
+
+def test_output_arena():
+    """Output buffers are reused and grown geometrically."""
+    c = Cvodeint(example_ode.logistic_growth, t=[0, 2], y=[0.1], chunksize=4)
+    t0, y0, _flag = c.integrate()
+    assert 0 < c.arena.ngrow < len(t0)
+    ngrow = c.arena.ngrow
+    # Same integration again: no further growth, and results are copies
+    t1, y1, _flag = c.integrate(t=[0, 2], y=[0.1])
+    assert c.arena.ngrow == ngrow
+    np.testing.assert_array_equal(t0, t1)
+    np.testing.assert_array_equal(y0, y1)
+    assert not np.may_share_memory(t1, c.arena.t)
+    # Views on the arena
+    c.copy_output = False
+    t2, y2, _flag = c.integrate(t=[0, 2], y=[0.1])
+    assert np.may_share_memory(t2, c.arena.t)
+    assert np.may_share_memory(y2, c.arena.Y)
+    np.testing.assert_array_equal(y0, y2)
+
+def test_jacobian():
+    """An analytic Jacobian is used for both dense and banded solvers."""
+    
+    def ode(t, y, ydot, f_data):  # pylint: disable=W0613
+        """Linear decay chain, y[i] feeding y[i+1]."""
+        ydot[0] = -y[0]
+        for i in range(1, len(ydot)):
+            ydot[i] = y[i - 1] - y[i]
+    
+    def jac(t, y, fy, J):  # pylint: disable=W0613
+        """Jacobian of the decay chain."""
+        n = len(J)
+        J[range(n), range(n)] = -1
+        J[range(1, n), range(n - 1)] = 1
+    
+    y0 = [1.0, 0, 0, 0, 0]
+    sparsity = np.zeros((5, 5), dtype=bool)
+    jac(0, y0, None, sparsity)
+    desired = Cvodeint(ode, t=[0, 1, 2], y=y0).integrate()[1]
+    dense = Cvodeint(ode, t=[0, 1, 2], y=y0, jac=jac, mupper="auto")
+    band = Cvodeint(ode, t=[0, 1, 2], y=y0, jac=jac, mupper="auto", 
+        sparsity=sparsity)
+    assert dense.mupper is None  # no structural pattern given
+    assert (band.mupper, band.mlower) == (0, 1)
+    for c in dense, band:
+        np.testing.assert_allclose(c.integrate()[1], desired, rtol=1e-6)
+    assert cvode.CVDenseGetNumJacEvals(dense.cvode_mem) > 0
+    assert cvode.CVBandGetNumJacEvals(band.cvode_mem) > 0
+
+def test_colored_jacobian():
+    """Colored finite differences need one RHS evaluation per color."""
+    
+    def ode(t, y, ydot, f_data):  # pylint: disable=W0613
+        """Nonlinear diffusion on a ring, coupling only nearest neighbours."""
+        n = len(ydot)
+        for i in range(n):
+            ydot[i] = y[i - 1] - 2 * y[i] * y[i] + y[(i + 1) % n]
+    
+    y0 = np.linspace(0.1, 1, 9)
+    desired = Cvodeint(ode, t=[0, 0.5, 1], y=y0).integrate()[1]
+    c = Cvodeint(ode, t=[0, 0.5, 1], y=y0, jac="colored")
+    np.testing.assert_array_equal(c.sparsity.sum(axis=0), 3)
+    assert c.jac.ncolors == 3
+    np.testing.assert_allclose(c.integrate()[1], desired, rtol=1e-6)
+    assert c.jac.nfevals == 3 * cvode.CVDenseGetNumJacEvals(c.cvode_mem)
+
+def test_stats():
+    """Statistics accumulate across re-initializations until reset."""
+    c = Cvodeint(example_ode.vdp, t=[0, 10], y=[-2, 0])
+    _t, _y, _flag = c.integrate()
+    first = c.stats
+    assert first.nsteps == cvode.CVodeGetNumSteps(c.cvode_mem)
+    assert first.njevals > 0
+    _t, _y, _flag = c.integrate(t=[0, 10])  # re-initializes CVODE
+    second = c.stats
+    assert second.ncalls == 2
+    assert second.nsteps == first.nsteps + cvode.CVodeGetNumSteps(c.cvode_mem)
+    assert second.nfevals > first.nfevals
+    assert second.callback_time == 0  # not profiling
+    c.reset_stats()
+    assert (c.stats.nsteps, c.stats.ncalls, c.stats.wall_time) == (0, 0, 0)
+    _t, _y, _flag = c.integrate(t=20)
+    assert c.stats.nsteps == cvode.CVodeGetNumSteps(c.cvode_mem)
@@ -1,6 +1,7 @@
 """Test :mod:`cgp.virtexp.elphys.examples`."""
 # pylint: disable=E0611
 
+import numpy as np
 from nose.tools import assert_equal, assert_not_equal
 
 from ..virtexp.elphys import *
@@ -155,6 +156,18 @@ def test_not_overwrite_y0r():
         _t, y, _stats = bond.ap()
         assert_not_equal(y.V[-1], bond.y0r.V)
 
+def test_rootfinding_single_pass():
+    """Rootfinding for all thresholds at once agrees with online tracking."""
+    li = Li()
+    with li.autorestore():
+        t, y, stats = li.ap(rootfinding=True)
+    with li.autorestore():
+        _t, _y, desired = li.ap(online=True)
+    np.testing.assert_equal(t[stats["i"]], np.r_[stats["ttp"], 
+        stats["t_repol"]])
+    for k in "ttp", "peak", "t_repol":
+        np.testing.assert_allclose(stats[k], desired[k], rtol=1e-4)
+
 def test_tentusscher():
     """
     Test for class :class:`cgp.virtexp.elphys.Tentusscher`.
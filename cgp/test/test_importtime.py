@@ -0,0 +1,28 @@
+"""
+Tests for :mod:`cgp.utils.importtime`.
+
+Wall-clock import times depend on the machine and its load, so they are
+only checked if the environment variable CGP_TEST_IMPORT_TIME is set.
+Otherwise, use ``python -m cgp --bench-import``.
+"""
+
+import os
+import subprocess
+from unittest import SkipTest
+
+from ..utils import importtime
+
+def test_budget():
+    """Core modules defer heavy dependencies, and import within budget."""
+    timed = bool(os.environ.get("CGP_TEST_IMPORT_TIME"))
+    for module, seconds in importtime.budget.items():
+        try:
+            t, packages = importtime.import_time(module,
+                repeat=3 if timed else 1)
+        except subprocess.CalledProcessError, exc:
+            raise SkipTest("Cannot import %s: %s" % (module, exc))
+        loaded = [i for i in importtime.deferred if i in packages]
+        assert not loaded, "%s imports %s" % (module, loaded)
+        if timed:
+            assert t <= seconds, "%s took %.3f s, budget %s s" % (module, t,
+                seconds)
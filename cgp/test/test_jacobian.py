@@ -0,0 +1,77 @@
+"""Tests for :mod:`cgp.physmod.jacobian`."""
+# pylint: disable=C0111,W0122
+
+from math import exp, log, sqrt
+
+import numpy as np
+from nose.tools import raises
+
+from ..physmod.jacobian import jacobian_code, rates_sparsity
+
+# Code in the style generated from CellML, exercising the chain rule through
+# algebraic variables, conditionals and the functions used by CellML models.
+src = """
+def computeRates(voi, states, constants):
+    rates = [0.0] * sizeStates; algebraic = [0.0] * sizeAlgebraic
+    algebraic[0] = constants[0]*exp(-(states[0]+40.0)/constants[1])
+    algebraic[1] = custom_piecewise([greater(states[0], 0.0), \
+pow(states[0], 2.00000), True, -states[0]])
+    algebraic[2] = (states[1] - algebraic[0]) / (1.0 + sqrt(states[2]))
+    rates[0] = -algebraic[2]*log(states[2]) + voi
+    rates[1] = algebraic[1] * (1.0 - states[1]) - algebraic[0]*states[1]
+    rates[2] = constants[2] if states[0] > 1e3 else -states[2] / constants[1]
+    rates[3] = constants[0]
+    return(rates)
+"""
+
+def custom_piecewise(cases):
+    """Select the value for the first true condition, as generated code."""
+    return np.select(cases[0::2], cases[1::2])
+
+def greater(x, y):
+    return x > y
+
+def namespace():
+    ns = dict(sizeStates=4, sizeAlgebraic=3, exp=exp, log=log, sqrt=sqrt,
+        custom_piecewise=custom_piecewise, greater=greater)
+    exec src in ns
+    exec jacobian_code(src) in ns
+    return ns
+
+def numjac(f, t, y, p, h=1e-7):
+    """Central finite-difference Jacobian of f(t, y, p)."""
+    y = np.asarray(y, dtype=float)
+    J = np.zeros((len(y), len(y)))
+    for j in range(len(y)):
+        dy = np.zeros_like(y)
+        dy[j] = h * max(1.0, abs(y[j]))
+        J[:, j] = (np.array(f(t, y + dy, p)) -
+                   np.array(f(t, y - dy, p))) / (2 * dy[j])
+    return J
+
+def test_jacobian():
+    ns = namespace()
+    p = [2.0, 9.0, 3.0]
+    for y in [0.5, 0.2, 1.5, 0.0], [-0.5, 0.7, 0.3, 1.0]:
+        J = ns["computeJacobian"](1.0, y, p)
+        np.testing.assert_allclose(J, numjac(ns["computeRates"], 1.0, y, p),
+            rtol=1e-5, atol=1e-8)
+
+def test_nonzero():
+    ns = namespace()
+    assert ns["nonzero"] == [(0, 0), (0, 1), (0, 2),
+                             (1, 0), (1, 1), (2, 2)]
+
+@raises(NotImplementedError)
+def test_unsupported():
+    jacobian_code("""
+def computeRates(voi, states, constants):
+    rates = [0.0] * sizeStates; algebraic = [0.0] * sizeAlgebraic
+    rootfind_0(voi, constants, rates, states, algebraic)
+    return(rates)
+""")
+
+def test_rates_sparsity():
+    """Static analysis also includes dependencies through conditions."""
+    ns = namespace()
+    assert rates_sparsity(src) == sorted(ns["nonzero"] + [(2, 0)])
@@ -1,10 +1,10 @@
 """Tests for :mod:`cgp.cvodeint.namedcvodeint`."""
 # pylint: disable=W0142
 
-from nose.tools import raises
+from nose.tools import assert_equal, raises
 import numpy as np
 
-from ..cvodeint.namedcvodeint import Namedcvodeint
+from ..cvodeint.namedcvodeint import Namedcvodeint, WarmStartCache
 
 def test_autorestore():
     """Verify that time and state get restored when exiting context manager."""
@@ -35,3 +35,88 @@ def test_no_p():
     n = Namedcvodeint(ode, t=[0, 1], y=np.ones(1.0).view([("y", float)]))
     with n.autorestore():
         n.integrate()
+
+def test_integrate_ensemble():
+    """Ensemble members match separate runs under autorestore."""
+    n = Namedcvodeint()
+    tout = np.linspace(0, 1, 5)
+    P = np.tile(n.pr, 2)
+    P.epsilon = 0.5, 2.0
+    _t, Yr, flag = n.integrate_ensemble(P, t=tout)
+    np.testing.assert_equal(flag, 0)
+    for i, p in enumerate(P):
+        with n.autorestore(_p=p):
+            _ti, yi, _flag = n.integrate(t=tout)
+        np.testing.assert_allclose(Yr[i].view(float), yi.view(float))
+
+def test_parameter_frame():
+    """Frames restore parameters and state, re-initializing only if needed."""
+    n = Namedcvodeint()
+    calls = []
+    reinit = n._ReInit_if_required
+    def counting_reinit(*args, **kwargs):
+        calls.append(args)
+        return reinit(*args, **kwargs)
+    n._ReInit_if_required = counting_reinit
+    y0 = n.y.copy()
+    with n.parameter_frame(n.parameter_vector(epsilon=2.0)):
+        with n.parameter_frame():
+            n.pr.epsilon = 3.0
+        assert n.pr.epsilon == 2.0
+    assert n.pr.epsilon == 1.0
+    assert not calls
+    with n.parameter_frame([2.0]):
+        n.integrate(t=1)
+    np.testing.assert_equal(n.y, y0)
+    assert n.pr.epsilon == 1.0
+    assert n._depth == 0
+
+def test_parameter_frame_after_integrate():
+    """An empty frame after integrating keeps time and state as they were."""
+    n, desired = Namedcvodeint(), Namedcvodeint()
+    for m in n, desired:
+        m.integrate(t=1)
+    tret, y = n.tret.value, n.y.copy()
+    calls = []
+    reinit = n._ReInit_if_required
+    def counting_reinit(*args, **kwargs):
+        calls.append(args)
+        return reinit(*args, **kwargs)
+    n._ReInit_if_required = counting_reinit
+    with n.parameter_frame():
+        pass
+    assert not calls
+    assert_equal(n.tret.value, tret)
+    np.testing.assert_equal(n.y, y)
+    for a, d in zip(n.integrate(t=2), desired.integrate(t=2)):
+        np.testing.assert_allclose(a, d)
+
+@raises(TypeError)
+def test_parameter_vector_check_key():
+    """State variables cannot go into a parameter vector."""
+    Namedcvodeint().parameter_vector(x=1.0)
+
+def test_warm_start_cache():
+    """Cache evicts least recently used entries and falls back to nearest."""
+    cache = WarmStartCache(maxsize=2)
+    assert cache.get([1.0]) is None
+    cache.put([1.0], [1.0])
+    cache.put([2.0], [2.0])
+    cache.get([1.0])  # now [2.0] is least recently used
+    cache.put([3.0], [3.0])
+    assert len(cache) == 2
+    np.testing.assert_equal(cache.get([2.1]), [3.0])
+    assert (cache.hits, cache.near, cache.misses) == (1, 1, 1)
+
+def test_warm_start():
+    """Warm start restores the state remembered for similar parameters."""
+    n = Namedcvodeint(warmstart=5)
+    with n.autorestore():
+        n.integrate(t=1)
+        y1 = n.y.copy()
+        n.remember()
+    assert not np.allclose(n.y, y1)
+    with n.autorestore(epsilon=1.001):
+        assert n.warm_start()
+        np.testing.assert_equal(n.y, y1)
+    assert not Namedcvodeint().warm_start()
@@ -5,6 +5,7 @@ import unittest
 import logging
 import os
 import signal
+import threading
 
 from ..utils.poormanslock import Lock, log
 
@@ -58,3 +59,26 @@ def test_timeout():
             pass  # no error
     finally:
         log.setLevel(oldlevel)
+
+def test_timeout_thread():
+    """Outside the main thread, the timeout polls instead of using signals."""
+    oldlevel = log.level
+    result = []
+    def wait():
+        try:
+            with Lock("thread.lock", max_wait=1):
+                pass
+        except IOError:
+            result.append("timed out")
+    try:
+        log.setLevel(logging.CRITICAL)
+        with open("thread.lock", "w"):
+            pass  # existing lockfile causes Lock to wait until timeout
+        thread = threading.Thread(target=wait)
+        thread.start()
+        thread.join()
+        assert result == ["timed out"]
+    finally:
+        log.setLevel(oldlevel)
+        if os.path.exists("thread.lock"):
+            os.remove("thread.lock")
@@ -0,0 +1,82 @@
+"""
+Time to import cgp modules, measured in fresh Python processes.
+
+Short-lived tasks, such as those of an array job, import the same modules
+thousands of times. Therefore, heavy optional dependencies are imported
+only when first needed, and importing a module should have no side effects
+such as creating directories. :func:`bench_import` checks the modules in
+:data:`budget` against their time budgets, and that they do not import any
+of the packages in :data:`deferred`.
+
+From the command line::
+
+    python -m cgp --bench-import
+"""
+
+import subprocess
+import sys
+
+from .ordereddict import OrderedDict
+
+#: Seconds allowed for importing each module, not counting the startup of
+#: the Python interpreter itself
+budget = OrderedDict([
+    ("cgp.physmod.cellmlmodel", 0.5),
+    ("cgp.virtexp.elphys.examples", 0.75),
+    ])
+
+#: Packages that the modules in :data:`budget` should import only when needed
+deferred = ["lxml", "joblib", "tables", "rpy2", "matplotlib"]
+
+# Run in a fresh process to time one import
+script = """
+import sys, time
+t0 = time.time()
+import %s
+print time.time() - t0
+print " ".join(sorted(set(k.split(".")[0] for k, v in sys.modules.items() if v)))
+"""
+
+def import_time(module, repeat=3):
+    """
+    Best time to import *module* in a fresh process, and packages imported.
+
+    :return: (seconds, list of names of top-level packages imported)
+
+    >>> seconds, packages = import_time("cgp.utils.ordereddict")
+    >>> seconds < 1, "cgp" in packages, "lxml" in packages
+    (True, True, False)
+    """
+    times = []
+    for _i in range(repeat):
+        output = subprocess.check_output([sys.executable, "-c",
+            script % module])
+        seconds, packages = output.splitlines()[-2:]
+        times.append(float(seconds))
+    return min(times), packages.split()
+
+def bench_import(repeat=3, verbose=True):
+    """
+    Time imports of the modules in :data:`budget`, return True if all is well.
+
+    A module fails if it takes longer than its budget, or imports any
+    of the packages in :data:`deferred`.
+
+    >>> bench_import()  # doctest: +SKIP
+    Module                          Seconds  Budget  Deferred imported
+    cgp.physmod.cellmlmodel           0.092    0.50
+    cgp.virtexp.elphys.examples       0.159    0.75
+    True
+    """
+    ok = True
+    if verbose:
+        print "%-30s %8s %7s  %s" % ("Module", "Seconds", "Budget",
+            "Deferred imported")
+    for module, seconds in budget.items():
+        t, packages = import_time(module, repeat)
+        bad = [i for i in deferred if i in packages]
+        ok = ok and (t <= seconds) and not bad
+        if verbose:
+            print ("%-30s %8.3f %7.2f  %s" % (module, t, seconds, 
+                " ".join(bad))).rstrip()
+    return ok
@@ -0,0 +1,68 @@
+"""Disk caching with joblib, importing joblib only when a cached function runs."""
+
+import functools
+
+class LazyMemory(object):
+    """
+    Stand-in for :class:`joblib.Memory` that creates it on first use.
+
+    Decorating functions at import time with a joblib cache means importing
+    joblib and creating the cache directory, even in processes that never
+    call the functions. Here, both happen on the first call.
+
+    >>> from tempfile import mkdtemp
+    >>> from shutil import rmtree
+    >>> cachedir = mkdtemp()
+    >>> mem = LazyMemory(cachedir, verbose=0)
+    >>> @mem.cache
+    ... def square(x):
+    ...     print "Computing..."
+    ...     return x * x
+    >>> mem.memory is None  # joblib not used yet
+    True
+    >>> square(3)
+    Computing...
+    9
+    >>> square(3)
+    9
+    >>> square.__name__
+    'square'
+    >>> mem.clear()
+    >>> rmtree(cachedir) # cleanup after doctests
+    """
+
+    def __init__(self, *args, **kwargs):
+        """Arguments are passed to :class:`joblib.Memory` on first use."""
+        self.args = args
+        self.kwargs = kwargs
+        self.memory = None
+
+    def _memory(self):
+        """The :class:`joblib.Memory` object, created if needed."""
+        if self.memory is None:
+            import joblib  # deferred import to minimize startup time
+            self.memory = joblib.Memory(*self.args, **self.kwargs)
+        return self.memory
+
+    def cache(self, func=None, **kwargs):
+        """
+        Decorator like :meth:`joblib.Memory.cache`, also usable as cache().
+
+        Keyword arguments are passed to :meth:`joblib.Memory.cache`.
+        """
+        if func is None:
+            return functools.partial(self.cache, **kwargs)
+        cached = []
+
+        @functools.wraps(func)
+        def wrapper(*args, **kw):
+            """Call the cached function, wrapping it first if needed."""
+            if not cached:
+                cached.append(self._memory().cache(func, **kwargs))
+            return cached[0](*args, **kw)
+
+        return wrapper
+
+    def clear(self, warn=True):
+        """Erase the cache directory, see :meth:`joblib.Memory.clear`."""
+        self._memory().clear(warn=warn)
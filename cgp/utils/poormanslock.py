@@ -6,7 +6,9 @@ The constructor, Lock(lockname="lock", retry_delay=0.1, max_wait=30)
 creates a dummy file (called "lock" by default), but only if it does not 
 already exist. If the file already exists, the constructor will wait 
 "retry_delay" seconds before retrying. Waiting too long ("max_wait") triggers 
-an IOError exception.
+an IOError exception. The timeout uses signal.alarm() where available; 
+outside the main thread, or without signal.alarm(), the waiting loop checks 
+the elapsed time instead.
 
 
 Typical usage:
@@ -43,9 +45,6 @@ log.handlers[0].setFormatter(logging.Formatter(fmtstr))
 
 # Check if we have signal.alarm (only available on Unix)
 hasalarm = hasattr(signal, "alarm")
-if not hasalarm:
-    import warnings
-    warnings.warn("signal.alarm() not available, timeout won't work")    
 
 def _timeout(signum, frame):
     """Signal handler for Lock timeout"""
@@ -73,14 +72,19 @@ class Lock(object):
         self.retry_delay = retry_delay
         self.max_wait = max_wait
         self.fd = None # file descriptor to lockfile (needed by os.close())
+        self.alarm = hasalarm
         if hasalarm:
             # Set up handler
-            signal.signal(signal.SIGALRM, _timeout)  # @UndefinedVariable
+            try:
+                signal.signal(signal.SIGALRM, _timeout)  # @UndefinedVariable
+            except ValueError:  # signals only work in the main thread
+                self.alarm = False
 
     def __enter__(self):
         """Enter context of with statement"""
-        if hasalarm:
+        if self.alarm:
             signal.alarm(self.max_wait)  # @UndefinedVariable
+        start = time.time()
         while self.fd is None:
             try:
                 # open file for exclusive access, raise exception if it exists
@@ -89,9 +93,11 @@ class Lock(object):
                 log.debug("Acquired lock")
             except OSError:
                 log.debug("Failed to acquire lock")
+                if not self.alarm and time.time() - start > self.max_wait:
+                    _timeout(None, None)
                 # wait before trying again
                 time.sleep((0.5 + 0.5 * random()) * self.retry_delay)
-        if hasalarm:
+        if self.alarm:
             # Defuse the timer
             signal.alarm(0)  # @UndefinedVariable
         return self
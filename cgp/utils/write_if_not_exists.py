@@ -1,7 +1,8 @@
-"""open(filename, "w") only if the file does not exist."""
+"""open(filename, "w") only if the file does not exist, or atomically."""
 
 from contextlib import contextmanager
 import os
+import tempfile
 
 @contextmanager
 def write_if_not_exists(filename, raise_if_exists=False):
@@ -69,6 +70,63 @@ def write_if_not_exists(filename, raise_if_exists=False):
     with open(filename, "w") as f:
         yield f
 
+@contextmanager
+def write_atomically(filename, mode="w"):
+    """
+    Context manager to write a temporary file, then rename it to filename.
+    
+    Other processes see either no file or the complete file, never a partial 
+    one. If an exception occurs in the with block, filename is unaffected.
+    Use mode="wb" for binary files.
+    
+    >>> from tempfile import mkdtemp
+    >>> from shutil import rmtree
+    >>> dtemp = mkdtemp()
+    >>> filename = os.path.join(dtemp, "sub", "test.txt")
+    >>> with write_atomically(filename) as f:
+    ...     f.write("Hello world")
+    >>> with open(filename) as f:
+    ...     f.read()
+    'Hello world'
+    >>> with write_atomically(filename) as f:
+    ...     f.write("Goodbye")
+    ...     raise ValueError("Failed halfway")
+    Traceback (most recent call last):
+    ValueError: Failed halfway
+    >>> with open(filename) as f:
+    ...     f.read()
+    'Hello world'
+    >>> os.listdir(os.path.dirname(filename))
+    ['test.txt']
+    
+    >>> rmtree(dtemp) # cleanup after doctests
+    """
+    dirname, _ = os.path.split(os.path.realpath(filename))
+    try:
+        os.makedirs(dirname)
+    except OSError:
+        if not os.path.isdir(dirname):
+            raise
+    fd, tmpname = tempfile.mkstemp(suffix=".tmp", dir=dirname)
+    try:
+        with os.fdopen(fd, mode) as f:
+            yield f
+        replace(tmpname, filename)
+    except:
+        os.remove(tmpname)
+        raise
+
+def replace(src, dst):
+    """
+    Rename src to dst, replacing dst if it exists.
+    
+    This is atomic on Unix. Windows will not rename onto an existing file, 
+    so dst is removed first.
+    """
+    if os.name == "nt" and os.path.exists(dst):
+        os.remove(dst)
+    os.rename(src, dst)
+
 if __name__ == "__main__":
     import doctest
     doctest.testmod()
@@ -171,3 +171,268 @@ def apd_decayrate(stats, p=None):
         difflnv = np.log(1 - p3) - np.log(1 - p2)
         result = - difflnv / (t3 - t2)
         return result if (result > 0) else np.nan
+
+def ap_stats_dtype(p_repol, prefixes=("ap",)):
+    """
+    Structured dtype for statistics of one or more signals per beat.
+    
+    Fields are *amp, base, peak, ttp, decayrate* and one action potential 
+    duration per element of *p_repol*, for each prefix in turn, as returned 
+    by :func:`~cgp.virtexp.elphys.paceable.ap_stats_array`.
+    
+    >>> ap_stats_dtype([0.5, 0.9], prefixes=("ap", "ct"))
+    dtype([('apamp', '<f8'), ('apbase', '<f8'), ('appeak', '<f8'), 
+    ('apttp', '<f8'), ('apdecayrate', '<f8'), ('apd50', '<f8'), 
+    ('apd90', '<f8'), ('ctamp', '<f8'), ('ctbase', '<f8'), ('ctpeak', '<f8'), 
+    ('ctttp', '<f8'), ('ctdecayrate', '<f8'), ('ctd50', '<f8'), 
+    ('ctd90', '<f8')])
+    """
+    names = "amp base peak ttp decayrate".split()
+    names += ["d%d" % (100 * i) for i in p_repol]
+    return np.dtype([(prefix + name, float) 
+        for prefix in prefixes for name in names])
+
+def apd_many(time_list, voltage_list, p_repol=(0.25, 0.50, 0.75, 0.90), 
+    cai_list=None, interpolate=True, decay_p=None):
+    """
+    Statistics of many action potentials at once, as by :func:`apd`.
+    
+    :param time_list: sequence of time arrays, one per beat
+    :param voltage_list: sequence of voltage arrays, one per beat, of the 
+        same lengths as in *time_list*
+    :param p_repol: as for :func:`apd`
+    :param cai_list: optional sequence of Cai arrays, one per beat
+    :return: record array with one row per beat and fields as 
+        :func:`~cgp.virtexp.elphys.paceable.ap_stats_array` (see 
+        :func:`ap_stats_dtype`), the *ct...* fields from *cai_list* if given
+    
+    Beats may differ in length. Rather than a boolean matrix of 
+    thresholds by time points for each beat, this takes the running 
+    minimum of each beat after its peak and locates all threshold 
+    crossings of all beats together by binary search.
+    
+    >>> time = np.linspace(-np.pi, np.pi, 101)
+    >>> stats = apd_many([time, time[:81]], [np.cos(time), np.cos(time[:81])])
+    >>> stats.apd50
+    array([ 1.57079633,  1.57079633])
+    >>> stats.apd90
+    array([ 2.49855986,         nan])
+    
+    This agrees with :func:`apd`:
+    
+    >>> apd(time, np.cos(time))["t_repol"]
+    array([ 1.04693965,  1.57079633,  2.09465301,  2.49855986])
+    """
+    p_repol = np.atleast_1d(p_repol)
+    signals = [voltage_list] if cai_list is None else [voltage_list, cai_list]
+    prefixes = ("ap", "ct")[:len(signals)]
+    result = np.recarray(len(time_list), 
+        dtype=ap_stats_dtype(p_repol, prefixes))
+    for prefix, signal in zip(prefixes, signals):
+        stats = _apd_batch(time_list, signal, p_repol, interpolate, decay_p)
+        for name in "amp base peak ttp decayrate".split():
+            result[prefix + name] = stats[name]
+        for j, p in enumerate(p_repol):
+            result[prefix + "d%d" % (100 * p)] = stats["t_repol"][:, j]
+    return result
+
+def _apd_batch(time_list, voltage_list, p_repol, interpolate=True, 
+    decay_p=None):
+    """
+    Like :func:`apd`, but for a list of beats, returning arrays.
+    
+    Statistics are arrays with one element per beat; *t_repol* has one 
+    row per beat and one column per element of *p_repol*.
+    """
+    n = np.array([len(np.ravel(t)) for t in time_list])
+    # Beats padded to equal length, one per row
+    time = np.zeros((len(n), n.max()))
+    voltage = np.empty(time.shape)
+    voltage.fill(-np.inf)
+    for k, (t, v) in enumerate(zip(time_list, voltage_list)):
+        time[k, :n[k]] = np.ravel(t)
+        voltage[k, :n[k]] = np.ravel(v)
+    rows = np.arange(len(n))[:, None]
+    cols = np.arange(time.shape[1])
+    # landmarks in the action potential
+    base_v = voltage[:, 0]
+    peak_i = voltage.argmax(axis=1)
+    peak_t = time[rows[:, 0], peak_i]
+    peak_v = voltage[rows[:, 0], peak_i]
+    threshold = peak_v[:, None] - p_repol * (peak_v - base_v)[:, None]
+    # Lowest voltage since the peak; first repolarized at the first point 
+    # where this is below threshold
+    after = (cols > peak_i[:, None]) & (cols < n[:, None])
+    runmin = np.minimum.accumulate(np.where(after, voltage, np.inf), axis=1)
+    first = _first_below(runmin, threshold)
+    # Repolarization occurred between time-point repol_i and repol_i + 1, 
+    # or repol_i is 0 if never repolarized, as in apd()
+    repol_i = np.where(first < n[:, None], first - 1, 0)
+    t0, t1 = time[rows, repol_i], time[rows, repol_i + 1]
+    if interpolate:
+        # linear interpolation
+        v0, v1 = voltage[rows, repol_i], voltage[rows, repol_i + 1]
+        with np.errstate(all="ignore"):
+            t_repol = t0 + (threshold - v0) * (t1 - t0) / (v1 - v0)
+    else:
+        t_repol = t0
+    # sanity checking: time[0] <= t_repol[i-1] <= t_repol[i] <= time[-1], 
+    # otherwise that and the following elements are NaN
+    prev = np.c_[t_repol[:, :1], t_repol[:, :-1]]
+    with np.errstate(invalid="ignore"):
+        ok = ((time[:, :1] <= prev) & (prev <= t_repol) & 
+            (t_repol <= time[rows, n[:, None] - 1]))
+    t_repol[np.logical_or.accumulate(~ok, axis=1)] = np.nan
+    # decay rate, as in apd_decayrate()
+    p2, p3 = (p_repol[0], p_repol[-1]) if decay_p is None else decay_p
+    decayrate = np.empty(len(n))
+    decayrate.fill(np.nan)
+    if (p2 in p_repol) and (p3 in p_repol):
+        t2, t3 = [t_repol[:, np.flatnonzero(p_repol == pi)[0]] 
+            for pi in p2, p3]
+        with np.errstate(all="ignore"):
+            difflnv = np.log(1 - p3) - np.log(1 - p2)
+            rate = - difflnv / (t3 - t2)
+            decayrate[rate > 0] = rate[rate > 0]
+    return dict(base=base_v, ttp=peak_t, peak=peak_v, amp=peak_v - base_v, 
+        t_repol=t_repol, decayrate=decayrate, i=np.c_[peak_i, repol_i])
+
+def _first_below(runmin, threshold):
+    """
+    Column of the first element below each threshold, by binary search.
+    
+    Rows of *runmin* must be non-increasing. *threshold* has one row per 
+    row of *runmin*, and any number of columns. The result has the shape 
+    of *threshold*, with ``runmin.shape[1]`` where no element is below.
+    
+    >>> runmin = np.array([[5, 4, 2, 2, 1], [3, 3, 3, 3, 3.0]])
+    >>> _first_below(runmin, np.array([[4.5, 2, 0], [3.5, 3, 1]]))
+    array([[1, 4, 5],
+           [0, 5, 5]])
+    """
+    rows = np.arange(len(runmin))[:, None]
+    lo = np.zeros(threshold.shape, dtype=int)
+    hi = np.empty(threshold.shape, dtype=int)
+    hi.fill(runmin.shape[1])
+    active = lo < hi
+    while active.any():
+        mid = (lo + hi) // 2
+        below = runmin[rows, np.minimum(mid, runmin.shape[1] - 1)] < threshold
+        hi = np.where(active & below, mid, hi)
+        lo = np.where(active & ~below, mid + 1, lo)
+        active = lo < hi
+    return lo
+
+class OnlineAPD(object):
+    """
+    Statistics as by :func:`apd`, accumulated step by step while integrating.
+    
+    Call :meth:`update` after each solver step, then :meth:`stats`. 
+    The peak and the repolarization crossings are located within steps by 
+    root-finding on the solver's interpolant, as CVODE's rootfinding does, 
+    so only the current step is ever needed.
+    
+    As with :func:`apd`, the peak is the highest value, and repolarization 
+    times are the first times after it that the signal is below each 
+    threshold. Thresholds not crossed give NaN.
+    
+    Here, steps of a cosine wave are interpolated exactly:
+    
+    >>> p_repol = np.r_[0.25, 0.5, 0.75, 0.9]
+    >>> online = OnlineAPD(p_repol)
+    >>> def interp(t, k):
+    ...     return np.cos(t) if k == 0 else -np.sin(t)
+    >>> time = np.linspace(-np.pi, np.pi, 11)
+    >>> for t0, t1 in zip(time[:-1], time[1:]):
+    ...     online.update(t0, t1, interp)
+    >>> stats = online.stats()
+    >>> stats["peak"], abs(stats["ttp"]) < 1e-12
+    (1.0, True)
+    >>> np.testing.assert_allclose(stats["t_repol"], 
+    ...     np.arccos(1 - 2 * p_repol))
+    """
+    
+    def __init__(self, p_repol=(0.25, 0.50, 0.75, 0.90)):
+        self.p_repol = np.atleast_1d(p_repol)
+        self.base = None
+        self.peak = self.ttp = None
+        self.threshold = None
+        self.t_repol = np.empty(len(self.p_repol))
+        self.ncrossed = 0
+    
+    def _newpeak(self, t, v):
+        """Record a new highest value; start over looking for crossings."""
+        self.peak, self.ttp = v, t
+        self.threshold = v - self.p_repol * (v - self.base)
+        self.t_repol.fill(np.nan)
+        self.ncrossed = 0
+    
+    def update(self, t0, t1, interp):
+        """
+        Update statistics with a solver step from *t0* to *t1*.
+        
+        *interp(t, k)* is the *k*'th time derivative of the signal at time 
+        *t* within the step, e.g. from :func:`pysundials.cvode.CVodeGetDky`.
+        """
+        v0, v1 = interp(t0, 0), interp(t1, 0)
+        if self.base is None:
+            self.base = v0
+            self._newpeak(t0, v0)
+        # local maximum within the step
+        dv0, dv1 = interp(t0, 1), interp(t1, 1)
+        if dv0 > 0 >= dv1:
+            tm = t1 if dv1 == 0 else _falsi(lambda t: interp(t, 1), 
+                t0, t1, dv0, dv1)
+            vm = interp(tm, 0)
+            if vm > self.peak:
+                self._newpeak(tm, vm)
+        if v1 > self.peak:
+            self._newpeak(t1, v1)
+        # repolarization thresholds crossed during the step
+        s, vs = (t0, v0) if self.ttp <= t0 else (self.ttp, self.peak)
+        n = len(self.threshold)
+        while (self.ncrossed < n) and (v1 < self.threshold[self.ncrossed]):
+            x = self.threshold[self.ncrossed]
+            s = _falsi(lambda t: interp(t, 0) - x, s, t1, vs - x, v1 - x)
+            vs = x
+            self.t_repol[self.ncrossed] = s
+            self.ncrossed += 1
+    
+    def stats(self, decay_p=None):
+        """Statistics as returned by :func:`apd`, except the indices *i*."""
+        result = dict(base=self.base, ttp=self.ttp, peak=self.peak, 
+            amp=self.peak - self.base, p_repol=self.p_repol, 
+            t_repol=self.t_repol.copy())
+        result["decayrate"] = apd_decayrate(result, decay_p)
+        return result
+
+def _falsi(g, a, b, ga, gb, maxiter=100):
+    """
+    First time where *g* is negative, bracketed by ``ga >= 0 > gb``.
+    
+    Uses the Illinois variant of regula falsi, as does CVODE's rootfinding, 
+    to a tolerance of 100 machine epsilons relative to *a* and *b - a*.
+    
+    >>> _falsi(lambda t: 2 - t * t, 0.0, 2.0, 2.0, -2.0)
+    1.41421356237309...
+    """
+    tol = 100 * np.finfo(float).eps * (abs(a) + abs(b - a))
+    side = 0
+    for _i in range(maxiter):
+        if b - a <= tol:
+            break
+        c = b - gb * (b - a) / (gb - ga)
+        if not a < c < b:
+            c = 0.5 * (a + b)
+        gc = g(c)
+        if gc >= 0:
+            a, ga = c, gc
+            if side == 1:
+                gb *= 0.5
+            side = 1
+        else:
+            b, gb = c, gc
+            if side == -1:
+                ga *= 0.5
+            side = -1
+    return b
@@ -5,38 +5,21 @@
 from __future__ import division
 
 import logging
+import os
+import threading
+import traceback
+import uuid
 from collections import namedtuple
 from contextlib import contextmanager
 from itertools import chain
 
 import numpy as np
 
-# TODO: We now depend on rpy2, so don't need the workaround below.
-try:
-    from cgp.utils.rnumpy import r, RRuntimeError
-    have_rnumpy = True
-except ImportError:
-    have_rnumpy = False
-    
-    import warnings
-    warnings.warn("rnumpy not installed, some functions will not work.")
-    
-    from nose.plugins.skip import SkipTest
-    
-    class DummyR(object):
-        """Dummy R object to skip nosetests if R is unavailable."""
-        
-        def __getattr__(self, name):
-            raise SkipTest("rnumpy not installed")
-    
-    r = DummyR()
-
 from ...cvodeint.namedcvodeint import Namedcvodeint
 from . import paceable
 from .ap_stats import apd
 from ...utils.ordereddict import OrderedDict
 from ...utils.thinrange import thin
-from ...utils.splom import r2rec
 
 Pace = namedtuple("Pace", "t y dy a stats")
 Trajectory = namedtuple("Trajectory", "t y dy a")
@@ -48,6 +31,29 @@ format_ = "%(" + ")s\t%(".join(keys.split()) + ")s"
 logging.basicConfig(level=logging.INFO, format=format_)
 logger = logging.getLogger("protocols")
 
+class DummyR(object):
+    """Dummy R object to skip nosetests if R is unavailable."""
+    
+    def __getattr__(self, name):
+        from nose.plugins.skip import SkipTest
+        raise SkipTest("rnumpy not installed")
+
+def rnumpy():
+    """
+    Return (r, RRuntimeError) from :mod:`cgp.utils.rnumpy`.
+    
+    Importing rnumpy starts R, so this is deferred until R is needed. 
+    If rpy2 is not installed, r is a :class:`DummyR`.
+    """
+    # TODO: We now depend on rpy2, so don't need the workaround below.
+    try:
+        from ...utils.rnumpy import r, RRuntimeError
+    except ImportError:
+        import warnings
+        warnings.warn("rnumpy not installed, some functions will not work.")
+        return DummyR(), None
+    return r, RRuntimeError
+
 @contextmanager
 def roptions(**kwargs):
     """
@@ -58,6 +64,7 @@ def roptions(**kwargs):
     
     Example: Temporarily use a different character for the decimal point.
     
+    >>> r, _RRuntimeError = rnumpy()
     >>> with roptions(OutDec="@"):
     ...     r.as_character(1.5)[0]
     '1@5'
@@ -83,6 +90,7 @@ def roptions(**kwargs):
     altogether,     whereas in R this setting is ignored if it is not a 
     positive integer.
     """
+    r, RRuntimeError = rnumpy()
     opt = r.options(**kwargs)
     old_max_lines = RRuntimeError.max_lines
     if kwargs.get("deparse_max_lines") == 0:
@@ -312,6 +320,67 @@ def vclamp2arr(L, nthin=100):
     return result.reshape(1)
 
 
+# Models rebuilt by pool workers, keyed by (sweep key, thread identifier)
+_sweep_models = {}
+_sweep_lock = threading.Lock()
+# Keys (process id, uuid) of sweeps that are running in this process
+_open_sweeps = set()
+
+def _sweep_worker(task):
+    """
+    Run one protocol of :meth:`Clampable.sweep` in a pool worker.
+    
+    The model is rebuilt from its spec on the first task of each sweep that 
+    reaches this thread or process, and reused for the rest. A thread keeps 
+    only the model of its latest sweep. Threads in the process that runs the 
+    sweep stop caching when it ends, although queued tasks may still run.
+    """
+    key, spec, method, protocol, nthin, catch = task
+    thread = threading.current_thread().ident
+    model = _sweep_models.get((key, thread))
+    if model is None:
+        model = spec.build()
+        with _sweep_lock:
+            for k in [k for k in _sweep_models if k[1] == thread]:
+                del _sweep_models[k]
+            if (key[0] != os.getpid()) or (key in _open_sweeps):
+                _sweep_models[key, thread] = model
+    return _run_protocol(model, method, protocol, nthin, catch)
+
+def clear_sweep_models(key=None):
+    """
+    Drop models rebuilt by pool workers in this process.
+    
+    :param tuple key: drop only the models of this sweep (default: all)
+    
+    :meth:`Clampable.sweep` calls this when it finishes or is closed, which 
+    frees the models of :class:`~multiprocessing.pool.ThreadPool` workers. 
+    Each process of a :class:`~multiprocessing.Pool` keeps the model of the 
+    last sweep it ran until it runs another sweep or the pool is closed.
+    
+    >>> clear_sweep_models()
+    >>> _sweep_models
+    {}
+    """
+    with _sweep_lock:
+        for k in list(_sweep_models):
+            if (key is None) or (k[0] == key):
+                del _sweep_models[k]
+
+def _run_protocol(model, method, protocol, nthin, catch):
+    """
+    Return (protocol, result, traceback) for a protocol method of a model.
+    
+    If *catch* is True, an exception is returned as a formatted traceback, 
+    with result None. Otherwise, exceptions propagate and traceback is None.
+    """
+    try:
+        return protocol, list(getattr(model, method)(protocol, nthin)), None
+    except Exception:  # pylint: disable=W0703
+        if not catch:
+            raise
+        return protocol, None, traceback.format_exc()
+
 class Clampable(object):
     """
     :wiki:`Mixin` class for in silico experimental protocols for Bondarenko-like models.
@@ -540,7 +609,8 @@ class Clampable(object):
                     yield Pace(t, y, dy, a, stats)
             y0 = y[-1]
     
-    def vecpace(self, protocol, nthin=None):
+    def vecpace(self, protocol, nthin=None, pool=None, chunksize=1, 
+        ordered=True):
         """
         Vectorized :meth:`~Clampable.pace`.
         
@@ -548,6 +618,8 @@ class Clampable(object):
             If any n, period, duration or amplitude is a sequence of length > 1, 
             multiple protocols are computed by :func:`ndbcast`.
         :param nthin: Number of time-points for each pulse (default: no thinning).
+        :param pool, chunksize, ordered: Run protocols in parallel, 
+            see :meth:`sweep`.
         :return list: Input and output (protocol_i, [list of Pace]) for each 
             call to :meth:`~Clampable.pace`, one for each unique protocol.
         
@@ -564,8 +636,76 @@ class Clampable(object):
         ...         print "%8.3f" % pace.y.V.max(),
         [(3, 150, 0.25, -80)]   31.584 -63.698 -63.112
         [(3, 250, 0.25, -80)]   31.584 -63.252 -62.847
+        
+        The protocols are independent and can run in parallel, see 
+        :meth:`sweep` for the *pool*, *chunksize* and *ordered* arguments.
+        """
+        return list(self.sweep("pace", ndbcast(*protocol), nthin, pool=pool, 
+            chunksize=chunksize, ordered=ordered))
+    
+    def sweep(self, method, protocols, nthin=None, pool=None, chunksize=1, 
+        ordered=True, log_exceptions=False):
+        """
+        Iterator to yield (protocol, result) for each of several protocols.
+        
+        :param str method: name of a protocol method, such as 
+            :meth:`~Clampable.pace` or :meth:`~Clampable.vclamp`, 
+            called as ``method(protocol, nthin)``
+        :param protocols: sequence of protocols, e.g. from :func:`ndbcast` 
+            or :func:`pairbcast`
+        :param nthin: thinning output as for *method*
+        :param pool: :class:`multiprocessing.Pool`, 
+            :class:`multiprocessing.pool.ThreadPool`, or other object with 
+            methods ``imap`` and ``imap_unordered`` like theirs 
+            (default: run protocols in turn in this process)
+        :param int chunksize: number of protocols sent to a worker at a time
+        :param bool ordered: yield results in the order of *protocols*; if 
+            False, yield them as they are completed
+        :param bool log_exceptions: log any exception raised by a protocol 
+            and skip it, rather than stopping the sweep
+        :return: Yields tuples (protocol_i, list of results_i), as 
+            :meth:`vecpace` and :meth:`vecvclamp` return.
+        
+        With a pool, each worker rebuilds the model from its 
+        :meth:`~cgp.physmod.cellmlmodel.Cellmlmodel.spec` once per sweep, 
+        and starts each protocol from the current state and parameters. 
+        The rebuilt models are released as described in 
+        :func:`clear_sweep_models`. 
+        Threads help only if the right-hand side releases the GIL, i.e. for 
+        compiled models (see :mod:`cgp.cvodeint._stepper`).
+        
+        >>> from multiprocessing import Pool
+        >>> from cgp.virtexp.elphys.examples import Bond
+        >>> b = Bond(reltol=1e-3)
+        >>> protocols = pairbcast((1000, -140), (500, (-80, -40, 0, 40)))
+        >>> pool = Pool(2)
+        >>> L = b.sweep("vclamp", protocols, pool=pool, ordered=False)
+        >>> sorted(proto[1][1] for proto, traj in L)
+        [-80, -40, 0, 40]
+        >>> pool.close()
         """
-        return [(p, list(self.pace(p, nthin))) for p in ndbcast(*protocol)]
+        if pool is None:
+            results = (_run_protocol(self, method, p, nthin, log_exceptions) 
+                for p in protocols)
+        else:
+            key, spec = (os.getpid(), uuid.uuid4().hex), self.spec()
+            with _sweep_lock:
+                _open_sweeps.add(key)
+            tasks = ((key, spec, method, p, nthin, log_exceptions) 
+                for p in protocols)
+            imap = pool.imap if ordered else pool.imap_unordered
+            results = imap(_sweep_worker, tasks, chunksize)
+        try:
+            for p, result, error in results:
+                if error is None:
+                    yield p, result
+                else:
+                    logger.error("Error in %s(%s)\n%s", method, p, error)
+        finally:
+            if pool is not None:
+                with _sweep_lock:
+                    _open_sweeps.discard(key)
+                clear_sweep_models(key)
 
     @contextmanager
     def dynclamp(self, setpoint, R=0.02, V="V", ion="Ki", scale=None):
@@ -668,8 +808,9 @@ class Clampable(object):
         y = np.array(self.y).view(self.dtype.y)
         
         # Use original options when rerunning the Cvodeint initialization.
+        # f_data may hold the parameters, as for Cellmlmodel.
         oldkwargs = dict((k, getattr(self, k)) 
-            for k in "chunksize maxsteps reltol abstol".split())
+            for k in "chunksize maxsteps reltol abstol f_data".split())
         
         pr_old = self.pr.copy()
         
@@ -802,7 +943,8 @@ class Clampable(object):
             p2 = [Trajectory(*[thin(arr, nthin) for arr in i]) for i in p2]
         return p1, gap, p2
     
-    def vecvclamp(self, protocol, nthin=None, log_exceptions=False):
+    def vecvclamp(self, protocol, nthin=None, log_exceptions=False, 
+        pool=None, chunksize=1, ordered=True):
         """
         Vectorized :meth:`~Clampable.vclamp`.
         
@@ -811,6 +953,8 @@ class Clampable(object):
             multiple protocols are computed by pairbcast().
         :param nthin: thinning output as for :meth:`~Clampable.vclamp`
         :param bool log_exceptions: handle any exceptions by logging a warning
+        :param pool, chunksize, ordered: Run protocols in parallel, 
+            see :meth:`sweep`.
         :return: List with input and output (protocol_i, trajectories_i) for 
             each call to :meth:`~Clampable.vclamp`, one for each unique protocol.
         
@@ -838,14 +982,21 @@ class Clampable(object):
         
         >>> all(b.y == b.model.y0)
         True
+        
+        Large families of protocols can run in parallel, with the same result.
+        
+        >>> from multiprocessing.pool import ThreadPool
+        >>> pool = ThreadPool(2)
+        >>> L2 = b.vecvclamp(protocol, pool=pool)
+        >>> [(proto, traj[1].a.i_Na.min()) for proto, traj in L2] == [
+        ...     (proto, traj[1].a.i_Na.min()) for proto, traj in L]
+        True
+        >>> pool.close()
         """
-        L = []
-        for p in pairbcast(*protocol):
-            try:
-                L.append((p, self.vclamp(p, nthin)))
-            except Exception, _exc:  # pylint: disable=W0703,W0612
-                logger.exception("Error in vclamp(%s)", p)
-        return L
+        # failing protocols are logged and skipped, as they always were
+        return list(self.sweep("vclamp", pairbcast(*protocol), nthin, 
+            pool=pool, chunksize=chunksize, ordered=ordered, 
+            log_exceptions=True))
     
     def bondfig3(self, thold=1000, vhold=-140, 
         t1=500, v1=np.arange(-140, 51, 10), 
@@ -1037,6 +1188,7 @@ def mmfit(x, y, rse=False):
     >>> mmfit(x, -y)
     (nan, nan)
     """
+    r, RRuntimeError = rnumpy()
     with roptions(show_error_messages=False, deparse_max_lines=0):
         kwargs = dict(formula="y~ymax*x/(x+xhalf)", data=dict(x=x, y=y), 
             start=dict(ymax=max(y), xhalf=np.mean(x)))
@@ -1049,6 +1201,7 @@ def mmfit(x, y, rse=False):
             logger.debug(errmsg, kwargs)
             ymax = xhalf = rse_ymax = rse_xhalf = np.nan
         else:
+            from ...utils.splom import r2rec  # imports matplotlib
             coef = r2rec(r.as_data_frame(r.coef(r.summary(fit))))
             ymax, xhalf = coef.Estimate
             rse_ymax, rse_xhalf = coef["Std. Error"] / coef.Estimate
@@ -1146,7 +1299,9 @@ def decayfit(t, y, p=(0.05, 0.9), prepend_zero=False, rse=False, lm=False):
         tau = rse_slope = np.nan
         rlm = None
     else:
-        if have_rnumpy:
+        r, RRuntimeError = rnumpy()
+        if not isinstance(r, DummyR):
+            from ...utils.splom import r2rec  # imports matplotlib
             with roptions(show_error_messages=False, deparse_max_lines=0):
                 try:
                     rlm = r.lm("log(y)~t", data=dict(t=t[i0:i1], 
@@ -1233,6 +1388,7 @@ def markovplot(t, y, a=None, names=None, model=None, comp=None, col="bgrcmyk",
     xc = x.view(float).cumsum(axis=1).view(x.dtype).squeeze()
     if plotr:
         from ...utils.rec2dict import rec2dict
+        r, RRuntimeError = rnumpy()
         r["df"] = r.cbind({"t": t}, r.as_data_frame(rec2dict(x)))
         # r["df"] = r.data_frame(t=t, **rec2dict(xc))
         # r["df"] = r("df[c('" + "','".join(["t"] + names) + "')]")
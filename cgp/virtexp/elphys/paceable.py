@@ -32,7 +32,8 @@ has a
 
 from __future__ import division # 7 / 4 = 1.75 rather than 1
 from . import ap_stats
-from collections import namedtuple, deque
+from ...cvodeint.core import CvodeException
+from collections import namedtuple
 from pysundials import cvode
 import ctypes
 import numpy as np
@@ -60,7 +61,7 @@ class Paceable(object):
     """
 
     def ap(self, p_repol=(0.25, 0.5, 0.75, 0.9), 
-        ignore_flags=False, rootfinding=False):
+        ignore_flags=False, rootfinding=False, online=False):
         r"""
         Simulate action potential triggered by stimulus current.
         
@@ -70,6 +71,10 @@ class Paceable(object):
            action potential
         :param bool rootfinding: use CVODE's rootfinding facilities to 
            compute action potential statistics more accurately
+        :param bool online: compute statistics while CVODE steps, as 
+           accurately as with *rootfinding* but without storing the 
+           trajectory; *t* and *y* then hold only the initial and final 
+           time and state (see :meth:`_ap_online`)
         
         >>> from cgp.virtexp.elphys.examples import Bond
         >>> cell = Bond()
@@ -107,23 +112,17 @@ class Paceable(object):
          't_repol': array([  3.31012...,   5.125...]),
          'ttp': 1.844189...}
         
-        Module-level variables are shared between instances!
+        The generated module is shared between instances, but each instance 
+        has its own parameters and default initial state (see 
+        :meth:`~cgp.physmod.cellmlmodel.Cellmlmodel._storage`).
         
         >>> b0 = Bond(); b1 = Bond()
-        >>> original_y00 = b0.model.y0[0]
-        >>> b0.model.y0 is b1.model.y0
+        >>> b0.model is b1.model
         True
-        >>> b0.model.y0[0] = 12345
-        >>> b1.model.y0[0]
-        12345.0
         >>> b1.y0r.V = 54321
-        >>> b0.y0r.V
-        array([ 54321.])
-        
-        Reset the defaults so we don't mess up other doctests:
-        
-        >>> b0.y0r.V = original_y00
-        >>> assert b0.y0r.V == b1.model.y0[0] == original_y00
+        >>> b1.pr.stim_amplitude = 0
+        >>> b0.y0r.V == b0.model.y0[0], b0.pr.stim_amplitude
+        (array([ True], dtype=bool), array([-80.]))
 
         To temporarily modify initial state or parameters, use 
         :meth:`~cvodeint.namedcvodeint.Namedcvodeint.autorestore`.
@@ -141,8 +140,12 @@ class Paceable(object):
          't_repol': array([  2.550...,   3.648...]),
          'ttp': 1.327...}
         """
+        if rootfinding and online:
+            raise ValueError("Choose rootfinding or online, not both")
         if rootfinding:
             return self._ap_with_rootfinding(p_repol, ignore_flags)
+        elif online:
+            return self._ap_online(p_repol, ignore_flags)
         else:
             return self._ap_without_rootfinding(p_repol, ignore_flags)
     
@@ -191,63 +194,44 @@ class Paceable(object):
         result.append(self.integrate(t=[0, self.pr.stim_duration], nrtfn=0, 
             assert_flag=cvode.CV_TSTOP_RETURN, ignore_flags=ignore_flags))
         
-        # integrate from stimulus to peak
-        j_peak = 0 # index to "result" item ending with peak
-        # make sure we don't stop at a minor peak at end of stimulus
-        # repeat until we are at an extremum with V > 0
-        while True:
-            j_peak += 1
-            result.append(self.integrate(t=self.pr.stim_period, 
-                nrtfn=1, g_rtfn=self.ydoti("V"), assert_flag=cvode.CV_ROOT_RETURN, 
-                ignore_flags=ignore_flags))
-            _tj, yj, flagj = result[-1]
-            if (flagj == cvode.CV_TSTOP_RETURN) or (yj.V[-1] > 0):
-                break
-        
-        # compute repolarization thresholds
+        # Integrate from stimulus to next stimulus in one pass, with one 
+        # root function for the peak (dV/dt = 0) and for V minus each 
+        # repolarization threshold, which are set once the peak is known.
         Vmin = result[0][1][0].V # 1st integration, 2nd return var, 1st step
-        # was: Vmax = result[-1][1][-1].V
-        Vmax = yj.V[-1] # last integration, 2nd return var, last step
-        V_repol = Vmax - p_repol * (Vmax - Vmin)        
-        
-        # integrate to each repolarization threshold in turn
-        g_rtfn = self.repol()
-        result += [self.integrate(t=self.pr.stim_period,
-            nrtfn=1, g_rtfn=g_rtfn, g_data=ctypes.byref(ctypes.c_float(x)),
-            assert_flag=(cvode.CV_ROOT_RETURN, cvode.CV_TSTOP_RETURN), 
-            ignore_flags=ignore_flags)
-            for x in V_repol]
-        
-        # If time has run out, flag is None but flagj is CV_TSTOP_RETURN
-        if result[-1][-1] == cvode.CV_ROOT_RETURN:
-            # integrate from repolarization to next stimulus:
-            result.append(self.integrate(t=self.pr.stim_period, nrtfn=0, 
-                assert_flag=cvode.CV_TSTOP_RETURN, 
-                ignore_flags=ignore_flags))        
-        
-        # drop intervals where flag is None; those were past t_stop
-        result = [res for res in result if res[-1] is not None]
-        t, Y, _flag = zip(*result) # (t, Y, flag), where each is a tuple
+        V_repol = np.empty(len(p_repol))
+        V_repol.fill(np.nan) # not tracked until the peak is known
+        i_peak = [] # index of peak in output of the second integration
+        i_repol = np.zeros(len(V_repol), dtype=int) # same for V_repol
+        
+        def roots(i, rootsfound):
+            """Note the peak, then the first crossing of each threshold."""
+            V = self.yr.V[0] # state at the root
+            if not i_peak:
+                # make sure we don't stop at a minor peak at end of stimulus
+                if rootsfound[0] and (V > 0):
+                    i_peak.append(i)
+                    V_repol[:] = V - p_repol * (V - Vmin)
+            else:
+                first = (i_repol == 0) & (np.array(rootsfound[1:]) != 0)
+                i_repol[first] = i
         
-        # The items of the tuples refer to these intervals, assuming the
-        # default p_repol specifying four thresholds:
-        # 0) stimulus
-        # ...+ possibly more here, waiting for some extremum V >= 0...
-        # 1) stimulus to peak,
-        # 2) peak to first repolarization threshold
-        # 3) first to second repolarization threshold
-        # 4) second to third repolarization threshold
-        # 5) third to fourth repolarization threshold
-        # 6) fourth repolarization threshold to just before next stimulus
-        
-        stats = {"base": Y[0][0].V, "ttp": t[j_peak][-1], 
-            "peak": Y[j_peak][-1].V, "p_repol": p_repol}
-        # summarize "result" items for repolarization (items _after_ j_peak)
-        stats["t_repol"] = np.array([ti[-1]
-            for ti, _yi, flagi in result[j_peak + 1:]
-            if flagi == cvode.CV_ROOT_RETURN])
-        # keep indices for j_peak and later items
-        stats["i"] = np.cumsum([len(ti) for ti in t])[j_peak:-1] - 1        
+        result.append(self.integrate(t=self.pr.stim_period, 
+            nrtfn=1 + len(V_repol), g_rtfn=self.peak_and_repol(V_repol), 
+            roots=roots, assert_flag=(cvode.CV_TSTOP_RETURN, 
+            cvode.CV_ROOT_RETURN), ignore_flags=ignore_flags))
+        if not (i_peak or ignore_flags):
+            raise CvodeException(cvode.CV_TSTOP_RETURN, result[-1])
+        
+        t, Y, _flag = zip(*result) # (t, Y, flag), where each is a tuple
+        # indices into the concatenation of the two intervals
+        i = len(t[0]) + np.r_[i_peak, i_repol[i_repol > 0]].astype(int)
+        stats = {"base": Y[0][0].V, "p_repol": p_repol, "i": []}
+        if i_peak:
+            stats["i"] = i
+            stats["ttp"] = t[1][i_peak[0]]
+            stats["peak"] = Y[1][i_peak[0]].V
+        # keep only the thresholds crossed
+        stats["t_repol"] = np.array([t[1][j] for j in i_repol if j > 0])
         # concatenation converts recarray to ndarray, so need to convert back
         Y = np.concatenate(Y).view(np.recarray)
         t = np.concatenate(t)
@@ -306,6 +290,40 @@ class Paceable(object):
             return 0
         return result
     
+    def peak_and_repol(self, V_repol):
+        """
+        Root function for dV/dt and the difference between V and thresholds.
+        
+        :param array_like V_repol: float array of repolarization thresholds, 
+           read at every call so it can be filled in when the peak is known. 
+           While it holds NaNs, only dV/dt is tracked.
+        :return: function of *(t, y, gout, g_data)* for 
+           :func:`pysundials.cvode.CVodeRootInit` with 
+           ``nrtfn = 1 + len(V_repol)``.
+        
+        >>> from cgp.virtexp.elphys.examples import Bond
+        >>> bond = Bond()
+        >>> V_repol = np.array([np.nan, np.nan])
+        >>> g = bond.peak_and_repol(V_repol)
+        >>> gout = cvode.NVector([0.0, 0.0, 0.0])
+        >>> g(0, bond.model.y0, gout, None), gout
+        (0, [..., 1.0, 1.0])
+        >>> V_repol[:] = -75, -80
+        >>> g(0, bond.model.y0, gout, None), gout
+        (0, [..., -7.420199..., -2.420199...])
+        """
+        dvdt = self.ydoti("V")
+        iV = self.dtype.y.names.index("V")
+        
+        def result(t, y, gout, g_data):
+            """Set gout to [dV/dt, V - V_repol[0], V - V_repol[1], ...]."""
+            dvdt(t, y, gout, g_data)
+            tracking = not np.isnan(V_repol[0])
+            for k, x in enumerate(V_repol):
+                gout[k + 1] = (y[iV] - x) if tracking else 1.0
+            return 0
+        return result
+    
     def _ap_without_rootfinding(self, p_repol=(0.25, 0.5, 0.75, 0.9), 
         ignore_flags=False):
         r"""
@@ -369,6 +387,67 @@ class Paceable(object):
             pass
         return t, Y, stats
     
+    def _ap_online(self, p_repol=(0.25, 0.5, 0.75, 0.9), 
+        ignore_flags=False):
+        r"""
+        Simulate action potential, computing statistics as CVODE steps.
+        
+        Arguments are as for :meth:`ap`.
+        
+        After each internal step, an :class:`~ap_stats.OnlineAPD` for *V* 
+        (and *Cai*, if present) updates the peak and repolarization times, 
+        locating them within the step on CVODE's interpolating polynomial. 
+        This takes one pass over the action potential, like 
+        :meth:`_ap_without_rootfinding`, but gives statistics as accurate as 
+        :meth:`_ap_with_rootfinding`, without storing the trajectory. 
+        The returned *t* and *y* hold only the initial and final time and 
+        state, and *stats* has no indices *i*.
+        
+        >>> from cgp.virtexp.elphys.examples import Bond
+        >>> bond = Bond()
+        >>> with bond.autorestore():
+        ...     t, y, stats = bond.ap(online=True)
+        >>> with bond.autorestore():
+        ...     _t, _y, desired = bond.ap(rootfinding=True)
+        >>> len(t), len(y)
+        (2, 2)
+        >>> np.testing.assert_allclose(stats["t_repol"], desired["t_repol"], 
+        ...     rtol=1e-4)
+        """
+        names = self.dtype.y.names
+        trackers = [(names.index("V"), ap_stats.OnlineAPD(p_repol))]
+        if "Cai" in names:
+            trackers.append((names.index("Cai"), ap_stats.OnlineAPD()))
+        dky = cvode.NVector(np.zeros(len(names)))
+        
+        def observe(t0, t1):
+            """Update statistics for a step, interpolating with GetDky."""
+            cache = {}
+            def interp(t, k):
+                """State or its derivative at time t within the step."""
+                if (t, k) not in cache:
+                    cvode.CVodeGetDky(self.cvode_mem, t, k, dky)
+                    cache[t, k] = np.array(dky)
+                return cache[t, k]
+            for i, tracker in trackers:
+                tracker.update(t0, t1, lambda t, k: interp(t, k)[i])
+        
+        # integrate over stimulus, then to the start of the next one, 
+        # re-initializing at the RHS discontinuity
+        result = [self.integrate(t=t, nrtfn=0, observe=observe, 
+            assert_flag=cvode.CV_TSTOP_RETURN, ignore_flags=ignore_flags)
+            for t in ([0, self.pr.stim_duration], 
+                [self.pr.stim_duration, self.pr.stim_period])]
+        t = np.r_[result[0][0][0], result[-1][0][-1]]
+        Y = np.concatenate([result[0][1][:1], result[-1][1][-1:]])
+        stats = trackers[0][1].stats()
+        if len(trackers) > 1:
+            sc = stats["caistats"] = trackers[1][1].stats()
+            # don't bother to report Ca decay rate for very small oscillations 
+            if (sc["amp"] / sc["peak"]) < 1e-3:
+                sc["decayrate"] = np.nan
+        return t, Y.view(np.recarray), stats
+    
     def aps(self, n=5, y=None, pr=None, *args, **kwargs):
         """
         Consecutive stimulus-induced action potentials using :meth:`ap`.
@@ -486,7 +565,19 @@ class Paceable(object):
         If state variables include *Cai*, the cycle is aligned so that the 
         highest Cai peak occurs in *steady[0]*.
         
-        If dynamics does not converge within *max_nap* intervals, *period* is zero.
+        If dynamics does not converge within *max_nap* intervals, *period* is zero
+        and *steady* holds the last *winwidth* intervals.
+        
+        Convergence is judged only by the state variables named in *reltol* 
+        (all of them if it is a scalar).
+        
+        While pacing, no trajectories are stored: the integrals are 
+        accumulated as CVODE steps (see :meth:`_beat_summary`), and only a 
+        summary of the last *winwidth* intervals is kept 
+        (see :class:`BeatSummaries`), so each new interval is compared with 
+        all of them at once. The trajectories in *steady* are recomputed from 
+        the stored initial state of the first interval returned, so memory 
+        use does not grow with the number of intervals or their length.
         
         To speed up the doctest, we use a precomputed approximate steady state.
         
@@ -506,39 +597,84 @@ class Paceable(object):
         't_repol': array([ 31.0...,  40.2...}, 'base': -83.60..., 
         'peak': 25.35..., 't_repol': array([  3.7...,   5.7...})
         """
-        d = deque(maxlen=winwidth)
-        for i, (ti, yi, statsi) in enumerate(self.aps(n=max_nap)):
-            # Converged if integral of specified state variables are 
-            # within tolerance of values stored in deque, i.e. at t-1, t-2, ...
-            # Trapezoidal integration of trajectories
-            inti = np.trapz(yi.view(float), ti, axis=0).view(yi.dtype)
-            for j, (_tj, yj, _statsj, intj) in enumerate(reversed(d)):
-                if (self.converged(inti, intj, reltol) and 
-                    self.converged(yi[0], yj[0], reltol)):
-                    period = j + 1
-                    steady = deque(d, maxlen=period)
-                    if "Cai" in self.dtype.y.names:
-                        # Ensure cycle starts with a high Cai peak
-                        n = np.argmax([max(y.Cai) 
-                            for _t, y, _stats, _int_ in steady])
-                        if n: # Highest Cai peak is not yet in position 0
-                            # Append the next interval, already computed
-                            steady.append((ti, yi, statsi, inti))
-                            # Compute the remaining n-1, if any
-                            for tk, yk, statsk in self.aps(n=n-1, y=yi[-1]):
-                                intk = np.trapz(yk.view(float), 
-                                    tk, axis=0).view(yk.dtype)
-                                steady.append((tk + ti[-1], yk, statsk, intk))
-                    t0 = steady[0][0][0]
-                    result = [(tk - t0, yk, statsk, intk) 
-                        for tk, yk, statsk, intk in steady]
-                    return (period, i), result
-            # Don't append until after we've compared against previous items
-            d.append((ti, yi, statsi, inti))
-        t0 = d[0][0][0]
-        result = [(tk - t0, yk, statsk, intk) for tk, yk, statsk, intk in d]
+        names = self.dtype.y.names
+        if np.isscalar(reltol):
+            reltol = dict((k, reltol) for k in names)
+        columns = [j for j, k in enumerate(names) if k in reltol]
+        if not columns:
+            raise ValueError("reltol names no state variables: %s" % reltol)
+        tol = np.array([reltol[names[j]] for j in columns])
+        icai = names.index("Cai") if "Cai" in names else None
+        history = BeatSummaries(winwidth, len(names))
+        period = 0
+        with self.autorestore():
+            for i in range(max_nap):
+                start, integral, caipeak = self._beat_summary(icai)
+                # Converged if the integral of each state variable and the 
+                # initial state are within tolerance of those of a previous 
+                # interval, i.e. at t-1, t-2, ...
+                period = history.match(start, integral, tol, columns)
+                if period:
+                    break
+                # Don't append until after we've compared against previous 
+                # items
+                history.append(start, integral, caipeak)
+        if period:
+            # Ensure cycle starts with a high Cai peak
+            n = np.argmax(history.caipeak[:period][::-1]) if (
+                icai is not None) else 0
+            return (period, i), self._replay(history.start[period - 1], 
+                period + n, period)
         # If we get here, convergence failed.
-        return (0, i), result  # pylint: disable=W0631
+        return (0, i), self._replay(  # pylint: disable=W0631
+            history.start[len(history) - 1], len(history), len(history))
+    
+    def _beat_summary(self, icai=None):
+        """
+        Pace one interval from the current state, summarizing it on the way.
+        
+        Return the initial state, the integral of each state variable, and 
+        the peak of state variable number *icai* (0 if *icai* is None). 
+        The trapezoidal integral over CVODE's internal steps and the peak at 
+        the step ends are accumulated after each step 
+        (see *observe* in :meth:`~cgp.cvodeint.core.Cvodeint.integrate`), 
+        so the trajectory is never stored.
+        """
+        start = np.array(self.y)
+        integral = np.zeros(len(start))
+        last = [start]  # state at the end of the previous step
+        peak = [start[icai] if icai is not None else 0.0]
+        
+        def observe(t0, t1):
+            """Add the trapezoid of one step to the integral."""
+            y1 = np.array(self.y)
+            integral[:] += 0.5 * (t1 - t0) * (last[0] + y1)
+            last[0] = y1
+            if icai is not None:
+                peak[0] = max(peak[0], y1[icai])
+        
+        # integrate over stimulus, then to the start of the next one, 
+        # re-initializing at the RHS discontinuity, as in ap()
+        for t in ([0, self.pr.stim_duration], 
+            [self.pr.stim_duration, self.pr.stim_period]):
+            self.integrate(t=t, nrtfn=0, observe=observe, 
+                assert_flag=cvode.CV_TSTOP_RETURN)
+        return start, integral, peak[0]
+    
+    def _replay(self, y, n, keep):
+        """
+        Rerun *n* intervals from state *y*, return the last *keep* of them.
+        
+        The result is a list of *(t, y, stats, int_)* as for :meth:`steady`, 
+        with time starting at zero in the first interval returned.
+        """
+        result = []
+        for tk, yk, statsk in list(self.aps(n=n, y=y))[-keep:]:
+            intk = trapz_weights(tk).dot(yk.view(float).reshape(len(tk), -1))
+            result.append((tk, yk, statsk, intk.view(yk.dtype)))
+        t0 = result[0][0][0]
+        return [(tk - t0, yk, statsk, intk) 
+            for tk, yk, statsk, intk in result]
     
     def restitution_portrait(self, BCL0=1000, delta=50, Delta=100, 
         tburnin=60000, nbetween=10, p_repol=0.70, *args, **kwargs):
@@ -634,6 +770,113 @@ class Paceable(object):
             if BCL0 <= self.pr.stim_duration:
                 break # while
 
+class BeatSummaries(object):
+    """
+    Ring buffer of summaries of the last *size* intervals of a pacing run.
+    
+    Each summary holds the initial state, the integral of each state 
+    variable, and the peak Cai of an interval. Indexing the arrays 
+    *start*, *integral* and *caipeak* with 0 gives the most recent interval, 
+    1 the one before, and so on.
+    
+    >>> b = BeatSummaries(size=2, n=3)
+    >>> for k in range(3):
+    ...     b.append(start=[k, 1, 1], integral=[k, 2, 2], caipeak=k)
+    >>> len(b), b.start[:, 0], b.caipeak
+    (2, array([ 2.,  1.]), array([ 2.,  1.]))
+    
+    :meth:`match` compares a new interval with all stored ones at once.
+    
+    >>> b.match([1.0001, 1, 1], [1.0001, 2, 2], tol=0.001)
+    2
+    >>> b.match([1.01, 1, 1], [1.0001, 2, 2], tol=0.001)
+    0
+    
+    Only the state variables in *columns* are compared, if given.
+    
+    >>> b.match([1.01, 1, 1], [1.0001, 2, 2], tol=0.001, columns=[1, 2])
+    1
+    """
+    
+    def __init__(self, size, n):
+        self.size = size
+        self.count = 0
+        self._start = np.zeros((size, n))
+        self._integral = np.zeros((size, n))
+        self._caipeak = np.zeros(size)
+    
+    def __len__(self):
+        return min(self.count, self.size)
+    
+    def _order(self):
+        """Ring buffer indices of stored intervals, most recent first."""
+        return (self.count - 1 - np.arange(len(self))) % self.size
+    
+    @property
+    def start(self):
+        """Initial states, most recent first."""
+        return self._start[self._order()]
+    
+    @property
+    def integral(self):
+        """Integrals of state variables, most recent first."""
+        return self._integral[self._order()]
+    
+    @property
+    def caipeak(self):
+        """Peak Cai, most recent first."""
+        return self._caipeak[self._order()]
+    
+    def append(self, start, integral, caipeak=0):
+        """Store the summary of a new interval, replacing the oldest."""
+        i = self.count % self.size
+        self._start[i] = start
+        self._integral[i] = integral
+        self._caipeak[i] = caipeak
+        self.count += 1
+    
+    def match(self, start, integral, tol, columns=None):
+        """
+        Lag of the most recent interval that matches within tolerance, or 0.
+        
+        Initial states and integrals must all match within relative 
+        tolerance *tol* (a scalar or one value per compared state variable) 
+        of those of the new interval. If *columns* is given, only those 
+        state variables are compared.
+        """
+        start, integral = np.asarray(start), np.asarray(integral)
+        old_start, old_integral = self.start, self.integral
+        if columns is not None:
+            start, integral = start[columns], integral[columns]
+            old_start = old_start[:, columns]
+            old_integral = old_integral[:, columns]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ok = ((abs((old_start - start) / start) < tol).all(axis=1) & 
+                (abs((old_integral - integral) / integral) < tol).all(axis=1))
+        return int(np.argmax(ok)) + 1 if ok.any() else 0
+
+def trapz_weights(t):
+    """
+    Weights for trapezoidal integration over *t*.
+    
+    ``trapz_weights(t).dot(y)`` equals ``np.trapz(y, t, axis=0)`` but 
+    computes all columns of *y* in one pass, without temporary arrays 
+    the size of *y*.
+    
+    >>> t = np.array([0, 1, 3.0])
+    >>> y = np.array([[1, 2], [3, 4], [5, 6.0]])
+    >>> trapz_weights(t)
+    array([ 0.5,  1.5,  1. ])
+    >>> trapz_weights(t).dot(y), np.trapz(y, t, axis=0)
+    (array([ 10.,  13.]), array([ 10.,  13.]))
+    """
+    t = np.asarray(t, dtype=float)
+    w = np.zeros(len(t))
+    dt = 0.5 * np.diff(t)
+    w[:-1] += dt
+    w[1:] += dt
+    return w
+
 # Convert between local time, starting at 0 in each interval, and global time.
 
 def globaltime(T):
@@ -699,19 +942,20 @@ def ap_stats_array(stats):
     ('ctbase', '<f8'), ('ctpeak', '<f8'), ('ctttp', '<f8'), 
     ('ctdecayrate', '<f8'), ('ctd25', '<f8'), ('ctd50', '<f8'), 
     ('ctd75', '<f8'), ('ctd90', '<f8')])
+    
+    To compute statistics for many beats in one call, see 
+    :func:`~cgp.virtexp.elphys.ap_stats.apd_many`.
     """
     names = "amp base peak ttp decayrate".split()
-    n = len(names)
-    names += ["d%d" % (100 * i) for i in stats["p_repol"]]
     if "caistats" in stats:
-        dtype = [(var + name, float) for var in "ap", "ct" for name in names]
-        data = np.r_[[float(stats[k]) for k in names[:n]],
+        dtype = ap_stats.ap_stats_dtype(stats["p_repol"], ("ap", "ct"))
+        data = np.r_[[float(stats[k]) for k in names],
                      stats["t_repol"],
-                     [float(stats["caistats"][k]) for k in names[:n]],
+                     [float(stats["caistats"][k]) for k in names],
                      stats["caistats"]["t_repol"]]
     else:
-        dtype = [("ap" + name, float) for name in names]
-        data = np.r_[[float(stats[k]) for k in names[:n]], stats["t_repol"]]
+        dtype = ap_stats.ap_stats_dtype(stats["p_repol"])
+        data = np.r_[[float(stats[k]) for k in names], stats["t_repol"]]
     return np.rec.array(data, dtype=dtype)
 
 if __name__ == "__main__":
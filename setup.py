@@ -13,7 +13,8 @@ if __name__ == "__main__":
         url='http://arken.umb.no/~jonvi/cgptoolbox/',
         download_url='https://github.com/jonovik/cgptoolbox',
         packages = find_packages(),
-        package_data={"cgp.physmod": ["_cellml/*"]},
+        package_data={"cgp.physmod": ["_cellml/*"], 
+            "cgp.cvodeint": ["_stepper.pyx", "_stepper.pyxbld"]},
         install_requires=[
             "numpy", 
             "scipy", 